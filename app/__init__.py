@@ -1,16 +1,38 @@
 from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_bcrypt import Bcrypt
 from flask_jwt_extended import JWTManager
 import logging
-from sqlalchemy import inspect, text as db_text
+from app.cache import URLCache, UserCache
+from app.clicks import ClickBuffer
+from app.codes import CodeAllocator
+from app.analytics import ClickAnalytics
+from app.passwords import PasswordHasher
+from app.metrics import RequestMetrics
+from app.bloom import ShortCodeFilter
+from app.ratelimit import RateLimiter
+from app.pool import build_engine_options, enable_sqlite_foreign_keys
+from app.replication import ReplicaRouter, RoutingSession
+from app.snapshot import RedirectSnapshot
 
 # Initialize extensions
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 migrate = Migrate()
 bcrypt = Bcrypt()
 jwt = JWTManager()
+url_cache = URLCache()
+user_cache = UserCache()
+click_buffer = ClickBuffer()
+code_allocator = CodeAllocator()
+click_analytics = ClickAnalytics()
+password_hasher = PasswordHasher()
+request_metrics = RequestMetrics()
+short_code_filter = ShortCodeFilter()
+rate_limiter = RateLimiter()
+replicas = ReplicaRouter()
+redirect_snapshot = RedirectSnapshot()
 
 def create_app(config_class='config.Config'):
     app = Flask(__name__)
@@ -22,92 +44,73 @@ def create_app(config_class='config.Config'):
     if not app.config.get('SQLALCHEMY_DATABASE_URI'):
         raise RuntimeError("Database URI not configured!")
 
-    # Configure logging
+    # Behind trusted proxies, remote_addr is the client's address taken from
+    # X-Forwarded-For rather than the nearest proxy's
+    if app.config.get('PROXY_FIX_X_FOR'):
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
+
+    # Configure logging. SQL statement logging is opt-in via SQLALCHEMY_ECHO
     logging.basicConfig(level=logging.INFO)
-    logger = logging.getLogger(__name__)
-    
-    # Enable SQLAlchemy logging
-    logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO)
+
+    # Pool settings must be in place before the engine is created
+    engine_options = build_engine_options(app.config)
+    engine_options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
 
     # 2. Initialize extensions
+    from app.serializers import init_serializers
+    init_serializers(app)
     db.init_app(app)
+    with app.app_context():
+        enable_sqlite_foreign_keys(db.engine)
+    replicas.init_app(app)
     migrate.init_app(app, db)
     bcrypt.init_app(app)
     jwt.init_app(app)
+    url_cache.init_app(app)
+    user_cache.init_app(app)
+    click_buffer.init_app(app)
+    code_allocator.init_app(app)
+    click_analytics.init_app(app)
+    password_hasher.init_app(app)
+    short_code_filter.init_app(app)
+    rate_limiter.init_app(app)
+    redirect_snapshot.init_app(app)
+    if app.config.get('METRICS_ENABLED', True):
+        request_metrics.init_app(app)
 
-    # Import models after db initialization
-    from app.models import User, ShortURL
-
-    with app.app_context():
-        # 3. Verify and create tables
-        inspector = inspect(db.engine)
-        required_tables = {'user', 'short_url'}
-        existing_tables = set(inspector.get_table_names())
-        
-        if not required_tables.issubset(existing_tables):
-            logger.info("🛠 Creating database tables...")
-            try:
-                db.create_all()
-                
-                # Verify creation
-                created_tables = set(inspect(db.engine).get_table_names())
-                missing_tables = required_tables - created_tables
-                if missing_tables:
-                    logger.error(f"❌ Missing tables: {missing_tables}")
-                    # Try creating tables individually
-                    if 'user' in missing_tables:
-                        User.__table__.create(db.engine)
-                    if 'short_url' in missing_tables:
-                        ShortURL.__table__.create(db.engine)
-                    
-                    # Re-check
-                    created_tables = set(inspect(db.engine).get_table_names())
-                    missing_tables = required_tables - created_tables
-                    if missing_tables:
-                        raise RuntimeError(f"Failed to create tables: {missing_tables}")
-                
-                logger.info("✅ Tables created successfully")
-            except Exception as e:
-                logger.error(f"❌ Table creation failed: {str(e)}")
-                raise RuntimeError(f"Database setup failed: {str(e)}") from e
-        else:
-            logger.info("✅ Database tables already exist")
-
-        # 4. Test connection
-        try:
-            with db.engine.connect() as conn:
-                result = conn.execute(db_text("SELECT 1"))
-                if result.scalar() == 1:
-                    logger.info("✅ Database connection successful!")
-                else:
-                    raise RuntimeError("Database test query failed")
-        except Exception as e:
-            logger.error(f"❌ Database connection failed: {str(e)}")
-            raise
+    # Import models after db initialization. Schema management and
+    # connectivity checks are explicit steps (`flask db upgrade`,
+    # `flask init-db`, GET /healthz) so worker boot never touches the database
+    from app.models import User, ShortURL, Tag, LinkTag, CodeSequence, ClickEvent, ClickStatMinute, ClickStatDay
+    # Full-text tables and indexes are attached to short_url for create_all
+    from app import search
 
-    # 5. Initialize OAuth
+    # 3. Initialize OAuth
     from app.oauth import init_oauth
     init_oauth(app)
     
-    # 6. Register blueprints
+    # 4. Register blueprints. The short_code converter must exist first
+    from app.redirects import init_redirects, redirects_bp
+    init_redirects(app)
+
     from app.routes import bp as main_bp
     app.register_blueprint(main_bp, url_prefix='/api')
     
     from app.auth import auth_bp
     app.register_blueprint(auth_bp, url_prefix='/auth')
     
-    # 7. Error handlers
+    from app.health import health_bp
+    app.register_blueprint(health_bp)
+
+    # Public short links at the root; static routes above take precedence
+    app.register_blueprint(redirects_bp)
+    
+    # 5. Error handlers and CLI commands
     from app.errors import register_error_handlers
     register_error_handlers(app)
     
-    # 8. Production settings
-    if not app.debug:
-        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
-            'pool_pre_ping': True,
-            'pool_recycle': 3600,
-            'pool_timeout': 30,
-            'max_overflow': 20,
-            'pool_size': 10
-        }
-
+    from app.cli import register_commands
+    register_commands(app)
+    
     return app
\ No newline at end of file
@@ -0,0 +1,249 @@
+import atexit
+import logging
+import queue
+import re
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import urlparse
+
+from sqlalchemy import insert, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.utils import client_ip
+
+try:
+    import geoip2.database
+    import geoip2.errors
+except ImportError:  # optional dependency
+    geoip2 = None
+
+logger = logging.getLogger(__name__)
+
+# Checked in order, first match wins
+USER_AGENT_FAMILIES = [
+    ('Bot', re.compile(r'bot|crawl|spider|slurp|preview', re.I)),
+    ('Edge', re.compile(r'Edg(e|A|iOS)?/')),
+    ('Opera', re.compile(r'OPR/|Opera')),
+    ('Chrome', re.compile(r'Chrome/|CriOS/')),
+    ('Firefox', re.compile(r'Firefox/|FxiOS/')),
+    ('Safari', re.compile(r'Safari/')),
+    ('curl', re.compile(r'^curl/')),
+]
+
+
+def user_agent_family(user_agent):
+    if not user_agent:
+        return 'Unknown'
+    for family, pattern in USER_AGENT_FAMILIES:
+        if pattern.search(user_agent):
+            return family
+    return 'Other'
+
+
+def referrer_host(referrer):
+    if not referrer:
+        return None
+    try:
+        return (urlparse(referrer).hostname or '')[:255] or None
+    except ValueError:
+        return None
+
+
+class ClickAnalytics:
+    """Queue click events off the redirect path and write them in batches
+
+    The redirect only enqueues a raw tuple. A background writer parses the
+    user agent and referrer, resolves the country, batch-inserts the events
+    into click_event and adds them to the per-minute and per-day rollups.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.engine = None
+        self.enabled = True
+        self.batch_size = 500
+        self.flush_interval = 2.0
+        self.geoip = None
+        self._queue = queue.Queue(maxsize=10000)
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self.enqueued = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+
+    def init_app(self, app):
+        self.app = app
+        self._configure(app.config)
+        app.extensions['click_analytics'] = self
+        atexit.register(self.shutdown)
+
+    def init_engine(self, engine, config):
+        """Write through a plain engine, for processes without a Flask app"""
+        self.engine = engine
+        self._configure(config)
+        atexit.register(self.shutdown)
+
+    def _configure(self, config):
+        self.enabled = config.get('ANALYTICS_ENABLED', True)
+        self.batch_size = config.get('ANALYTICS_BATCH_SIZE', 500)
+        self.flush_interval = config.get('ANALYTICS_FLUSH_INTERVAL', 2.0)
+        self._queue = queue.Queue(maxsize=config.get('ANALYTICS_QUEUE_SIZE', 10000))
+        self.geoip = None
+        geoip_path = config.get('GEOIP_DB_PATH')
+        if geoip_path and geoip2 is not None:
+            try:
+                self.geoip = geoip2.database.Reader(geoip_path)
+            except (OSError, ValueError) as e:
+                logger.warning(f"GeoIP database not loaded: {str(e)}")
+
+    def record(self, short_code, request):
+        """Enqueue a click from the current request; drops it if the queue is full"""
+        if not self.enabled:
+            return
+        self.enqueue(short_code, request.referrer, request.headers.get('User-Agent'), client_ip())
+
+    def enqueue(self, short_code, referrer, user_agent, ip):
+        if not self.enabled:
+            return
+        event = (datetime.utcnow(), short_code, referrer, user_agent, ip)
+        try:
+            self._queue.put_nowait(event)
+            self.enqueued += 1
+        except queue.Full:
+            self.dropped += 1
+        self._ensure_thread()
+        if self._queue.qsize() >= self.batch_size:
+            self._wake.set()
+
+    def flush(self):
+        """Write everything currently queued"""
+        written = 0
+        while True:
+            batch = self._drain()
+            if not batch:
+                return written
+            written += self._write(batch)
+
+    def stats(self):
+        return {
+            'enqueued': self.enqueued,
+            'dropped': self.dropped,
+            'written': self.written,
+            'failed': self.failed,
+            'queued': self._queue.qsize()
+        }
+
+    def shutdown(self):
+        self._stop.set()
+        self._wake.set()
+        if self.app is not None or self.engine is not None:
+            self.flush()
+
+    def _country(self, ip):
+        if self.geoip is None or not ip:
+            return None
+        try:
+            return self.geoip.country(ip).country.iso_code
+        except (geoip2.errors.AddressNotFoundError, ValueError):
+            return None
+
+    def _drain(self):
+        batch = []
+        try:
+            while len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _write(self, batch):
+        from app.models import ClickEvent, ClickStatMinute, ClickStatDay
+
+        rows = []
+        per_minute = Counter()
+        per_day = Counter()
+        for occurred_at, short_code, referrer, user_agent, ip in batch:
+            rows.append({
+                'occurred_at': occurred_at,
+                'short_code': short_code,
+                'referrer_host': referrer_host(referrer),
+                'user_agent_family': user_agent_family(user_agent),
+                'country': self._country(ip)
+            })
+            per_minute[(short_code, occurred_at.replace(second=0, microsecond=0))] += 1
+            per_day[(short_code, occurred_at.date())] += 1
+
+        try:
+            with self._write_lock, self._begin() as conn:
+                conn.execute(insert(ClickEvent.__table__), rows)
+                _add_counts(conn, ClickStatMinute.__table__, 'bucket', per_minute)
+                _add_counts(conn, ClickStatDay.__table__, 'day', per_day)
+        except Exception as e:
+            self.failed += len(batch)
+            logger.error(f"Writing {len(batch)} click events failed: {str(e)}")
+            return 0
+
+        self.written += len(batch)
+        return len(batch)
+
+    @contextmanager
+    def _begin(self):
+        if self.engine is not None:
+            with self.engine.begin() as conn:
+                yield conn
+            return
+        from app import db
+        with self.app.app_context(), db.engine.begin() as conn:
+            yield conn
+
+    def _ensure_thread(self):
+        # Started lazily so that no thread exists before a server forks workers
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='click-analytics-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        # Sleep between flushes rather than blocking on the queue, so that a
+        # busy redirect path does not wake the writer once per click
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+
+def _add_counts(conn, table, key_column, counts):
+    """Add click counts to a rollup table, creating missing buckets"""
+    params = [
+        {'short_code': short_code, key_column: key, 'clicks': clicks}
+        for (short_code, key), clicks in counts.items()
+    ]
+    if conn.dialect.name in ('postgresql', 'sqlite'):
+        dialect_insert = pg_insert if conn.dialect.name == 'postgresql' else sqlite_insert
+        stmt = dialect_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['short_code', key_column],
+            set_={'clicks': table.c.clicks + stmt.excluded.clicks})
+        conn.execute(stmt, params)
+        return
+
+    for row in params:
+        result = conn.execute(
+            update(table)
+            .where(table.c.short_code == row['short_code'],
+                   table.c[key_column] == row[key_column])
+            .values(clicks=table.c.clicks + row['clicks']))
+        if result.rowcount == 0:
+            conn.execute(insert(table).values(**row))
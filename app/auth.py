@@ -1,8 +1,10 @@
 # auth.py
 from flask import Blueprint, request, jsonify, url_for, session
 from app.models import User
-from app import db, bcrypt, jwt
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from app import db, jwt, user_cache, rate_limiter
+from app.cache import MISSING
+from app.passwords import HasherBusy
+from flask_jwt_extended import create_access_token, jwt_required, get_current_user as current_profile
 from datetime import timedelta
 from app.utils import error_response
 from authlib.integrations.flask_client import OAuth
@@ -10,7 +12,29 @@ from app.oauth import oauth, handle_google_auth
 
 auth_bp = Blueprint('auth', __name__)
 
+@jwt.user_lookup_loader
+def load_user(_jwt_header, jwt_data):
+    """Resolve the token identity to a profile dict, cached for USER_CACHE_TTL"""
+    user_id = jwt_data['sub']
+
+    def load():
+        user = db.session.get(User, user_id)
+        return user.to_dict() if user else MISSING
+
+    profile = user_cache.get_or_load(str(user_id), load)
+    return None if profile is MISSING else profile
+
+@jwt.user_lookup_error_loader
+def user_lookup_error(_jwt_header, jwt_data):
+    return error_response(404, 'User not found')
+
+def busy_response():
+    response, status = error_response(503, 'Too many login attempts in progress, please retry')
+    response.headers['Retry-After'] = '1'
+    return response, status
+
 @auth_bp.route('/register', methods=['POST'])
+@rate_limiter.limit('register')
 def register():
     data = request.get_json()
     
@@ -30,7 +54,10 @@ def register():
         username=username,
         email=data['email']
     )
-    user.set_password(data['password'])
+    try:
+        user.set_password(data['password'])
+    except HasherBusy:
+        return busy_response()
     
     try:
         db.session.add(user)
@@ -50,6 +77,7 @@ def register():
         return error_response(500, f'Error creating user: {str(e)}')
 
 @auth_bp.route('/login', methods=['POST'])
+@rate_limiter.limit('login')
 def login():
     data = request.get_json()
     
@@ -58,8 +86,15 @@ def login():
     
     user = User.query.filter_by(email=data['email']).first()
     
-    if not user or not user.check_password(data['password']):
-        return error_response(401, 'Invalid email or password')
+    try:
+        if not user or not user.check_password(data['password']):
+            return error_response(401, 'Invalid email or password')
+    except HasherBusy:
+        return busy_response()
+    
+    if db.session.is_modified(user):
+        # check_password upgraded the hash to the current work factor
+        db.session.commit()
     
     access_token = create_access_token(
         identity=user.id,
@@ -99,25 +134,13 @@ def google_callback():
 @jwt_required()
 def protected():
     """Example protected endpoint"""
-    current_user_id = get_jwt_identity()
-    user = User.query.get(current_user_id)
-    
-    if not user:
-        return error_response(404, 'User not found')
-    
     return jsonify({
         'message': 'This is a protected route',
-        'user': user.to_dict()
+        'user': current_profile()
     })
 
 @auth_bp.route('/me', methods=['GET'])
 @jwt_required()
 def get_current_user():
     """Get current user's profile"""
-    current_user_id = get_jwt_identity()
-    user = User.query.get(current_user_id)
-    
-    if not user:
-        return error_response(404, 'User not found')
-    
-    return jsonify(user.to_dict())
\ No newline at end of file
+    return jsonify(current_profile())
\ No newline at end of file
@@ -0,0 +1,449 @@
+import fcntl
+import hashlib
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import func, select
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over any writable buffer (bytearray or mmap)"""
+
+    def __init__(self, num_bits, num_hashes, buffer=None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = memoryview(buffer if buffer is not None else bytearray((num_bits + 7) // 8))
+        self.count = 0
+
+    @classmethod
+    def for_capacity(cls, capacity, error_rate):
+        num_bits, num_hashes = cls.dimensions(capacity, error_rate)
+        return cls(num_bits, num_hashes)
+
+    @staticmethod
+    def dimensions(capacity, error_rate):
+        """Optimal (bits, hashes) for capacity items at the given false-positive rate"""
+        capacity = max(1, capacity)
+        num_bits = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        return num_bits, num_hashes
+
+    def _hashes(self, key):
+        # Double hashing: position i is h1 + i * h2, from one 128-bit digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+    def add(self, key):
+        h1, h2 = self._hashes(key)
+        bits, num_bits = self.bits, self.num_bits
+        for i in range(self.num_hashes):
+            position = (h1 + i * h2) % num_bits
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        h1, h2 = self._hashes(key)
+        bits, num_bits = self.bits, self.num_bits
+        for i in range(self.num_hashes):
+            position = (h1 + i * h2) % num_bits
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    @property
+    def size_bytes(self):
+        return len(self.bits)
+
+    def fill_ratio(self):
+        return int.from_bytes(self.bits, 'little').bit_count() / self.num_bits
+
+    def false_positive_rate(self):
+        """Estimated from the fraction of bits set, so it accounts for stale deletes"""
+        return self.fill_ratio() ** self.num_hashes
+
+
+# Shared filter file: magic, num_bits, num_hashes, refreshed_at
+HEADER = struct.Struct('<8sQId')
+MAGIC = b'SCBLOOM2'
+
+
+class ShortCodeFilter:
+    """Bloom filter of every existing short code, for rejecting probes without a query
+
+    A background thread builds the filter from a streamed scan of
+    short_url.short_code, then polls for rows whose updated_at is at most
+    BLOOM_FILTER_MARGIN seconds older than the start of the previous poll,
+    and rebuilds from scratch every BLOOM_FILTER_REBUILD_INTERVAL to drop
+    deleted codes. updated_at is stamped before the insert commits, so the
+    margin must be longer than the slowest insert transaction (and the
+    clock skew between hosts); rows that commit within it are never missed.
+
+    Codes created in this process are added immediately and, with
+    CACHE_BACKEND, published on <CACHE_KEY_PREFIX>short_codes:created so
+    every other worker adds them too. With BLOOM_FILTER_PATH the filter
+    lives in a memory-mapped file shared by every worker on the host;
+    whichever worker holds the leader lock maintains it.
+
+    The filter fails open. Until it is built, when it has not been
+    refreshed for three intervals, or when it cannot have heard of every
+    code created since its last refresh began (no CACHE_BACKEND, unless
+    BLOOM_FILTER_SINGLE_HOST says the shared file reaches every worker, or
+    the subscription dropped), a code it has not seen might still exist
+    and is looked up in the database.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.engine = None
+        self.enabled = False
+        self.capacity = 1000000
+        self.error_rate = 0.001
+        self.refresh_interval = 2.0
+        self.rebuild_interval = 3600
+        self.margin = 60.0
+        self.path = None
+        self.single_host = False
+        self.backend = None
+        self.channel = None
+        self._filter = None
+        self._mmap = None
+        self._inode = None
+        self._refreshed_at = 0.0
+        self._built_at = 0.0
+        self._leader_fd = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        # Codes added or heard about within the margin, replayed into a rebuilt filter
+        self._recent = deque()
+        self._listening_since = None
+        self._publish_retry_at = 0.0
+        self.rejected = 0
+        self.passed = 0
+        self.uncertain = 0
+        self.builds = 0
+
+    def init_app(self, app):
+        self.app = app
+        self._configure(app.config)
+        app.extensions['short_code_filter'] = self
+
+    def init_engine(self, engine, config):
+        """Query through a plain engine, for processes without a Flask app"""
+        self.engine = engine
+        self._configure(config)
+
+    def _configure(self, config):
+        from app.cache_backends import get_backend
+
+        self.enabled = config.get('BLOOM_FILTER_ENABLED', False)
+        self.capacity = config.get('BLOOM_FILTER_CAPACITY', 1000000)
+        self.error_rate = config.get('BLOOM_FILTER_ERROR_RATE', 0.001)
+        self.refresh_interval = config.get('BLOOM_FILTER_REFRESH_INTERVAL', 2.0)
+        self.rebuild_interval = config.get('BLOOM_FILTER_REBUILD_INTERVAL', 3600)
+        self.margin = config.get('BLOOM_FILTER_MARGIN', 60.0)
+        self.path = config.get('BLOOM_FILTER_PATH') or None
+        self.single_host = config.get('BLOOM_FILTER_SINGLE_HOST', False)
+        if self.backend is not None:
+            self.backend.unsubscribe(self.channel, self._on_message)
+        self.backend = self._listening_since = None
+        if not self.enabled:
+            return
+        self.backend = get_backend(config.get('CACHE_BACKEND'), config.get('CACHE_SOCKET_TIMEOUT', 0.25))
+        self.channel = f"{config.get('CACHE_KEY_PREFIX', 'shortener:')}short_codes:created"
+        if self.backend is not None:
+            self.backend.subscribe(self.channel, self._on_message)
+        elif self.path is None or not self.single_host:
+            logger.warning("BLOOM_FILTER_ENABLED without CACHE_BACKEND (or BLOOM_FILTER_PATH with "
+                           "BLOOM_FILTER_SINGLE_HOST): codes created by other workers are not "
+                           "heard of, so every code the filter has not seen is still looked up")
+
+    def might_exist(self, short_code):
+        """False only when short_code is certainly not in short_url"""
+        if not self.enabled:
+            return True
+        self._ensure_thread()
+        bloom = self._filter
+        last_refresh = self._last_refresh()
+        if bloom is None or time.time() - last_refresh > 3 * self.refresh_interval:
+            return True
+        if short_code in bloom:
+            self.passed += 1
+            return True
+        if not self._hears_new_codes(last_refresh):
+            # It may have been created elsewhere since the refresh began
+            self.uncertain += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def add(self, short_code):
+        """Record a code created by this process"""
+        self.add_many([short_code])
+
+    def add_many(self, short_codes):
+        """Record codes created by this process and tell the other workers"""
+        if not self.enabled or not short_codes:
+            return
+        self._remember(short_codes)
+        if self.backend is not None:
+            self._publish(short_codes)
+
+    def _remember(self, short_codes):
+        now = time.time()
+        with self._writing():
+            bloom = self._filter
+            for short_code in short_codes:
+                self._recent.append((now, short_code))
+                if bloom is not None and short_code not in bloom:
+                    bloom.add(short_code)
+
+    def _hears_new_codes(self, last_refresh):
+        """True if every code created since the last refresh began has reached this filter"""
+        if self.backend is None:
+            # Workers on this host write to the shared file directly; only
+            # the deployment knows there are no workers on other hosts
+            return self.path is not None and self.single_host
+        return (self.backend.connected and self._listening_since is not None
+                and self._listening_since <= last_refresh)
+
+    # New codes from other workers
+
+    def _origin(self):
+        return f'{os.getpid()}:{id(self)}'
+
+    def _publish(self, short_codes):
+        if self._publish_retry_at and time.monotonic() < self._publish_retry_at:
+            return
+        try:
+            self.backend.ensure_listening()
+            self.backend.publish(self.channel, json.dumps(
+                {'origin': self._origin(), 'codes': list(short_codes)}))
+        except Exception as e:
+            self._publish_retry_at = time.monotonic() + 1.0
+            logger.warning(f"Could not publish new short codes: {str(e)}")
+
+    def _on_message(self, message):
+        if message is None:
+            # (Re)subscribed: codes published before this moment may have been missed
+            self._listening_since = time.time()
+            return
+        try:
+            payload = json.loads(message)
+        except ValueError:
+            return
+        if payload.get('origin') != self._origin():
+            self._remember(payload.get('codes', ()))
+
+    def stats(self):
+        bloom = self._filter
+        if bloom is None:
+            return {'enabled': self.enabled, 'ready': False, 'rejected': self.rejected,
+                    'passed': self.passed, 'uncertain': self.uncertain}
+        return {
+            'enabled': self.enabled,
+            'ready': True,
+            'shared': self.path is not None,
+            'size_bytes': bloom.size_bytes,
+            'num_bits': bloom.num_bits,
+            'num_hashes': bloom.num_hashes,
+            'added': bloom.count if self.path is None else None,
+            'false_positive_rate': bloom.false_positive_rate(),
+            'rejected': self.rejected,
+            'passed': self.passed,
+            'uncertain': self.uncertain,
+            'hears_new_codes': self._hears_new_codes(self._last_refresh()),
+            'builds': self.builds,
+            'age_seconds': time.time() - self._built_at if self._built_at else None
+        }
+
+    # Database access
+
+    @contextmanager
+    def _connect(self):
+        if self.engine is not None:
+            with self.engine.connect() as conn:
+                yield conn
+            return
+        from app import db
+        with self.app.app_context(), db.engine.connect() as conn:
+            yield conn
+
+    def _scan(self, conn, since=None):
+        """Stream short codes, all of them or those updated at or after since (a Unix time)"""
+        from app.models import ShortURL
+
+        table = ShortURL.__table__
+        stmt = select(table.c.short_code)
+        if since is not None:
+            # Naive UTC, like the column's default
+            stmt = stmt.where(table.c.updated_at >= datetime.utcfromtimestamp(since))
+        return conn.execution_options(stream_results=True, yield_per=10000).scalars(stmt)
+
+    def build(self):
+        """Size a new filter from the row count and fill it with every code"""
+        from app.models import ShortURL
+
+        started = time.time()
+        with self._connect() as conn:
+            rows = conn.execute(select(func.count()).select_from(ShortURL.__table__)).scalar()
+            num_bits, num_hashes = BloomFilter.dimensions(
+                max(self.capacity, 2 * rows), self.error_rate)
+            bloom, mapping = self._allocate(num_bits, num_hashes)
+            for short_code in self._scan(conn):
+                bloom.add(short_code)
+
+        self._install(bloom, mapping, started)
+        self.builds += 1
+        logger.info(f"Short code filter built: {bloom.count} codes, "
+                    f"{bloom.size_bytes / 1048576:.1f} MiB, {num_hashes} hashes "
+                    f"in {time.time() - started:.2f}s")
+
+    def refresh(self):
+        """Add codes committed since the previous refresh began"""
+        started = time.time()
+        with self._connect() as conn:
+            codes = list(self._scan(conn, self._refreshed_at - self.margin))
+        with self._writing():
+            bloom = self._filter
+            for short_code in codes:
+                if short_code not in bloom:
+                    bloom.add(short_code)
+        self._set_refreshed(started)
+
+    # Storage: a private bytearray, or a file shared by the host's workers
+
+    def _allocate(self, num_bits, num_hashes):
+        if self.path is None:
+            return BloomFilter(num_bits, num_hashes), None
+        size = HEADER.size + (num_bits + 7) // 8
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w+b') as f:
+            f.truncate(size)
+            mapping = mmap.mmap(f.fileno(), size)
+        HEADER.pack_into(mapping, 0, MAGIC, num_bits, num_hashes, 0.0)
+        return BloomFilter(num_bits, num_hashes, memoryview(mapping)[HEADER.size:]), (mapping, tmp_path)
+
+    def _install(self, bloom, mapping, started):
+        with self._writing():
+            # Codes created while the scan ran may have committed after it read the table
+            for _, short_code in self._recent:
+                bloom.add(short_code)
+            if mapping is not None:
+                mapping, tmp_path = mapping
+                HEADER.pack_into(mapping, 0, MAGIC, bloom.num_bits, bloom.num_hashes, started)
+                mapping.flush()
+                os.replace(tmp_path, self.path)
+                self._mmap, self._inode = mapping, os.stat(self.path).st_ino
+            self._filter = bloom
+        self._refreshed_at = self._built_at = started
+
+    def _set_refreshed(self, when):
+        self._refreshed_at = when
+        if self._mmap is not None:
+            struct.pack_into('<d', self._mmap, HEADER.size - 8, when)
+
+    def _last_refresh(self):
+        if self._mmap is not None:
+            return HEADER.unpack_from(self._mmap, 0)[3]
+        return self._refreshed_at
+
+    def _attach(self):
+        """Map the shared file if another worker has replaced it"""
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return
+        if inode == self._inode:
+            return
+        with open(self.path, 'r+b') as f:
+            mapping = mmap.mmap(f.fileno(), 0)
+        magic, num_bits, num_hashes, refreshed_at = HEADER.unpack_from(mapping, 0)
+        if magic != MAGIC:
+            return
+        bloom = BloomFilter(num_bits, num_hashes, memoryview(mapping)[HEADER.size:])
+        with self._writing():
+            # The leader rebuilt it; codes this worker created meanwhile may be missing
+            for _, short_code in self._recent:
+                bloom.add(short_code)
+            self._mmap, self._inode, self._filter = mapping, inode, bloom
+        self._built_at = refreshed_at
+
+    @contextmanager
+    def _writing(self):
+        # Setting a bit is a read-modify-write of a byte that other threads,
+        # and with a shared file other workers, may be updating too
+        with self._write_lock:
+            if self.path is None:
+                yield
+                return
+            with open(f'{self.path}.lock', 'a') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _is_leader(self):
+        if self.path is None:
+            return True
+        if self._leader_fd is None:
+            fd = os.open(f'{self.path}.leader', os.O_CREAT | os.O_RDWR, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return False
+            self._leader_fd = fd
+        return True
+
+    # Background maintenance
+
+    def _ensure_thread(self):
+        # Started lazily so that no thread exists before a server forks workers
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='short-code-filter', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.backend is not None:
+                    self.backend.ensure_listening()
+                self._tick()
+            except Exception as e:
+                logger.error(f"Short code filter maintenance failed: {str(e)}")
+            self._stop.wait(self.refresh_interval)
+
+    def _tick(self):
+        if self.path is not None:
+            self._attach()
+        if self._is_leader():
+            # A new leader rebuilds rather than trusting a file it did not write
+            if self.builds == 0 or time.time() - self._built_at > self.rebuild_interval:
+                self.build()
+            else:
+                self.refresh()
+        # Codes created before the last completed scan began are in the filter
+        cutoff = self._last_refresh() - self.margin
+        with self._writing():
+            while self._recent and self._recent[0][0] < cutoff:
+                self._recent.popleft()
@@ -0,0 +1,494 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+
+logger = logging.getLogger(__name__)
+
+# Sentinel stored for keys that are known not to exist (negative caching)
+MISSING = object()
+
+
+class Expiring(namedtuple('Expiring', 'value expires_at')):
+    """A cached value that must not be served after expires_at (epoch seconds)
+
+    Its entries live for the cache's TTL or until expires_at, whichever
+    comes first, in every tier.
+    """
+
+    __slots__ = ()
+
+
+def _capped_ttl(value, ttl):
+    if type(value) is Expiring:
+        return min(ttl, value.expires_at - time.time())
+    return ttl
+
+
+class TTLCache:
+    """Thread-safe LRU cache with per-entry expiry"""
+
+    def __init__(self, maxsize=10000, ttl=300, negative_ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the cached value, MISSING for a cached miss, or None"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._put(key, value, ttl)
+
+    def _put(self, key, value, ttl):
+        # Caller holds self._lock
+        if ttl is None:
+            ttl = self.negative_ttl if value is MISSING else self.ttl
+        ttl = _capped_ttl(value, ttl)
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        self._data[key] = (value, time.monotonic() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def set_missing(self, key):
+        self.set(key, MISSING)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            size = len(self._data)
+        lookups = self.hits + self.misses
+        return {
+            'size': size,
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / lookups if lookups else 0.0
+        }
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ConfiguredCache(TTLCache):
+    """TTLCache sized from <PREFIX>_SIZE, <PREFIX>_TTL and <PREFIX>_NEGATIVE_TTL"""
+
+    config_prefix = None
+    extension_name = None
+
+    def init_app(self, app):
+        self.configure(app.config)
+        app.extensions[self.extension_name] = self
+
+    def configure(self, config):
+        prefix = self.config_prefix
+        self.maxsize = config.get(f'{prefix}_SIZE', self.maxsize)
+        self.ttl = config.get(f'{prefix}_TTL', self.ttl)
+        self.negative_ttl = config.get(f'{prefix}_NEGATIVE_TTL', self.negative_ttl)
+        self.clear()
+
+
+class Lease:
+    """Right to fill one key, taken before loading it from the database"""
+
+    __slots__ = ('key', 'token', 'held', 'generation')
+
+    def __init__(self, key, token, held, generation):
+        self.key = key
+        self.token = token
+        self.held = held
+        self.generation = generation
+
+
+class _Flight:
+    __slots__ = ('done', 'value', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TieredCache(ConfiguredCache):
+    """Per-worker L1 in front of an optional shared L2 (CACHE_BACKEND)
+
+    Reads go to L1, then L2, then the loader passed to get_or_load. Writes
+    and invalidations go to both tiers and are published on
+    <CACHE_KEY_PREFIX><namespace>:invalidate so every other worker drops
+    its L1 copy. Concurrent misses for one key are coalesced: threads in a
+    worker wait for a single load, and across workers the first to take
+    the key's lease in L2 loads while the others poll L2 for its result,
+    for up to CACHE_COALESCE_TIMEOUT seconds.
+
+    A load only fills the cache if the key was not invalidated while it
+    ran, and only writes L2 while it still holds the lease, so a value
+    read before a concurrent update cannot overwrite the newer one. Keys
+    are strings. L2 failures are counted and the cache carries on as L1
+    only, retrying L2 after a second.
+    """
+
+    namespace = None
+
+    # Invalidation generations are tracked per stripe rather than per key
+    STRIPES = 64
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.l2_ttl = 3600
+        self.coalesce_timeout = 0.5
+        self.backend = None
+        self.key_prefix = ''
+        self.channel = None
+        self._generations = [0] * self.STRIPES
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        self._l2_retry_at = 0.0
+        self.l2_hits = 0
+        self.l2_misses = 0
+        self.l2_errors = 0
+        self.coalesced = 0
+        self.loads = 0
+
+    def configure(self, config):
+        super().configure(config)
+        from app.cache_backends import get_backend
+
+        self.l2_ttl = config.get(f'{self.config_prefix}_L2_TTL', self.l2_ttl)
+        self.coalesce_timeout = config.get('CACHE_COALESCE_TIMEOUT', self.coalesce_timeout)
+        backend = get_backend(config.get('CACHE_BACKEND'), config.get('CACHE_SOCKET_TIMEOUT', 0.25))
+        self.use_backend(backend, config.get('CACHE_KEY_PREFIX', 'shortener:'))
+        if backend is None:
+            # Invalidations only reach the worker that made the change; bound
+            # how long the others keep serving an edited, deleted or new key
+            local_ttl = config.get('CACHE_LOCAL_TTL', 5)
+            self.ttl = min(self.ttl, local_ttl)
+            self.negative_ttl = min(self.negative_ttl, local_ttl)
+            logger.warning(f"No CACHE_BACKEND: {self.extension_name} entries are kept for at most "
+                           f"{local_ttl}s, as other workers' changes cannot reach them")
+
+    def use_backend(self, backend, key_prefix='shortener:'):
+        """Attach the shared tier (None for L1 only)"""
+        if self.backend is not None:
+            self.backend.unsubscribe(self.channel, self._on_message)
+        self.backend = backend
+        self.key_prefix = f'{key_prefix}{self.namespace}:'
+        self.channel = f'{self.key_prefix}invalidate'
+        if backend is not None:
+            backend.subscribe(self.channel, self._on_message)
+
+    # L2 values are strings; MISSING is stored as '!' and Expiring
+    # values as '~<expires_at>~<value>'
+
+    def serialize(self, value):
+        return value
+
+    def deserialize(self, raw):
+        return raw
+
+    def _encode(self, value):
+        if value is MISSING:
+            return '!'
+        if type(value) is Expiring:
+            return f'~{value.expires_at!r}~{self.serialize(value.value)}'
+        return self.serialize(value)
+
+    def _decode(self, raw):
+        if raw == '!':
+            return MISSING
+        if raw[:1] == '~':
+            expires_at, _, raw = raw[1:].partition('~')
+            return Expiring(self.deserialize(raw), float(expires_at))
+        return self.deserialize(raw)
+
+    def _l2_ttl(self, value):
+        return _capped_ttl(value, self.negative_ttl if value is MISSING else self.l2_ttl)
+
+    # Reads
+
+    def get(self, key):
+        """L1, then L2: the value, MISSING for a cached miss, or None"""
+        value = TTLCache.get(self, key)
+        if value is not None or self.backend is None:
+            return value
+        return self.get_shared(key)
+
+    def get_local(self, key):
+        """L1 only; never waits on the network"""
+        return TTLCache.get(self, key)
+
+    def get_shared(self, key):
+        """L2 only, filling L1 from it; for callers that already missed L1"""
+        generation = self._generation(key)
+        raw = self._shared('get', self.key_prefix + key)
+        if raw is None:
+            self.l2_misses += 1
+            return None
+        self.l2_hits += 1
+        value = self._decode(raw)
+        self._fill_local(key, value, generation)
+        return value
+
+    def get_or_load(self, key, load):
+        """Cached value, or load() run once for all concurrent callers
+
+        load returns the value, MISSING to cache a miss, or None for a
+        miss that should not be cached.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        return self.coalesce(key, load)
+
+    def coalesce(self, key, load):
+        """get_or_load for a key already known to be missing from both tiers"""
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            self.coalesced += 1
+            if flight.done.wait(self.coalesce_timeout) and flight.error is None:
+                return flight.value
+            return self._load(key, load)
+
+        try:
+            flight.value = self._load(key, load)
+            return flight.value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._flights_lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.done.set()
+
+    def _load(self, key, load):
+        lease = self.begin_fill(key)
+        if not lease.held:
+            value = self.wait_for_fill(key, lease)
+            if value is not None:
+                return value
+        value = load()
+        self.fill(key, value, lease)
+        return value
+
+    def begin_fill(self, key):
+        """Take the key's lease in L2; held is False if another worker has it"""
+        token = uuid.uuid4().hex
+        held = True
+        if self.backend is not None:
+            ttl = max(1.0, 2 * self.coalesce_timeout)
+            held = self._shared('acquire', self.key_prefix + key + ':lease', token, ttl) is not False
+        return Lease(key, token, held, self._generation(key))
+
+    def poll_fill(self, key, lease):
+        """One check of L2 for the value another worker is loading"""
+        raw = self._shared('get', self.key_prefix + key)
+        if raw is None:
+            return None
+        self.l2_hits += 1
+        self.coalesced += 1
+        value = self._decode(raw)
+        self._fill_local(key, value, lease.generation)
+        return value
+
+    def wait_for_fill(self, key, lease):
+        deadline = time.monotonic() + self.coalesce_timeout
+        delay = 0.002
+        while time.monotonic() < deadline:
+            time.sleep(delay)
+            value = self.poll_fill(key, lease)
+            if value is not None:
+                return value
+            delay = min(delay * 2, 0.05)
+        return None
+
+    def fill(self, key, value, lease):
+        """Cache a loaded value unless the key changed while it was loading"""
+        self.loads += 1
+        if value is None:
+            return
+        if self.backend is not None and lease.held:
+            ttl = self._l2_ttl(value)
+            if ttl > 0:
+                stored = self._shared('set_if_held', self.key_prefix + key, self._encode(value),
+                                      ttl, self.key_prefix + key + ':lease', lease.token)
+                if stored is False:
+                    return
+        self._fill_local(key, value, lease.generation)
+
+    # Writes
+
+    def set(self, key, value, ttl=None):
+        self.set_many({key: value}, ttl)
+
+    def set_many(self, mapping, ttl=None):
+        """Write both tiers and tell other workers to drop their copies"""
+        # L2 goes first: a local read that sees the new generation must not
+        # be able to fetch the old L2 value
+        if self.backend is not None and mapping:
+            groups = {}
+            for key, value in mapping.items():
+                group_ttl = self._l2_ttl(value) if ttl is None else _capped_ttl(value, ttl)
+                if type(value) is Expiring:
+                    # Whole seconds, so links created together share a write
+                    group_ttl = int(group_ttl)
+                groups.setdefault(group_ttl, {})[self.key_prefix + key] = self._encode(value)
+            for group_ttl, encoded in groups.items():
+                if group_ttl > 0:
+                    self._shared('set_many', encoded, group_ttl)
+        with self._lock:
+            for key, value in mapping.items():
+                self._bump(key)
+                self._put(key, value, ttl)
+        if self.backend is not None and mapping:
+            self._publish(list(mapping))
+
+    def invalidate(self, key):
+        if self.backend is not None:
+            self._shared('delete', self.key_prefix + key, self.key_prefix + key + ':lease')
+        self._forget(key)
+        if self.backend is not None:
+            self._publish([key])
+
+    # Invalidation messages
+
+    def _origin(self):
+        return f'{os.getpid()}:{id(self)}'
+
+    def _publish(self, keys):
+        message = json.dumps({'origin': self._origin(), 'keys': keys})
+        self._shared('publish', self.channel, message)
+
+    def _on_message(self, message):
+        if message is None:
+            # The subscription was (re)established and may have missed messages
+            with self._lock:
+                self._data.clear()
+                self._generations = [generation + 1 for generation in self._generations]
+            with self._flights_lock:
+                self._flights.clear()
+            return
+        try:
+            payload = json.loads(message)
+        except ValueError:
+            return
+        if payload.get('origin') == self._origin():
+            return
+        for key in payload.get('keys', ()):
+            self._forget(key)
+
+    def _forget(self, key):
+        with self._lock:
+            self._bump(key)
+            self._data.pop(key, None)
+        # Callers arriving from now on must not share a load that began earlier
+        with self._flights_lock:
+            self._flights.pop(key, None)
+
+    def _fill_local(self, key, value, generation):
+        """L1 write, dropped if the key was invalidated since generation was read"""
+        with self._lock:
+            if self._generation(key) == generation:
+                self._put(key, value, None)
+
+    def _generation(self, key):
+        return self._generations[hash(key) % self.STRIPES]
+
+    def _bump(self, key):
+        self._generations[hash(key) % self.STRIPES] += 1
+
+    def _shared(self, method, *args):
+        """Call the L2 backend; None if it is failing"""
+        if self._l2_retry_at and time.monotonic() < self._l2_retry_at:
+            return None
+        try:
+            self.backend.ensure_listening()
+            return getattr(self.backend, method)(*args)
+        except Exception as e:
+            self.l2_errors += 1
+            self._l2_retry_at = time.monotonic() + 1.0
+            logger.warning(f"Shared cache unavailable, using the local cache only: {str(e)}")
+            return None
+
+    def stats(self):
+        stats = super().stats()
+        stats.update({
+            'shared': self.backend is not None,
+            'l2_hits': self.l2_hits,
+            'l2_misses': self.l2_misses,
+            'l2_errors': self.l2_errors,
+            'coalesced': self.coalesced,
+            'loads': self.loads
+        })
+        return stats
+
+
+class URLCache(TieredCache):
+    """short_code -> original_url cache for the redirect path"""
+
+    config_prefix = 'URL_CACHE'
+    extension_name = 'url_cache'
+    namespace = 'url'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Called with each code invalidated here or by another worker
+        self.forget_listeners = []
+
+    def _forget(self, key):
+        super()._forget(key)
+        for listener in self.forget_listeners:
+            listener(key)
+
+
+class UserCache(TieredCache):
+    """user id -> profile cache for JWT user lookups"""
+
+    config_prefix = 'USER_CACHE'
+    extension_name = 'user_cache'
+    namespace = 'user'
+
+    def __init__(self):
+        super().__init__(maxsize=10000, ttl=30, negative_ttl=5)
+        self.l2_ttl = 300
+
+    def serialize(self, value):
+        return json.dumps(value)
+
+    def deserialize(self, raw):
+        return json.loads(raw)
@@ -0,0 +1,242 @@
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+try:
+    import redis
+except ImportError:  # optional dependency
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBackend:
+    """In-process stand-in for the shared cache tier
+
+    Caches that share one instance behave like workers sharing a Redis
+    server: same keys, leases and invalidation messages, delivered
+    synchronously. Used for CACHE_BACKEND=memory and for consistency checks.
+    """
+
+    # Delivery is synchronous, so no message is ever missed
+    connected = True
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(list)
+        self._buckets = None
+
+    def _live(self, key):
+        entry = self._data.get(key)
+        if entry is not None and entry[1] < time.monotonic():
+            del self._data[key]
+            return None
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live(key)
+            return entry[0] if entry else None
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+
+    def set_many(self, mapping, ttl):
+        with self._lock:
+            expires_at = time.monotonic() + ttl
+            for key, value in mapping.items():
+                self._data[key] = (value, expires_at)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def acquire(self, key, token, ttl):
+        """SET key token NX: True if the lease was free"""
+        with self._lock:
+            if self._live(key):
+                return False
+            self._data[key] = (token, time.monotonic() + ttl)
+            return True
+
+    def set_if_held(self, key, value, ttl, lease_key, token):
+        """Store value only while lease_key still holds token, then release it"""
+        with self._lock:
+            entry = self._live(lease_key)
+            if not entry or entry[0] != token:
+                return False
+            self._data[key] = (value, time.monotonic() + ttl)
+            del self._data[lease_key]
+            return True
+
+    def throttle(self, key, interval, burst, cost=1):
+        """Take cost tokens from a bucket: 0.0, or seconds until it has them"""
+        from app.ratelimit import TokenBuckets
+
+        with self._lock:
+            if self._buckets is None:
+                self._buckets = TokenBuckets()
+            return self._buckets.take(key, interval, burst, cost)
+
+    def publish(self, channel, message):
+        for callback in list(self._subscribers[channel]):
+            callback(message)
+
+    def subscribe(self, channel, callback):
+        self._subscribers[channel].append(callback)
+        # Confirmed at once, as the Redis listener confirms each subscription
+        callback(None)
+
+    def unsubscribe(self, channel, callback):
+        if callback in self._subscribers[channel]:
+            self._subscribers[channel].remove(callback)
+
+    def ensure_listening(self):
+        pass
+
+
+class RedisBackend:
+    """Shared cache tier on Redis, with a pub/sub listener thread per process"""
+
+    # Atomic "set if my lease is still held, then release it"
+    SET_IF_HELD = """
+    if redis.call('get', KEYS[2]) == ARGV[3] then
+        redis.call('set', KEYS[1], ARGV[1], 'PX', ARGV[2])
+        redis.call('del', KEYS[2])
+        return 1
+    end
+    return 0
+    """
+
+    # Token bucket as a theoretical arrival time (see app.ratelimit.TokenBuckets),
+    # on the server's clock so every worker agrees
+    THROTTLE = """
+    local now = redis.call('time')
+    now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+    local tat = tonumber(redis.call('get', KEYS[1]) or now)
+    if tat < now then
+        tat = now
+    end
+    tat = tat + tonumber(ARGV[1]) * tonumber(ARGV[3])
+    local wait = tat - now - tonumber(ARGV[1]) * tonumber(ARGV[2])
+    if wait > 0 then
+        return tostring(wait)
+    end
+    redis.call('set', KEYS[1], tostring(tat), 'PX', math.ceil((tat - now) * 1000))
+    return '0'
+    """
+
+    def __init__(self, url, socket_timeout=0.25):
+        if redis is None:
+            raise RuntimeError("CACHE_BACKEND is a Redis URL but the redis package "
+                               "is not installed (`pip install redis`)")
+        self.client = redis.Redis.from_url(url, socket_timeout=socket_timeout,
+                                           socket_connect_timeout=socket_timeout,
+                                           decode_responses=True)
+        self._set_if_held = self.client.register_script(self.SET_IF_HELD)
+        self._throttle = self.client.register_script(self.THROTTLE)
+        self._subscribers = defaultdict(list)
+        self._thread = None
+        self._thread_pid = None
+        self._lock = threading.Lock()
+        # False while the listener is (re)connecting and messages may be lost
+        self.connected = False
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl):
+        self.client.set(key, value, px=max(1, int(ttl * 1000)))
+
+    def set_many(self, mapping, ttl):
+        pipeline = self.client.pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipeline.set(key, value, px=max(1, int(ttl * 1000)))
+        pipeline.execute()
+
+    def delete(self, *keys):
+        self.client.delete(*keys)
+
+    def acquire(self, key, token, ttl):
+        return bool(self.client.set(key, token, nx=True, px=int(ttl * 1000)))
+
+    def set_if_held(self, key, value, ttl, lease_key, token):
+        return bool(self._set_if_held(keys=[key, lease_key],
+                                      args=[value, max(1, int(ttl * 1000)), token]))
+
+    def throttle(self, key, interval, burst, cost=1):
+        return float(self._throttle(keys=[key], args=[interval, burst, cost]))
+
+    def publish(self, channel, message):
+        self.client.publish(channel, message)
+
+    def subscribe(self, channel, callback):
+        self._subscribers[channel].append(callback)
+
+    def unsubscribe(self, channel, callback):
+        if callback in self._subscribers[channel]:
+            self._subscribers[channel].remove(callback)
+
+    def ensure_listening(self):
+        # Threads do not survive a fork, so each worker starts its own
+        if self._thread is not None and self._thread_pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread_pid == os.getpid() and self._thread.is_alive():
+                return
+            self._thread_pid = os.getpid()
+            self.connected = False
+            self._thread = threading.Thread(target=self._listen, name='cache-invalidation',
+                                            daemon=True)
+            self._thread.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub()
+                subscribed = set()
+                while True:
+                    # Channels registered after the listener started
+                    channels = set(self._subscribers) - subscribed
+                    if channels:
+                        pubsub.subscribe(*channels)
+                        subscribed |= channels
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is None:
+                        continue
+                    # Once a subscription is confirmed, entries cached before it
+                    # (or while disconnected) may have missed messages: None
+                    # tells the cache to drop everything
+                    data = message['data'] if message['type'] == 'message' else None
+                    if message['type'] == 'subscribe':
+                        self.connected = True
+                    if message['type'] in ('message', 'subscribe'):
+                        for callback in list(self._subscribers.get(message['channel'], ())):
+                            callback(data)
+            except redis.RedisError as e:
+                self.connected = False
+                logger.warning(f"Cache invalidation listener disconnected: {str(e)}")
+                time.sleep(1)
+
+
+_backends = {'memory': MemoryBackend()}
+
+
+def get_backend(url, socket_timeout=0.25):
+    """Backend for CACHE_BACKEND: '' (none), 'memory' or a redis:// URL
+
+    One backend per URL and process, so the URL and user caches share a
+    connection pool and a listener thread.
+    """
+    if not url or url == 'none':
+        return None
+    if url not in _backends:
+        if not url.startswith(('redis://', 'rediss://', 'unix://')):
+            raise RuntimeError(f"Unknown CACHE_BACKEND '{url}', expected memory or a redis:// URL")
+        _backends[url] = RedisBackend(url, socket_timeout)
+    return _backends[url]
@@ -0,0 +1,66 @@
+import click
+from flask_migrate import stamp
+from app import db
+
+def register_commands(app):
+    """Register custom flask CLI commands"""
+
+    @app.cli.command('init-db')
+    @click.option('--drop', is_flag=True, help='Drop all tables first.')
+    def init_db(drop):
+        """Create all tables from the models and stamp the migration head.
+
+        Meant for local development and tests; deployments should run
+        `flask db upgrade` instead.
+        """
+        if drop:
+            db.drop_all()
+        db.create_all()
+        stamp()
+        click.echo('Database tables created.')
+
+    @app.cli.command('purge-expired')
+    @click.option('--batch-size', type=int, default=None,
+                  help='Rows per DELETE (default PURGE_BATCH_SIZE).')
+    @click.option('--pause', type=float, default=None,
+                  help='Seconds to sleep between batches (default PURGE_PAUSE).')
+    @click.option('--max-batches', type=int, default=None,
+                  help='Stop after this many batches of links.')
+    @click.option('--orphans/--no-orphans', default=True,
+                  help='Also delete click data of links that no longer exist, and unused tags.')
+    def purge_expired(batch_size, pause, max_batches, orphans):
+        """Delete expired links and their click data in small batches.
+
+        Safe to run from cron while the app serves traffic; expired links
+        already stopped redirecting, this only reclaims their rows.
+        """
+        from app.purge import purge_expired_links, purge_orphaned_clicks, purge_unused_tags
+
+        batch_size = batch_size or app.config['PURGE_BATCH_SIZE']
+        pause = app.config['PURGE_PAUSE'] if pause is None else pause
+        links, clicks = purge_expired_links(batch_size, pause, max_batches)
+        click.echo(f'Purged {links} expired links and {clicks} of their click rows.')
+        if orphans:
+            click.echo(f'Purged {purge_orphaned_clicks(batch_size, pause)} orphaned click rows.')
+            click.echo(f'Purged {purge_unused_tags(batch_size, pause)} unused tags.')
+
+    @app.cli.command('snapshot-links')
+    @click.option('--output', default=None,
+                  help='Snapshot file to replace (default REDIRECT_SNAPSHOT_PATH).')
+    @click.option('--batch-size', type=int, default=10000, help='Rows fetched per round trip.')
+    def snapshot_links(output, batch_size):
+        """Write every live link to the memory-mapped redirect snapshot.
+
+        Run it from cron on each node (hourly is plenty; workers pick up
+        links changed since from the database). The file is replaced
+        atomically and workers map the new one within
+        REDIRECT_SNAPSHOT_REFRESH seconds.
+        """
+        from app.snapshot import export_links
+
+        output = output or app.config['REDIRECT_SNAPSHOT_PATH']
+        if not output:
+            raise click.UsageError('Pass --output or set REDIRECT_SNAPSHOT_PATH.')
+        with db.engine.connect() as conn:
+            count = export_links(conn, output, batch_size)
+        click.echo(f'Wrote {count} links to {output}.')
@@ -0,0 +1,156 @@
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import bindparam, update
+
+logger = logging.getLogger(__name__)
+
+
+class ClickBuffer:
+    """Accumulate access_count deltas in memory and flush them in bulk"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.engine = None
+        self.flush_interval = 5.0
+        self.max_pending = 1000
+        self._pending = defaultdict(int)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self.recorded = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.last_flush = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self._configure(app.config)
+        app.extensions['click_buffer'] = self
+        atexit.register(self.shutdown)
+
+    def init_engine(self, engine, config):
+        """Flush through a plain engine, for processes without a Flask app"""
+        self.engine = engine
+        self._configure(config)
+        atexit.register(self.shutdown)
+
+    def _configure(self, config):
+        self.flush_interval = config.get('CLICK_FLUSH_INTERVAL', 5.0)
+        self.max_pending = config.get('CLICK_FLUSH_MAX_PENDING', 1000)
+
+    def record(self, short_code, count=1):
+        """Count a click; never touches the database on the caller's thread"""
+        with self._lock:
+            self._pending[short_code] += count
+            self.recorded += count
+            pending = len(self._pending)
+        self._ensure_thread()
+        if pending >= self.max_pending:
+            self._wake.set()
+
+    def flush(self):
+        """Write all pending deltas with one executemany UPDATE"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                batch, self._pending = self._pending, defaultdict(int)
+
+            from app.models import ShortURL
+
+            table = ShortURL.__table__
+            stmt = (
+                update(table)
+                .where(table.c.short_code == bindparam('code'))
+                .values(access_count=table.c.access_count + bindparam('delta'),
+                        last_accessed=bindparam('accessed'),
+                        # Clicks are not edits; keeps onupdate away from updated_at
+                        updated_at=table.c.updated_at)
+            )
+            accessed = datetime.utcnow()
+            params = [{'code': code, 'delta': delta, 'accessed': accessed}
+                      for code, delta in batch.items()]
+            try:
+                with self._begin() as conn:
+                    conn.execute(stmt, params)
+            except Exception as e:
+                # Put the deltas back so the next flush retries them
+                with self._lock:
+                    for code, delta in batch.items():
+                        self._pending[code] += delta
+                self.failed_flushes += 1
+                logger.error(f"Click flush failed: {str(e)}")
+                return 0
+
+            flushed = sum(batch.values())
+            self.flushed += flushed
+            self.flushes += 1
+            self.last_flush = time.time()
+            return flushed
+
+    def pending(self, short_code):
+        with self._lock:
+            return self._pending.get(short_code, 0)
+
+    def discard(self, short_code):
+        with self._lock:
+            self._pending.pop(short_code, None)
+
+    def stats(self):
+        with self._lock:
+            pending_codes = len(self._pending)
+            pending_clicks = sum(self._pending.values())
+        return {
+            'recorded': self.recorded,
+            'flushed': self.flushed,
+            'flushes': self.flushes,
+            'failed_flushes': self.failed_flushes,
+            'pending_codes': pending_codes,
+            'pending_clicks': pending_clicks,
+            'last_flush': self.last_flush
+        }
+
+    def shutdown(self):
+        self._stop.set()
+        self._wake.set()
+        if self.app is not None or self.engine is not None:
+            self.flush()
+
+    @contextmanager
+    def _begin(self):
+        if self.engine is not None:
+            with self.engine.begin() as conn:
+                yield conn
+            return
+        from app import db
+        with self.app.app_context(), db.engine.begin() as conn:
+            yield conn
+
+    def _ensure_thread(self):
+        # Started lazily so that no thread exists before a server forks workers
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='click-buffer-flush', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
@@ -0,0 +1,175 @@
+import hashlib
+import os
+import string
+import threading
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+ALPHABET = string.digits + string.ascii_letters
+BASE = len(ALPHABET)
+_INDEX = {char: i for i, char in enumerate(ALPHABET)}
+
+
+def encode_base62(number, width):
+    """Encode a non-negative integer as a fixed-width base62 string"""
+    chars = []
+    for _ in range(width):
+        number, rem = divmod(number, BASE)
+        chars.append(ALPHABET[rem])
+    if number:
+        raise ValueError('Number does not fit in the requested width')
+    return ''.join(reversed(chars))
+
+
+def decode_base62(code):
+    number = 0
+    for char in code:
+        number = number * BASE + _INDEX[char]
+    return number
+
+
+def is_short_code_conflict(error):
+    """Whether an IntegrityError was raised by the short_code unique constraint"""
+    return 'short_code' in str(getattr(error, 'orig', error))
+
+
+class FeistelPermutation:
+    """Keyed bijection on range(domain) so sequential IDs map to unguessable codes"""
+
+    def __init__(self, domain, key, rounds=4):
+        self.domain = domain
+        self.key = hashlib.blake2b(key, digest_size=32).digest()
+        self.rounds = rounds
+        bits = max(2, (domain - 1).bit_length())
+        self.half_bits = (bits + 1) // 2
+        self.mask = (1 << self.half_bits) - 1
+
+    def _f(self, value, round_no):
+        digest = hashlib.blake2b(
+            value.to_bytes(8, 'big') + bytes([round_no]),
+            key=self.key, digest_size=8).digest()
+        return int.from_bytes(digest, 'big') & self.mask
+
+    def _encrypt(self, value):
+        left, right = value >> self.half_bits, value & self.mask
+        for i in range(self.rounds):
+            left, right = right, left ^ self._f(right, i)
+        return (left << self.half_bits) | right
+
+    def _decrypt(self, value):
+        left, right = value >> self.half_bits, value & self.mask
+        for i in reversed(range(self.rounds)):
+            left, right = right ^ self._f(left, i), left
+        return (left << self.half_bits) | right
+
+    def permute(self, value):
+        # Cycle-walk until the result lands back inside the domain
+        value = self._encrypt(value)
+        while value >= self.domain:
+            value = self._encrypt(value)
+        return value
+
+    def invert(self, value):
+        value = self._decrypt(value)
+        while value >= self.domain:
+            value = self._decrypt(value)
+        return value
+
+
+class CodeAllocator:
+    """Hand out short codes from ID blocks leased from the code_sequence table
+
+    Each worker leases SHORT_CODE_BLOCK_SIZE sequence values in one
+    transaction and then encodes them locally, so allocating a code never
+    needs a uniqueness lookup. Codes can only collide with a custom code of
+    the same length, which the unique constraint on short_url catches.
+    """
+
+    def __init__(self):
+        self.length = 6
+        self.block_size = 1000
+        self.permutation = None
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0
+        self._pid = None
+        self.leases = 0
+
+    def init_app(self, app):
+        self.length = app.config.get('SHORT_CODE_LENGTH', 6)
+        if not 3 <= self.length <= 8:
+            # short_code is a String(8) and redirects only match 3 to 8 characters
+            raise RuntimeError("SHORT_CODE_LENGTH must be between 3 and 8")
+        self.block_size = app.config.get('SHORT_CODE_BLOCK_SIZE', 1000)
+        self.permutation = None
+        if app.config.get('SHORT_CODE_SCRAMBLE', True):
+            secret = app.config.get('SHORT_CODE_SECRET') or app.config.get('SECRET_KEY')
+            if not secret:
+                # An empty key makes the code sequence guessable again
+                raise RuntimeError("SHORT_CODE_SCRAMBLE needs SHORT_CODE_SECRET or SECRET_KEY")
+            self.permutation = FeistelPermutation(self.capacity, secret.encode('utf-8'))
+        self._next = self._end = 0
+        app.extensions['code_allocator'] = self
+
+    @property
+    def capacity(self):
+        return BASE ** self.length
+
+    def encode(self, sequence):
+        if sequence >= self.capacity:
+            raise RuntimeError('Short code space exhausted; increase SHORT_CODE_LENGTH')
+        if self.permutation is not None:
+            sequence = self.permutation.permute(sequence)
+        return encode_base62(sequence, self.length)
+
+    def decode(self, code):
+        """Return the sequence value behind an allocated code, or None"""
+        if len(code) != self.length or any(char not in _INDEX for char in code):
+            return None
+        value = decode_base62(code)
+        if self.permutation is not None:
+            value = self.permutation.invert(value)
+        return value
+
+    def allocate(self):
+        return self.allocate_many(1)[0]
+
+    def allocate_many(self, count):
+        sequences = []
+        with self._lock:
+            if self._pid != os.getpid():
+                # Never reuse a block inherited from a parent process
+                self._next = self._end = 0
+                self._pid = os.getpid()
+            while len(sequences) < count:
+                if self._next >= self._end:
+                    self._next, self._end = self._lease(
+                        max(self.block_size, count - len(sequences)))
+                take = min(count - len(sequences), self._end - self._next)
+                sequences.extend(range(self._next, self._next + take))
+                self._next += take
+        return [self.encode(sequence) for sequence in sequences]
+
+    def _lease(self, size):
+        from app import db
+        from app.models import CodeSequence
+
+        table = CodeSequence.__table__
+        for _ in range(2):
+            try:
+                with db.engine.begin() as conn:
+                    result = conn.execute(
+                        update(table)
+                        .where(table.c.id == 1)
+                        .values(next_value=table.c.next_value + size))
+                    if result.rowcount == 0:
+                        conn.execute(insert(table).values(id=1, next_value=size))
+                    end = conn.execute(
+                        select(table.c.next_value).where(table.c.id == 1)).scalar()
+                self.leases += 1
+                return end - size, end
+            except IntegrityError:
+                # Another worker created the sequence row first; retry the update
+                continue
+        raise RuntimeError('Could not lease a short code block')
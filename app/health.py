@@ -0,0 +1,35 @@
+from flask import Blueprint, jsonify, current_app, Response
+from sqlalchemy import text
+from app import db, replicas
+from app.pool import pool_stats
+from app.metrics import render_metrics
+
+health_bp = Blueprint('health', __name__)
+
+@health_bp.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness/readiness probe that checks database connectivity"""
+    try:
+        with db.engine.connect() as conn:
+            conn.execute(text('SELECT 1'))
+    except Exception as e:
+        return jsonify({
+            'status': 'unavailable',
+            'database': 'error',
+            'details': str(e)
+        }), 503
+    
+    body = {
+        'status': 'ok',
+        'database': 'ok',
+        'pool': pool_stats(db.engine)
+    }
+    # Replicas are reported but not required: reads fall back to the primary
+    if replicas.replicas:
+        body['replicas'] = replicas.stats()['replicas']
+    return jsonify(body)
+
+@health_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text exposition of this worker's metrics"""
+    return Response(render_metrics(current_app), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,270 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from flask import g, has_request_context, request, request_finished, request_started
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{_labels(labels, le=bound)} {cumulative}')
+        lines.append(f'{name}_bucket{_labels(labels, le="+Inf")} {self.count}')
+        lines.append(f'{name}_sum{_labels(labels)} {self.sum}')
+        lines.append(f'{name}_count{_labels(labels)} {self.count}')
+        return lines
+
+
+def _labels(labels, **extra):
+    items = list(labels.items()) + list(extra.items())
+    if not items:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in items) + '}'
+
+
+class RequestMetrics:
+    """Per-endpoint latency, status and DB query accounting
+
+    Hooks Flask's request_started/request_finished signals and the
+    engine's cursor events. Per request it costs a few clock reads and one
+    locked dict update. Requests that run more than QUERY_BUDGET queries
+    are logged as warnings, which is how N+1 patterns show up.
+    """
+
+    def __init__(self):
+        self.query_budget = 10
+        self._lock = threading.Lock()
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.queries = defaultdict(lambda: Histogram(QUERY_COUNT_BUCKETS))
+        self.query_seconds = defaultdict(float)
+        self.responses = defaultdict(int)
+        self.budget_exceeded = defaultdict(int)
+
+    def init_app(self, app):
+        from app import db
+
+        self.query_budget = app.config.get('QUERY_BUDGET', 10)
+        request_started.connect(self._request_started, app)
+        request_finished.connect(self._request_finished, app)
+        with app.app_context():
+            engines = [db.engine]
+        replicas = app.extensions.get('replicas')
+        if replicas is not None:
+            engines += replicas.engines()
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        app.extensions['request_metrics'] = self
+
+    def _request_started(self, sender, **extra):
+        g._metrics_start = time.perf_counter()
+        g._metrics_queries = 0
+        g._metrics_query_seconds = 0.0
+
+    def _request_finished(self, sender, response, **extra):
+        start = g.get('_metrics_start')
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+        endpoint = request.endpoint or 'unmatched'
+        queries = g._metrics_queries
+        key = (endpoint, request.method)
+        with self._lock:
+            self.latency[key].observe(elapsed)
+            self.queries[key].observe(queries)
+            self.query_seconds[key] += g._metrics_query_seconds
+            self.responses[(endpoint, request.method, response.status_code)] += 1
+            if queries > self.query_budget:
+                self.budget_exceeded[key] += 1
+        if queries > self.query_budget:
+            logger.warning(f"{request.method} {endpoint} ran {queries} queries "
+                           f"(budget {self.query_budget})")
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and '_metrics_start' in g:
+            conn.info['_metrics_query_start'] = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        start = conn.info.pop('_metrics_query_start', None)
+        if start is not None and has_request_context() and '_metrics_start' in g:
+            g._metrics_queries += 1
+            g._metrics_query_seconds += time.perf_counter() - start
+
+    def render(self):
+        """Request metrics in Prometheus text format"""
+        with self._lock:
+            lines = ['# TYPE http_request_duration_seconds histogram']
+            for (endpoint, method), histogram in sorted(self.latency.items()):
+                lines += histogram.render('http_request_duration_seconds',
+                                          {'endpoint': endpoint, 'method': method})
+            lines.append('# TYPE http_requests_total counter')
+            for (endpoint, method, status), count in sorted(self.responses.items()):
+                lines.append(f'http_requests_total'
+                             f'{_labels({"endpoint": endpoint, "method": method, "status": status})} {count}')
+            lines.append('# TYPE db_queries_per_request histogram')
+            for (endpoint, method), histogram in sorted(self.queries.items()):
+                lines += histogram.render('db_queries_per_request',
+                                          {'endpoint': endpoint, 'method': method})
+            lines.append('# TYPE db_query_duration_seconds_total counter')
+            for (endpoint, method), seconds in sorted(self.query_seconds.items()):
+                lines.append(f'db_query_duration_seconds_total'
+                             f'{_labels({"endpoint": endpoint, "method": method})} {seconds}')
+            lines.append('# TYPE db_query_budget_exceeded_total counter')
+            for (endpoint, method), count in sorted(self.budget_exceeded.items()):
+                lines.append(f'db_query_budget_exceeded_total'
+                             f'{_labels({"endpoint": endpoint, "method": method})} {count}')
+        return lines
+
+
+def render_metrics(app):
+    """Everything /metrics exposes: requests, caches, pool and write buffers"""
+    from app import db
+    from app.pool import pool_stats
+
+    lines = []
+    request_metrics = app.extensions.get('request_metrics')
+    if request_metrics is not None:
+        lines += request_metrics.render()
+
+    caches = [(name, app.extensions[name]) for name in ('url_cache', 'user_cache')
+              if name in app.extensions]
+    for metric, key in (('cache_hits_total', 'hits'), ('cache_misses_total', 'misses'),
+                        ('cache_evictions_total', 'evictions'), ('cache_entries', 'size'),
+                        ('cache_l2_hits_total', 'l2_hits'), ('cache_l2_misses_total', 'l2_misses'),
+                        ('cache_l2_errors_total', 'l2_errors'),
+                        ('cache_coalesced_total', 'coalesced'), ('cache_loads_total', 'loads')):
+        lines.append(f"# TYPE {metric} {'gauge' if key == 'size' else 'counter'}")
+        for name, cache in caches:
+            lines.append(f'{metric}{_labels({"cache": name})} {cache.stats()[key]}')
+
+    # One series per engine: the primary and each replica have their own pool
+    engines = [db.engine]
+    replicas = app.extensions.get('replicas')
+    if replicas is not None:
+        engines += replicas.engines()
+    pools = []
+    for engine in engines:
+        stats = pool_stats(engine)
+        if stats is not None:
+            pools.append((engine.pool.metrics.name, stats))
+    for metric, key, kind in (('db_pool_checkouts_total', 'checkouts', 'counter'),
+                              ('db_pool_checkout_wait_seconds_total', 'wait_total', 'counter'),
+                              ('db_pool_checkout_wait_seconds_max', 'wait_max', 'gauge'),
+                              ('db_pool_timeouts_total', 'timeouts', 'counter'),
+                              ('db_pool_checked_out', 'checked_out', 'gauge'),
+                              ('db_pool_saturation', 'saturation', 'gauge')):
+        lines.append(f'# TYPE {metric} {kind}')
+        for name, stats in pools:
+            lines.append(f'{metric}{_labels({"engine": name})} {stats[key]}')
+
+    click_buffer = app.extensions.get('click_buffer')
+    if click_buffer is not None:
+        stats = click_buffer.stats()
+        lines += [
+            '# TYPE click_buffer_recorded_total counter',
+            f"click_buffer_recorded_total {stats['recorded']}",
+            '# TYPE click_buffer_flushed_total counter',
+            f"click_buffer_flushed_total {stats['flushed']}",
+            '# TYPE click_buffer_pending gauge',
+            f"click_buffer_pending {stats['pending_clicks']}",
+        ]
+
+    click_analytics = app.extensions.get('click_analytics')
+    if click_analytics is not None:
+        stats = click_analytics.stats()
+        lines.append('# TYPE click_events_total counter')
+        for state in ('enqueued', 'dropped', 'written', 'failed'):
+            lines.append(f'click_events_total{_labels({"state": state})} {stats[state]}')
+
+    rate_limiter = app.extensions.get('rate_limiter')
+    if rate_limiter is not None and rate_limiter.rules:
+        stats = rate_limiter.stats()
+        lines += [
+            '# TYPE rate_limit_allowed_total counter',
+            f"rate_limit_allowed_total {stats['allowed']}",
+            '# TYPE rate_limit_limited_total counter',
+        ]
+        for name, count in sorted(stats['limited'].items()):
+            lines.append(f'rate_limit_limited_total{_labels({"limit": name})} {count}')
+        lines += [
+            '# TYPE rate_limit_tracked_keys gauge',
+            f"rate_limit_tracked_keys {stats['tracked_keys']}",
+        ]
+
+    replicas = app.extensions.get('replicas')
+    if replicas is not None and replicas.replicas:
+        stats = replicas.stats()
+        lines.append('# TYPE replica_reads_total counter')
+        for replica in stats['replicas']:
+            lines.append(f'replica_reads_total{_labels({"replica": replica["name"]})} {replica["reads"]}')
+        lines.append('# TYPE replica_errors_total counter')
+        for replica in stats['replicas']:
+            lines.append(f'replica_errors_total{_labels({"replica": replica["name"]})} {replica["errors"]}')
+        lines.append('# TYPE replica_healthy gauge')
+        for replica in stats['replicas']:
+            lines.append(f'replica_healthy{_labels({"replica": replica["name"]})} {int(replica["healthy"])}')
+        lines.append('# TYPE replica_primary_reads_total counter')
+        for reason, count in sorted(stats['primary_reads'].items()):
+            lines.append(f'replica_primary_reads_total{_labels({"reason": reason})} {count}')
+
+    redirect_snapshot = app.extensions.get('redirect_snapshot')
+    if redirect_snapshot is not None and redirect_snapshot.enabled:
+        stats = redirect_snapshot.stats()
+        lines += [
+            '# TYPE redirect_snapshot_lookups_total counter',
+            f'redirect_snapshot_lookups_total{_labels({"result": "hit"})} {stats["hits"]}',
+            f'redirect_snapshot_lookups_total{_labels({"result": "miss"})} {stats["misses"]}',
+            '# TYPE redirect_snapshot_stale_served_total counter',
+            f'redirect_snapshot_stale_served_total {stats["stale_served"]}',
+            '# TYPE redirect_snapshot_delta_errors_total counter',
+            f'redirect_snapshot_delta_errors_total {stats["delta_errors"]}',
+            '# TYPE redirect_snapshot_links gauge',
+            f'redirect_snapshot_links {stats["links"]}',
+            '# TYPE redirect_snapshot_delta_links gauge',
+            f'redirect_snapshot_delta_links {stats["delta"]}',
+            '# TYPE redirect_snapshot_age_seconds gauge',
+            f'redirect_snapshot_age_seconds {stats["age"] if stats["age"] is not None else "NaN"}',
+        ]
+
+    short_code_filter = app.extensions.get('short_code_filter')
+    if short_code_filter is not None and short_code_filter.enabled:
+        stats = short_code_filter.stats()
+        lines += [
+            '# TYPE short_code_filter_checks_total counter',
+            f'short_code_filter_checks_total{_labels({"result": "rejected"})} {stats["rejected"]}',
+            f'short_code_filter_checks_total{_labels({"result": "passed"})} {stats["passed"]}',
+            f'short_code_filter_checks_total{_labels({"result": "uncertain"})} {stats["uncertain"]}',
+        ]
+        if stats['ready']:
+            lines += [
+                '# TYPE short_code_filter_bytes gauge',
+                f"short_code_filter_bytes {stats['size_bytes']}",
+                '# TYPE short_code_filter_false_positive_rate gauge',
+                f"short_code_filter_false_positive_rate {stats['false_positive_rate']}",
+            ]
+
+    return '\n'.join(lines) + '\n'
@@ -1,12 +1,6 @@
 from datetime import datetime
-import string
-import random
-from flask import url_for
-from app import db, bcrypt
-
-def generate_short_code(length=6):
-    characters = string.ascii_letters + string.digits
-    return ''.join(random.choice(characters) for _ in range(length))
+from flask import current_app
+from app import db, click_buffer, code_allocator, password_hasher
 
 class User(db.Model):
     __tablename__ = 'user'
@@ -20,16 +14,23 @@ class User(db.Model):
     is_verified = db.Column(db.Boolean, default=False)
     profile_picture = db.Column(db.String(256), nullable=True)
     
-    # Relationship
-    urls = db.relationship('ShortURL', backref='owner', lazy=True, cascade='all, delete-orphan')
+    # Relationship. Deleting a user leaves its links to ON DELETE CASCADE
+    # rather than loading every one of them first
+    urls = db.relationship('ShortURL', backref='owner', lazy=True, cascade='all, delete-orphan',
+                           passive_deletes=True)
 
     def set_password(self, password):
-        self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
+        """Verify a password, upgrading the stored hash if the work factor changed"""
         if not self.password_hash:
             return False
-        return bcrypt.check_password_hash(self.password_hash, password)
+        if not password_hasher.check(self.password_hash, password):
+            return False
+        if password_hasher.needs_rehash(self.password_hash):
+            self.set_password(password)
+        return True
 
     def to_dict(self):
         return {
@@ -56,48 +57,120 @@ class User(db.Model):
 
 class ShortURL(db.Model):
     __tablename__ = 'short_url'
+    __table_args__ = (
+        # Keyset pagination of a user's links and every owner-scoped lookup
+        db.Index('ix_short_url_user_id_id', 'user_id', 'id'),
+        # One link per normalized destination and user when dedup is used
+        db.Index('ix_short_url_user_id_url_hash', 'user_id', 'url_hash', unique=True),
+        # Purge of expired links; most links never expire and stay out of it
+        db.Index('ix_short_url_expires_at', 'expires_at',
+                 postgresql_where=db.text('expires_at IS NOT NULL'),
+                 sqlite_where=db.text('expires_at IS NOT NULL')),
+        # Links changed since the redirect snapshot was taken
+        db.Index('ix_short_url_updated_at', 'updated_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    original_url = db.Column(db.String(512), nullable=False)
-    short_code = db.Column(db.String(6), unique=True, nullable=False)
+    original_url = db.Column(db.String(2048), nullable=False)
+    # Digest of the normalized original_url, only set for deduplicated links
+    url_hash = db.Column(db.LargeBinary(16), nullable=True)
+    short_code = db.Column(db.String(8), unique=True, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    last_accessed = db.Column(db.DateTime, nullable=True)
     access_count = db.Column(db.Integer, default=0)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # UTC; the link stops redirecting then and is removed by `flask purge-expired`
+    expires_at = db.Column(db.DateTime, nullable=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', name='fk_short_url_user_id_user',
+                                                  ondelete='CASCADE'), nullable=False)
     title = db.Column(db.String(100), nullable=True)
-    tags = db.Column(db.String(200), nullable=True)
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         if not self.short_code:
-            self.short_code = self._generate_unique_short_code()
-
-    def _generate_unique_short_code(self):
-        short_code = generate_short_code()
-        while ShortURL.query.filter_by(short_code=short_code).first() is not None:
-            short_code = generate_short_code()
-        return short_code
+            self.short_code = code_allocator.allocate()
 
     def to_dict(self):
-        return {
-            "id": self.id,
-            "original_url": self.original_url,
-            "short_code": self.short_code,
-            "short_url": url_for('api.get_original_url', 
-                                short_code=self.short_code, 
-                                _external=True),
-            "user_id": self.user_id,
-            "access_count": self.access_count,
-            "title": self.title,
-            "tags": self.tags.split(',') if self.tags else [],
-            "created_at": self.created_at.isoformat(),
-            "updated_at": self.updated_at.isoformat(),
-            "owner": self.owner.to_dict() if self.owner else None
-        }
+        from app.tags import tags_for
+
+        owner = self.owner.to_dict() if self.owner else None
+        tags = tags_for([self.id]).get(self.id, [])
+        return current_app.extensions['url_serializer'].detail(self, owner, tags)
 
     def increment_access_count(self):
-        self.access_count += 1
-        db.session.commit()
+        click_buffer.record(self.short_code)
 
     def __repr__(self):
-        return f'<ShortURL {self.short_code}>'
\ No newline at end of file
+        return f'<ShortURL {self.short_code}>'
+
+class Tag(db.Model):
+    """A user's tag name, shared by all of that user's links carrying it"""
+    __tablename__ = 'tag'
+    __table_args__ = (
+        db.Index('ix_tag_user_id_name', 'user_id', 'name', unique=True),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', name='fk_tag_user_id_user',
+                                                  ondelete='CASCADE'), nullable=False)
+    name = db.Column(db.String(32), nullable=False)
+
+    def __repr__(self):
+        return f'<Tag {self.name}>'
+
+class LinkTag(db.Model):
+    """Tag on a link; keyed tag first, so a tag's links come back in id order"""
+    __tablename__ = 'link_tag'
+    __table_args__ = (
+        db.Index('ix_link_tag_link_id', 'link_id'),
+    )
+    
+    tag_id = db.Column(db.Integer, db.ForeignKey('tag.id', name='fk_link_tag_tag_id_tag',
+                                                 ondelete='CASCADE'), primary_key=True)
+    link_id = db.Column(db.Integer, db.ForeignKey('short_url.id', name='fk_link_tag_link_id_short_url',
+                                                  ondelete='CASCADE'), primary_key=True)
+
+class CodeSequence(db.Model):
+    """Single-row counter that workers lease short code blocks from"""
+    __tablename__ = 'code_sequence'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    next_value = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<CodeSequence {self.next_value}>'
+
+class ClickEvent(db.Model):
+    """One redirect, written in batches by the analytics writer"""
+    __tablename__ = 'click_event'
+    __table_args__ = (
+        db.Index('ix_click_event_short_code_occurred_at', 'short_code', 'occurred_at'),
+        # Append-only and time-ordered, so a BRIN index stays tiny on Postgres
+        db.Index('ix_click_event_occurred_at', 'occurred_at', postgresql_using='brin'),
+    )
+    
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    occurred_at = db.Column(db.DateTime, nullable=False)
+    short_code = db.Column(db.String(8), nullable=False)
+    referrer_host = db.Column(db.String(255), nullable=True)
+    user_agent_family = db.Column(db.String(32), nullable=True)
+    country = db.Column(db.String(2), nullable=True)
+
+    def __repr__(self):
+        return f'<ClickEvent {self.short_code} {self.occurred_at}>'
+
+class ClickStatMinute(db.Model):
+    """Per-minute click rollup"""
+    __tablename__ = 'click_stat_minute'
+    
+    short_code = db.Column(db.String(8), primary_key=True)
+    bucket = db.Column(db.DateTime, primary_key=True)
+    clicks = db.Column(db.Integer, nullable=False, default=0)
+
+class ClickStatDay(db.Model):
+    """Per-day click rollup"""
+    __tablename__ = 'click_stat_day'
+    
+    short_code = db.Column(db.String(8), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    clicks = db.Column(db.Integer, nullable=False, default=0)
@@ -0,0 +1,76 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+
+class HasherBusy(Exception):
+    """Raised when too many password hashes are already queued"""
+
+
+class PasswordHasher:
+    """Run bcrypt on a small bounded thread pool
+
+    bcrypt releases the GIL, so a couple of threads keep password checks off
+    the rest of the worker's CPU budget. At most BCRYPT_MAX_PENDING checks
+    may be running or queued; beyond that callers get HasherBusy instead of
+    piling up, which keeps login floods from pinning every worker.
+    """
+
+    def __init__(self):
+        self.log_rounds = 12
+        self.timeout = 10
+        self._executor = None
+        self._executor_pid = None
+        self._max_workers = 2
+        self._slots = threading.BoundedSemaphore(16)
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def init_app(self, app):
+        self.log_rounds = app.config.get('BCRYPT_LOG_ROUNDS', 12)
+        self.timeout = app.config.get('BCRYPT_TIMEOUT', 10)
+        self._max_workers = app.config.get('BCRYPT_WORKERS', 2)
+        self._slots = threading.BoundedSemaphore(app.config.get('BCRYPT_MAX_PENDING', 16))
+        self._executor = None
+        app.extensions['password_hasher'] = self
+
+    def hash(self, password):
+        from app import bcrypt
+        return self._run(bcrypt.generate_password_hash, password, self.log_rounds).decode('utf-8')
+
+    def check(self, password_hash, password):
+        from app import bcrypt
+        return self._run(bcrypt.check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """Whether a stored hash was made with a different work factor"""
+        try:
+            return int(password_hash.split('$')[2]) != self.log_rounds
+        except (AttributeError, IndexError, ValueError):
+            return False
+
+    def _run(self, func, *args):
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HasherBusy('Too many password checks in progress')
+        try:
+            future = self._pool().submit(func, *args)
+        except Exception:
+            slots.release()
+            raise
+        # The slot is held until bcrypt finishes, even if the caller times out
+        future.add_done_callback(lambda _: slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise HasherBusy('Password check timed out')
+
+    def _pool(self):
+        # One pool per process; threads do not survive a fork
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self._max_workers, thread_name_prefix='bcrypt')
+                self._executor_pid = os.getpid()
+            return self._executor
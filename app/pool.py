@@ -0,0 +1,126 @@
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+
+# Defaults per deployment style; DB_POOL_* settings override them
+POOL_PROFILES = {
+    # One request at a time per worker (gunicorn sync / gthread with few threads)
+    'sync': {'pool_size': 5, 'max_overflow': 5, 'pool_timeout': 30},
+    # Many concurrent greenlets per worker, fail fast instead of queueing
+    'gevent': {'pool_size': 20, 'max_overflow': 20, 'pool_timeout': 10},
+    # PgBouncer in transaction mode does the pooling
+    'pgbouncer': {'poolclass': NullPool},
+}
+
+
+class PoolMetrics:
+    """Checkout wait and saturation counters for one engine's pool"""
+
+    def __init__(self, name='primary'):
+        self.name = name
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += seconds
+            if seconds > self.wait_max:
+                self.wait_max = seconds
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def snapshot(self, pool=None):
+        stats = {
+            'checkouts': self.checkouts,
+            'timeouts': self.timeouts,
+            'wait_total': self.wait_total,
+            'wait_max': self.wait_max,
+            'wait_avg': self.wait_total / self.checkouts if self.checkouts else 0.0
+        }
+        if isinstance(pool, QueuePool):
+            capacity = pool.size() + max(pool._max_overflow, 0)
+            stats.update({
+                'size': pool.size(),
+                'capacity': capacity,
+                'checked_out': pool.checkedout(),
+                'overflow': max(pool.overflow(), 0),
+                'saturation': pool.checkedout() / capacity if capacity else 0.0
+            })
+        return stats
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection"""
+
+    metrics = None
+
+    @classmethod
+    def reporting_to(cls, metrics):
+        """Subclass recording into metrics; a class attribute survives the pool's recreate() on dispose"""
+        return type(cls.__name__, (cls,), {'metrics': metrics})
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            self.metrics.record_timeout()
+            raise
+        finally:
+            self.metrics.record_wait(time.perf_counter() - start)
+
+
+def pool_stats(engine):
+    """PoolMetrics snapshot of an engine's pool; None for pools that are not instrumented"""
+    metrics = getattr(engine.pool, 'metrics', None)
+    return metrics.snapshot(engine.pool) if metrics is not None else None
+
+
+def build_engine_options(config, name='primary'):
+    """Build SQLALCHEMY_ENGINE_OPTIONS from the DB_POOL_* settings
+
+    Each call gets its own PoolMetrics, reported under name.
+    """
+    uri = config.get('SQLALCHEMY_DATABASE_URI') or ''
+    if uri.startswith('sqlite') and (uri in ('sqlite://', 'sqlite:///') or ':memory:' in uri):
+        # In-memory SQLite gets a static pool from Flask-SQLAlchemy
+        return {}
+
+    profile = config.get('DB_POOL_PROFILE', 'sync')
+    if profile not in POOL_PROFILES:
+        raise RuntimeError(f"Unknown DB_POOL_PROFILE '{profile}', "
+                           f"expected one of {', '.join(POOL_PROFILES)}")
+    options = dict(POOL_PROFILES[profile])
+    if options.get('poolclass') is NullPool:
+        return options
+
+    options['poolclass'] = InstrumentedQueuePool.reporting_to(PoolMetrics(name))
+    for key, setting in (('pool_size', 'DB_POOL_SIZE'),
+                         ('max_overflow', 'DB_MAX_OVERFLOW'),
+                         ('pool_timeout', 'DB_POOL_TIMEOUT'),
+                         ('pool_recycle', 'DB_POOL_RECYCLE')):
+        if config.get(setting) is not None:
+            options[key] = int(config[setting])
+    options['pool_pre_ping'] = config.get('DB_POOL_PRE_PING', True)
+    return options
+
+
+def _enable_foreign_keys(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA foreign_keys=ON')
+    cursor.close()
+
+
+def enable_sqlite_foreign_keys(engine):
+    """Enforce foreign keys (and ON DELETE CASCADE) on every SQLite connection"""
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine, 'connect', _enable_foreign_keys)
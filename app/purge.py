@@ -0,0 +1,115 @@
+"""Removal of expired links, of click data whose link is gone and of unused tags
+
+Every statement deletes at most batch_size rows, chosen by a LIMITed
+subquery (DELETE ... WHERE key IN (SELECT key ... LIMIT n)), and commits
+on its own, so locks are held for one small batch at a time and writers
+get in between batches (more so with a pause). An interrupted purge can
+simply be run again.
+"""
+import logging
+import time
+from datetime import datetime
+
+from sqlalchemy import delete, distinct, exists, select, tuple_
+
+from app import db
+from app.models import ShortURL, ClickEvent, ClickStatMinute, ClickStatDay, LinkTag, Tag
+
+logger = logging.getLogger(__name__)
+
+# Click tables keyed by short code, and the columns that identify a row
+CLICK_TABLES = (
+    (ClickEvent.__table__, ('id',)),
+    (ClickStatMinute.__table__, ('short_code', 'bucket')),
+    (ClickStatDay.__table__, ('short_code', 'day')),
+)
+
+
+def _delete_batch(table, key, where, batch_size, returning=None):
+    """One bounded DELETE, committed; the result rows of `returning`, or the row count"""
+    key_columns = [table.c[name] for name in key]
+    target = key_columns[0] if len(key_columns) == 1 else tuple_(*key_columns)
+    stmt = delete(table).where(target.in_(select(*key_columns).where(where).limit(batch_size)))
+    if returning is not None:
+        stmt = stmt.returning(returning)
+    result = db.session.execute(stmt)
+    rows = result.scalars().all() if returning is not None else result.rowcount
+    db.session.commit()
+    return rows
+
+
+def delete_click_data(short_codes, batch_size=1000, pause=0.0):
+    """Delete every click row for these short codes, batch by batch; returns the count"""
+    deleted = 0
+    for start in range(0, len(short_codes), batch_size):
+        chunk = short_codes[start:start + batch_size]
+        for table, key in CLICK_TABLES:
+            while True:
+                count = _delete_batch(table, key, table.c.short_code.in_(chunk), batch_size)
+                deleted += count
+                if count < batch_size:
+                    break
+                time.sleep(pause)
+    return deleted
+
+
+def purge_expired_links(batch_size=1000, pause=0.0, max_batches=None, now=None):
+    """Delete links whose expires_at has passed, then their click data
+
+    Returns (links deleted, click rows deleted).
+    """
+    table = ShortURL.__table__
+    now = now or datetime.utcnow()
+    expired = table.c.expires_at <= now
+    links = clicks = batches = 0
+    while max_batches is None or batches < max_batches:
+        codes = _delete_batch(table, ('id',), expired, batch_size, returning=table.c.short_code)
+        batches += 1
+        links += len(codes)
+        # The links are gone first: a crash in between leaves orphans for
+        # purge_orphaned_clicks rather than clicks without their cleanup
+        clicks += delete_click_data(codes, batch_size, pause)
+        if len(codes) < batch_size:
+            break
+        time.sleep(pause)
+    if links:
+        logger.info(f"Purged {links} expired links and {clicks} click rows")
+    return links, clicks
+
+
+def purge_orphaned_clicks(batch_size=1000, pause=0.0):
+    """Delete click data for short codes that no longer have a link
+
+    Covers links deleted through the API or by a user's cascade, and
+    clicks recorded for a link just before it was purged. Returns the
+    number of click rows deleted.
+    """
+    links = ShortURL.__table__
+    deleted = 0
+    for table, _ in CLICK_TABLES:
+        orphaned = ~exists().where(links.c.short_code == table.c.short_code)
+        while True:
+            codes = db.session.execute(
+                select(distinct(table.c.short_code)).where(orphaned).limit(batch_size)).scalars().all()
+            db.session.commit()
+            deleted += delete_click_data(codes, batch_size, pause)
+            if len(codes) < batch_size:
+                break
+            time.sleep(pause)
+    if deleted:
+        logger.info(f"Purged {deleted} orphaned click rows")
+    return deleted
+
+
+def purge_unused_tags(batch_size=1000, pause=0.0):
+    """Delete tags no link carries any more; returns how many"""
+    tags = Tag.__table__
+    unused = ~exists().where(LinkTag.__table__.c.tag_id == tags.c.id)
+    deleted = 0
+    while True:
+        count = _delete_batch(tags, ('id',), unused, batch_size)
+        deleted += count
+        if count < batch_size:
+            break
+        time.sleep(pause)
+    return deleted
@@ -0,0 +1,232 @@
+import logging
+import math
+import re
+import time
+from functools import wraps
+
+from flask import request
+
+from app.utils import client_ip
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+RATE = re.compile(r'\s*(\d+)\s*/\s*(\d*)\s*(second|minute|hour|day)s?\s*')
+
+
+def parse_rate(value):
+    """'60/minute' or '1000/10 seconds' -> (interval between tokens, burst); None if unset
+
+    The burst is the count: a client may spend the whole allowance at
+    once, then earns one request back every period/count seconds.
+    """
+    if not value:
+        return None
+    match = RATE.fullmatch(value)
+    if match is None:
+        raise RuntimeError(f"Invalid rate limit '{value}', expected e.g. 60/minute")
+    count, multiplier, unit = match.groups()
+    count = int(count)
+    if count <= 0:
+        return None
+    period = (int(multiplier) if multiplier else 1) * PERIODS[unit]
+    return period / count, count
+
+
+class TokenBuckets:
+    """In-process token buckets, one float per key
+
+    Each bucket is stored as its theoretical arrival time (GCRA): the
+    moment it would be full again. Taking a token pushes that time
+    forward by one interval; a request is refused while doing so would
+    put it more than a burst's worth of intervals ahead of now. There is
+    no lock: two threads racing on one key can both be let through,
+    which errs on the side of the client. Idle buckets are swept once
+    more than max_keys are tracked.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = {}
+
+    def take(self, key, interval, burst, cost=1):
+        """0.0 if allowed, otherwise seconds until the request would be"""
+        now = time.monotonic()
+        tat = self._buckets.get(key, now)
+        if tat < now:
+            tat = now
+        tat += interval * cost
+        wait = tat - now - interval * burst
+        if wait > 0:
+            return wait
+        buckets = self._buckets
+        buckets[key] = tat
+        if len(buckets) > self.max_keys:
+            self._sweep(now)
+        return 0.0
+
+    def _sweep(self, now):
+        # A bucket whose arrival time has passed is full, the same as absent
+        for key, tat in list(self._buckets.items()):
+            if tat <= now:
+                self._buckets.pop(key, None)
+        if len(self._buckets) > self.max_keys:
+            logger.warning(f"Rate limiter tracking over {self.max_keys} active keys, resetting")
+            self._buckets.clear()
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+def _user():
+    from flask_jwt_extended import get_jwt_identity
+    return get_jwt_identity()
+
+
+def _account():
+    # Login and registration attempts, keyed by the email they target
+    data = request.get_json(silent=True)
+    email = data.get('email') if isinstance(data, dict) else None
+    return email.strip().lower() if isinstance(email, str) else None
+
+
+# Scope -> function returning the bucket key for the current request
+SCOPES = {
+    'ip': client_ip,
+    'user': _user,
+    'account': _account,
+    'endpoint': lambda: '*',
+}
+
+
+class RateLimiter:
+    """Token-bucket limits per IP, user, account or endpoint, from RATELIMIT_<NAME>_PER_<SCOPE>
+
+    Buckets live in each worker unless RATELIMIT_STORAGE names a shared
+    backend (a redis:// URL), in which case every worker draws from the
+    same bucket. A failing shared backend lets requests through.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.rules = {}
+        self._scopes = {}
+        self.buckets = TokenBuckets()
+        self.backend = None
+        self.key_prefix = 'shortener:rl:'
+        self._backend_retry_at = 0.0
+        self.allowed = 0
+        self.limited = {}
+        self.backend_errors = 0
+
+    def init_app(self, app):
+        self.configure(app.config)
+        app.extensions['rate_limiter'] = self
+
+    def configure(self, config):
+        from app.cache_backends import get_backend
+
+        self.enabled = config.get('RATELIMIT_ENABLED', True)
+        self.rules = {}
+        for key, value in config.items():
+            if key.startswith('RATELIMIT_') and '_PER_' in key:
+                name, scope = key[len('RATELIMIT_'):].lower().rsplit('_per_', 1)
+                if scope not in SCOPES:
+                    raise RuntimeError(f"Unknown rate limit scope in {key}, expected one of "
+                                       f"{', '.join(SCOPES)}")
+                rate = parse_rate(value)
+                if rate is not None:
+                    self.rules[(name, scope)] = rate
+        self._scopes = {}
+        for name, scope in self.rules:
+            self._scopes.setdefault(name, []).append(scope)
+        self.buckets = TokenBuckets(config.get('RATELIMIT_MAX_KEYS', 100000))
+        storage = config.get('RATELIMIT_STORAGE')
+        self.backend = get_backend(storage, config.get('CACHE_SOCKET_TIMEOUT', 0.25)) \
+            if storage and storage != 'memory' else None
+        self.key_prefix = f"{config.get('CACHE_KEY_PREFIX', 'shortener:')}rl:"
+
+    def limits(self, name):
+        """Scopes with a configured limit for name"""
+        return self._scopes.get(name, ())
+
+    def max_cost(self, name):
+        """Smallest burst among name's limits, the most one request can take; None if unlimited"""
+        if not self.enabled or not self.limits(name):
+            return None
+        return min(self.rules[(name, scope)][1] for scope in self.limits(name))
+
+    def take(self, name, scope, value, cost=1):
+        """0.0 if allowed, otherwise seconds to wait; unlimited if no rule is configured"""
+        rule = self.rules.get((name, scope))
+        if rule is None or value is None or not self.enabled:
+            return 0.0
+        interval, burst = rule
+        key = f'{name}:{scope}:{value}'
+        if self.backend is None:
+            wait = self.buckets.take(key, interval, burst, cost)
+        else:
+            wait = self._take_shared(key, interval, burst, cost)
+        if wait:
+            self.limited[name] = self.limited.get(name, 0) + 1
+        else:
+            self.allowed += 1
+        return wait
+
+    def _take_shared(self, key, interval, burst, cost):
+        if self._backend_retry_at and time.monotonic() < self._backend_retry_at:
+            return 0.0
+        try:
+            return self.backend.throttle(self.key_prefix + key, interval, burst, cost)
+        except Exception as e:
+            self.backend_errors += 1
+            self._backend_retry_at = time.monotonic() + 1.0
+            logger.warning(f"Rate limit storage unavailable, not limiting: {str(e)}")
+            return 0.0
+
+    def check(self, name, scopes=None, cost=1):
+        """Take from every configured bucket for name; the longest wait, or 0.0"""
+        wait = 0.0
+        for scope in scopes or self.limits(name):
+            if (name, scope) in self.rules:
+                wait = max(wait, self.take(name, scope, SCOPES[scope](), cost))
+        return wait
+
+    def limit(self, name, *scopes):
+        """Decorator answering 429 once any of the view's buckets is empty
+
+        Put it below @jwt_required() when limiting per user.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapped(*args, **kwargs):
+                if self.rules:
+                    wait = self.check(name, scopes)
+                    if wait:
+                        return too_many_requests(wait)
+                return view(*args, **kwargs)
+            return wrapped
+        return decorator
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'shared': self.backend is not None,
+            'rules': len(self.rules),
+            'tracked_keys': len(self.buckets),
+            'allowed': self.allowed,
+            'limited': dict(self.limited),
+            'backend_errors': self.backend_errors
+        }
+
+
+def retry_after_header(wait):
+    return str(max(1, math.ceil(wait)))
+
+
+def too_many_requests(wait):
+    from app.utils import error_response
+
+    response, status = error_response(429, 'Too many requests, please retry later')
+    response.headers['Retry-After'] = retry_after_header(wait)
+    return response, status
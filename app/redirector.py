@@ -0,0 +1,348 @@
+"""Redirect-only ASGI service
+
+Serves GET/HEAD /<short_code> and nothing else. It reuses modules of the
+app package, so Flask and the models are imported, but no Flask app is
+created: requests never see a request context, JWT or an ORM session.
+Lookups go through the same two-tier URL cache (with negative
+caching and the shared CACHE_BACKEND) as the main app and fall back to one
+Core SELECT on an async engine, issued once for concurrent misses, or to
+the redirect snapshot as the main app does. Clicks are handed to the same
+ClickBuffer and ClickAnalytics writers, which flush from background
+threads through a small sync engine, so the event loop never waits on a
+write. Without CACHE_BACKEND, edits and deletes made by the main app
+never reach this process, so links stay in its cache for at most
+CACHE_LOCAL_TTL seconds, as in every other worker. Calls to
+CACHE_BACKEND (L2 reads, leases, fills and shared rate limits) run in
+the loop's default executor; L1 hits stay on the loop.
+
+Run it next to the main app (see asgi.py):
+
+    uvicorn asgi:app --workers 4 --loop uvloop --http httptools
+"""
+import asyncio
+import logging
+import re
+import time
+
+from sqlalchemy import Column, DateTime, MetaData, String, Table, bindparam, create_engine, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.urls import iri_to_uri
+
+from app.analytics import ClickAnalytics
+from app.bloom import ShortCodeFilter
+from app.cache import MISSING, Expiring, URLCache
+from app.clicks import ClickBuffer
+from app.pool import build_engine_options
+from app.ratelimit import RateLimiter, retry_after_header
+from app.redirects import (SHORT_CODE_PATTERN, cache_value, deadline_value, expiring_redirect_policy,
+                           redirect_cache_policy)
+from app.snapshot import RedirectSnapshot
+from app.utils import forwarded_client
+
+logger = logging.getLogger(__name__)
+
+SHORT_CODE_PATH = re.compile(f'/({SHORT_CODE_PATTERN})')
+
+# The columns a lookup reads, without going through the ORM models
+short_url = Table('short_url', MetaData(),
+                  Column('short_code', String(8)),
+                  Column('original_url', String(2048)),
+                  Column('expires_at', DateTime))
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'postgresql+psycopg2': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+    'sqlite+pysqlite': 'sqlite+aiosqlite',
+}
+
+
+def async_database_url(uri):
+    """Swap a sync driver in a database URL for its asyncio counterpart"""
+    url = make_url(uri)
+    drivername = ASYNC_DRIVERS.get(url.drivername)
+    if drivername is None:
+        if url.drivername in ASYNC_DRIVERS.values():
+            return url
+        raise RuntimeError(f"No async driver known for '{url.drivername}'")
+    return url.set(drivername=drivername)
+
+
+class LocationCache(URLCache):
+    """URL cache holding the encoded Location header
+
+    L2 entries stay plain URLs, shared with the main app's URL cache.
+    """
+
+    def serialize(self, value):
+        return value.decode('latin-1')
+
+    def deserialize(self, raw):
+        return iri_to_uri(raw).encode('latin-1')
+
+
+def load_config(config_class='config.Config'):
+    """Upper-case attributes of the config class, as Flask's from_object reads them"""
+    from werkzeug.utils import import_string
+
+    obj = import_string(config_class) if isinstance(config_class, str) else config_class
+    return {key: getattr(obj, key) for key in dir(obj) if key.isupper()}
+
+
+def _response(status, headers, body=b''):
+    return (
+        {'type': 'http.response.start', 'status': status, 'headers': headers},
+        {'type': 'http.response.body', 'body': body},
+    )
+
+
+METHOD_NOT_ALLOWED = _response(405, [(b'allow', b'GET, HEAD'), (b'content-length', b'0')])
+HEALTHY = _response(200, [(b'content-type', b'text/plain'), (b'content-length', b'2')], b'ok')
+UNHEALTHY = _response(503, [(b'content-type', b'text/plain'), (b'content-length', b'11')],
+                      b'unavailable')
+EMPTY_BODY = {'type': 'http.response.body', 'body': b''}
+
+
+class RedirectService:
+    """ASGI application answering /<short_code> with a bare 302 (or 301)"""
+
+    def __init__(self, config):
+        self.config = config
+        uri = config.get('REDIRECT_DATABASE_URL') or config.get('SQLALCHEMY_DATABASE_URI')
+        if not uri:
+            raise RuntimeError("Database URI not configured!")
+
+        self.url_cache = LocationCache()
+        # Without CACHE_BACKEND, configure() caps its TTLs at CACHE_LOCAL_TTL
+        self.url_cache.configure(config)
+        self._loading = {}
+        self.engine = create_async_engine(async_database_url(uri),
+                                          **self._async_pool_options(config, uri))
+
+        # Click writes run on background threads and need a sync engine
+        self.write_engine = create_engine(uri, **build_engine_options(
+            dict(config, SQLALCHEMY_DATABASE_URI=uri, DB_POOL_SIZE=2, DB_MAX_OVERFLOW=0), 'redirect writes'))
+        self.click_buffer = ClickBuffer()
+        self.click_buffer.init_engine(self.write_engine, config)
+        self.click_analytics = ClickAnalytics()
+        self.click_analytics.init_engine(self.write_engine, config)
+        self.short_code_filter = ShortCodeFilter()
+        self.short_code_filter.init_engine(self.write_engine, config)
+        self.rate_limiter = RateLimiter()
+        self.rate_limiter.configure(config)
+        self.proxy_hops = config.get('PROXY_FIX_X_FOR', 0)
+        self.redirect_snapshot = RedirectSnapshot()
+        self.redirect_snapshot.init_engine(self.write_engine, config, self.url_cache)
+
+        status, cache_control, miss_cache_control = redirect_cache_policy(config)
+        self.status = status
+        self.cache_control = cache_control.encode('latin-1')
+        self.not_found = _response(404, [(b'content-type', b'text/plain'),
+                                         (b'content-length', b'9'),
+                                         (b'cache-control', miss_cache_control.encode('latin-1'))],
+                                   b'Not Found')
+
+        self.lookup = select(short_url.c.original_url, short_url.c.expires_at).where(
+            short_url.c.short_code == bindparam('code'))
+
+    @staticmethod
+    def _async_pool_options(config, uri):
+        if uri.startswith('sqlite'):
+            return {}
+        if config.get('DB_POOL_PROFILE') == 'pgbouncer':
+            from sqlalchemy.pool import NullPool
+            return {'poolclass': NullPool}
+        options = {'pool_pre_ping': config.get('DB_POOL_PRE_PING', True)}
+        for key, setting in (('pool_size', 'DB_POOL_SIZE'),
+                             ('max_overflow', 'DB_MAX_OVERFLOW'),
+                             ('pool_timeout', 'DB_POOL_TIMEOUT'),
+                             ('pool_recycle', 'DB_POOL_RECYCLE')):
+            if config.get(setting) is not None:
+                options[key] = int(config[setting])
+        return options
+
+    async def __call__(self, scope, receive, send):
+        scope_type = scope['type']
+        if scope_type == 'http':
+            await self.handle(scope, send)
+        elif scope_type == 'lifespan':
+            await self.lifespan(receive, send)
+
+    async def handle(self, scope, send):
+        method = scope['method']
+        if method != 'GET' and method != 'HEAD':
+            return await self._send(send, METHOD_NOT_ALLOWED)
+
+        path = scope['path']
+        if path == '/healthz':
+            return await self._send(send, HEALTHY if await self.healthy() else UNHEALTHY)
+        match = SHORT_CODE_PATH.fullmatch(path)
+        if match is None:
+            return await self._send(send, self.not_found)
+        short_code = match.group(1)
+        if self.rate_limiter.rules:
+            if self.rate_limiter.backend is not None:
+                wait = await self._blocking(self._throttle, scope)
+            else:
+                wait = self._throttle(scope)
+            if wait:
+                return await self._send(send, _response(429, [
+                    (b'content-type', b'text/plain'),
+                    (b'content-length', b'17'),
+                    (b'retry-after', retry_after_header(wait).encode('latin-1'))],
+                    b'Too Many Requests'))
+
+        # The cache holds the encoded Location header rather than the URL
+        cache = self.url_cache
+        location = cache.get_local(short_code)
+        if location is None and cache.backend is not None:
+            location = await self._blocking(cache.get_shared, short_code)
+        if location is None:
+            if not self.short_code_filter.might_exist(short_code):
+                return await self._send(send, self.not_found)
+            location = await self._coalesce(short_code)
+        if location is MISSING:
+            return await self._send(send, self.not_found)
+
+        status, cache_control = self.status, self.cache_control
+        if type(location) is Expiring:
+            location, expires_at = location
+            status, cache_control = expiring_redirect_policy(self.config, expires_at - time.time())
+            cache_control = cache_control.encode('latin-1')
+
+        self.click_buffer.record(short_code)
+        if self.click_analytics.enabled:
+            self._record_analytics(scope, short_code)
+
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'location', location),
+                        (b'cache-control', cache_control),
+                        (b'content-length', b'0')]
+        })
+        await send(EMPTY_BODY)
+
+    @staticmethod
+    async def _blocking(fn, *args):
+        """Run a call that waits on CACHE_BACKEND (up to CACHE_SOCKET_TIMEOUT) off the event loop"""
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    def _throttle(self, scope):
+        # Only the per-IP and whole-endpoint redirect limits apply here
+        wait = self.rate_limiter.take('redirect', 'ip', self._client_address(scope))
+        return max(wait, self.rate_limiter.take('redirect', 'endpoint', '*'))
+
+    async def _coalesce(self, short_code):
+        """Look a missed code up once for every request waiting on it"""
+        future = self._loading.get(short_code)
+        if future is not None:
+            self.url_cache.coalesced += 1
+            return await asyncio.shield(future)
+
+        future = self._loading[short_code] = asyncio.get_running_loop().create_future()
+        try:
+            location = await self._load(short_code)
+            future.set_result(location)
+            return location
+        except Exception as e:
+            future.set_exception(e)
+            # Waiters get the error; mark it retrieved in case there are none
+            future.exception()
+            raise
+        finally:
+            del self._loading[short_code]
+            if not future.done():
+                future.cancel()
+
+    async def _load(self, short_code):
+        cache = self.url_cache
+        shared = cache.backend is not None
+        lease = await self._blocking(cache.begin_fill, short_code) if shared else cache.begin_fill(short_code)
+        if not lease.held:
+            # Another worker is loading this code: wait for it in L2
+            deadline = time.monotonic() + cache.coalesce_timeout
+            delay = 0.002
+            while time.monotonic() < deadline:
+                await asyncio.sleep(delay)
+                location = await self._blocking(cache.poll_fill, short_code, lease)
+                if location is not None:
+                    return location
+                delay = min(delay * 2, 0.05)
+
+        snapshot = self.redirect_snapshot
+        found = snapshot.lookup(short_code) if snapshot.serves_first(short_code) else None
+        if found is None:
+            try:
+                async with self.engine.connect() as conn:
+                    row = (await conn.execute(self.lookup, {'code': short_code})).first()
+            except SQLAlchemyError:
+                # Stale-if-error, as in the main app
+                found = snapshot.stale(short_code) if snapshot.enabled else None
+                if found is None:
+                    raise
+        if found is not None:
+            location = deadline_value(iri_to_uri(found[0]).encode('latin-1'), found[1])
+        else:
+            location = MISSING if row is None else cache_value(
+                iri_to_uri(row.original_url).encode('latin-1'), row.expires_at)
+        if shared:
+            await self._blocking(cache.fill, short_code, location, lease)
+        else:
+            cache.fill(short_code, location, lease)
+        return location
+
+    def _record_analytics(self, scope, short_code):
+        referrer = user_agent = None
+        for name, value in scope['headers']:
+            if name == b'referer':
+                referrer = value.decode('latin-1')
+            elif name == b'user-agent':
+                user_agent = value.decode('latin-1')
+        self.click_analytics.enqueue(short_code, referrer, user_agent, self._client_address(scope))
+
+    def _client_address(self, scope):
+        """The client's address, from X-Forwarded-For behind PROXY_FIX_X_FOR proxies, as in the main app"""
+        client = scope.get('client')
+        address = client[0] if client else None
+        if self.proxy_hops:
+            forwarded = [value.decode('latin-1') for name, value in scope['headers']
+                         if name == b'x-forwarded-for']
+            if forwarded:
+                return forwarded_client(','.join(forwarded), self.proxy_hops) or address
+        return address
+
+    async def healthy(self):
+        try:
+            async with self.engine.connect() as conn:
+                await conn.exec_driver_sql('SELECT 1')
+            return True
+        except Exception as e:
+            logger.error(f"Redirect service health check failed: {str(e)}")
+            return False
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.click_buffer.shutdown()
+                self.click_analytics.shutdown()
+                await self.engine.dispose()
+                self.write_engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    async def _send(send, response):
+        start, body = response
+        await send(start)
+        await send(body)
+
+
+def create_redirect_app(config_class='config.Config'):
+    logging.basicConfig(level=logging.INFO)
+    return RedirectService(load_config(config_class))
@@ -0,0 +1,123 @@
+import time
+from datetime import timezone
+
+from flask import Blueprint, Response, current_app, request
+from werkzeug.routing import BaseConverter
+from sqlalchemy.exc import SQLAlchemyError
+from app import (db, url_cache, click_buffer, click_analytics, short_code_filter, rate_limiter, replicas,
+                 redirect_snapshot)
+from app.cache import MISSING, Expiring
+from app.models import ShortURL
+from app.ratelimit import retry_after_header
+
+# Anything a short code can be: allocated base62 codes and validated custom codes
+SHORT_CODE_PATTERN = r'[A-Za-z0-9]{3,8}'
+
+redirects_bp = Blueprint('redirects', __name__)
+
+
+class ShortCodeConverter(BaseConverter):
+    """URL converter that only matches well-formed short codes"""
+
+    regex = SHORT_CODE_PATTERN
+
+
+def redirect_cache_policy(config):
+    """(status, Cache-Control for redirects, Cache-Control for misses)
+
+    Redirects are 302 with REDIRECT_MAX_AGE (0 means revalidate every
+    time, so every click reaches the origin and is counted). With
+    REDIRECT_PERMANENT_MAX_AGE set, links are treated as immutable and
+    served as 301 cacheable for that long by browsers and CDNs.
+    """
+    max_age = config.get('REDIRECT_MAX_AGE', 0)
+    permanent_max_age = config.get('REDIRECT_PERMANENT_MAX_AGE', 0)
+    miss = f'public, max-age={max_age}' if max_age > 0 else 'no-cache'
+    if permanent_max_age > 0:
+        return 301, f'public, max-age={permanent_max_age}', miss
+    return 302, miss, miss
+
+
+def expiring_redirect_policy(config, remaining):
+    """(status, Cache-Control) for a link that expires in `remaining` seconds
+
+    Never a 301, and never cacheable past the expiry.
+    """
+    max_age = min(max(config.get('REDIRECT_MAX_AGE', 0), config.get('REDIRECT_PERMANENT_MAX_AGE', 0)),
+                  int(remaining))
+    return 302, f'public, max-age={max_age}' if max_age > 0 else 'no-cache'
+
+
+def cache_value(value, expires_at):
+    """URL cache entry for a link: value as is, Expiring if the link has an
+    expiry, MISSING once it has passed"""
+    if expires_at is None:
+        return value
+    return deadline_value(value, expires_at.replace(tzinfo=timezone.utc).timestamp())
+
+
+def deadline_value(value, deadline):
+    """cache_value for an expiry given as epoch seconds (None for never)"""
+    if deadline is None:
+        return value
+    if deadline <= time.time():
+        return MISSING
+    return Expiring(value, deadline)
+
+
+def _load_original_url(short_code):
+    if redirect_snapshot.serves_first(short_code):
+        found = redirect_snapshot.lookup(short_code)
+        if found is not None:
+            return deadline_value(*found)
+    try:
+        row = replicas.load(lambda: db.session.query(ShortURL.original_url, ShortURL.expires_at).filter_by(
+            short_code=short_code).first(), short_code=short_code)
+    except SQLAlchemyError:
+        db.session.rollback()
+        # Stale-if-error: a link as of the snapshot beats a 500
+        found = redirect_snapshot.stale(short_code) if redirect_snapshot.enabled else None
+        if found is None:
+            raise
+        return deadline_value(*found)
+    return MISSING if row is None else cache_value(row.original_url, row.expires_at)
+
+
+def resolve_redirect(short_code):
+    """Redirect response for a short code, or a plain-text 404"""
+    status, cache_control, miss_cache_control = current_app.extensions['redirect_policy']
+
+    wait = rate_limiter.check('redirect')
+    if wait:
+        return Response('Too Many Requests', status=429, mimetype='text/plain',
+                        headers={'Retry-After': retry_after_header(wait)})
+
+    original_url = url_cache.get(short_code)
+    # Codes the filter has never seen are answered without a query
+    if original_url is None and short_code_filter.might_exist(short_code):
+        original_url = url_cache.coalesce(short_code, lambda: _load_original_url(short_code))
+    if original_url is None or original_url is MISSING:
+        return Response('Not Found', status=404, mimetype='text/plain',
+                        headers={'Cache-Control': miss_cache_control})
+
+    if type(original_url) is Expiring:
+        original_url, expires_at = original_url
+        status, cache_control = expiring_redirect_policy(current_app.config, expires_at - time.time())
+
+    click_buffer.record(short_code)
+    click_analytics.record(short_code, request)
+    return Response(status=status, headers={
+        'Location': original_url,
+        'Cache-Control': cache_control
+    })
+
+
+@redirects_bp.route('/<short_code:short_code>', methods=['GET'])
+def redirect_short_url(short_code):
+    """Public short link: SHORT_DOMAIN/<short_code>"""
+    return resolve_redirect(short_code)
+
+
+def init_redirects(app):
+    app.url_map.converters['short_code'] = ShortCodeConverter
+    app.extensions['redirect_policy'] = redirect_cache_policy(app.config)
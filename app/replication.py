@@ -0,0 +1,299 @@
+"""Read replicas for read-only queries
+
+With DATABASE_REPLICA_URLS set, views marked read-only (and the redirect
+lookup) run their queries on a replica, taken round-robin among those
+that passed the last health check; writes, and anything inside a flush,
+always go to the primary. A background thread checks every replica each
+REPLICA_HEALTH_INTERVAL seconds (and on Postgres skips replicas further
+behind than REPLICA_MAX_LAG); a replica that fails a query is taken out
+until it passes a check again, and the query is retried on the primary.
+
+Read-your-writes: writes mark the user and the short codes involved for
+REPLICA_STICKY_SECONDS, during which their reads go to the primary. Marks
+are kept in the shared CACHE_BACKEND when there is one, so they hold on
+every worker, and in the worker otherwise.
+"""
+import itertools
+import logging
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql.dml import UpdateBase
+
+from app.pool import build_engine_options, pool_stats
+
+logger = logging.getLogger(__name__)
+
+# Seconds since the last replayed transaction; NULL on a primary
+POSTGRES_LAG = text(
+    "SELECT CASE WHEN pg_is_in_recovery() "
+    "THEN extract(epoch FROM now() - pg_last_xact_replay_timestamp()) END")
+
+
+class RoutingSession(Session):
+    """db.session that sends reads to the replica chosen for this app context"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not isinstance(clause, UpdateBase) \
+                and has_app_context():
+            replica = g.get('read_replica')
+            if replica is not None:
+                return replica.engine
+        return super().get_bind(mapper, clause, bind, **kwargs)
+
+
+class Replica:
+    def __init__(self, name, url, engine):
+        self.name = name
+        self.url = url
+        self.engine = engine
+        self.healthy = True
+        self.lag = None
+        self.reads = 0
+        self.errors = 0
+
+
+class ReplicaRouter:
+    """Chooses where read-only queries run and remembers recent writers"""
+
+    def __init__(self):
+        self.replicas = []
+        self.sticky_seconds = 10.0
+        self.health_interval = 5.0
+        self.max_lag = 10.0
+        self.backend = None
+        self.key_prefix = 'shortener:rw:'
+        self._backend_retry_at = 0.0
+        self._sticky = {}
+        self._sticky_max = 100000
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._thread_pid = None
+        self._stop = threading.Event()
+        self.primary_reads = {}
+
+    def init_app(self, app):
+        self.configure(app.config)
+        app.extensions['replicas'] = self
+
+    def configure(self, config):
+        from app.cache_backends import get_backend
+
+        self.dispose()
+        self.replicas = []
+        for index, url in enumerate(config.get('DATABASE_REPLICA_URLS') or ()):
+            # Credentials stay out of logs and metrics
+            name = f"{index}:{make_url(url).host or make_url(url).database}"
+            options = build_engine_options(dict(config, SQLALCHEMY_DATABASE_URI=url), f'replica {name}')
+            engine = create_engine(url, echo=config.get('SQLALCHEMY_ECHO', False), **options)
+            self.replicas.append(Replica(name, url, engine))
+        self.sticky_seconds = config.get('REPLICA_STICKY_SECONDS', 10.0)
+        self.health_interval = config.get('REPLICA_HEALTH_INTERVAL', 5.0)
+        self.max_lag = config.get('REPLICA_MAX_LAG', 10.0)
+        self.backend = get_backend(config.get('CACHE_BACKEND'), config.get('CACHE_SOCKET_TIMEOUT', 0.25))
+        self.key_prefix = f"{config.get('CACHE_KEY_PREFIX', 'shortener:')}rw:"
+        self._sticky = {}
+        self.primary_reads = {}
+
+    def engines(self):
+        return [replica.engine for replica in self.replicas]
+
+    # Read-your-writes
+
+    def mark_written(self, user_id=None, short_codes=()):
+        """Send this user's and these codes' reads to the primary for a while"""
+        if not self.replicas:
+            return
+        keys = [f'code:{code}' for code in short_codes]
+        if user_id is not None:
+            keys.append(f'user:{user_id}')
+        until = time.time() + self.sticky_seconds
+        if len(self._sticky) >= self._sticky_max:
+            now = time.time()
+            self._sticky = {key: value for key, value in self._sticky.items() if value > now}
+        for key in keys:
+            self._sticky[key] = until
+        if self.backend is not None:
+            try:
+                self.backend.set_many({self.key_prefix + key: '1' for key in keys}, self.sticky_seconds)
+            except Exception as e:
+                logger.warning(f"Could not share read-your-writes marks: {str(e)}")
+
+    def is_sticky(self, user_id=None, short_code=None):
+        keys = []
+        if short_code is not None:
+            keys.append(f'code:{short_code}')
+        if user_id is not None:
+            keys.append(f'user:{user_id}')
+        now = time.time()
+        if any(self._sticky.get(key, 0) > now for key in keys):
+            return True
+        if self.backend is not None:
+            # Without the marks a recent writer could read stale data, so
+            # an unavailable backend sends reads to the primary for a second
+            if self._backend_retry_at and time.monotonic() < self._backend_retry_at:
+                return True
+            try:
+                return any(self.backend.get(self.key_prefix + key) is not None for key in keys)
+            except Exception as e:
+                self._backend_retry_at = time.monotonic() + 1.0
+                logger.warning(f"Read-your-writes marks unavailable, reading the primary: {str(e)}")
+                return True
+        return False
+
+    # Routing
+
+    def choose(self):
+        """Next healthy replica, round-robin, or None for the primary"""
+        if not self.replicas:
+            return None
+        self._ensure_checking()
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            self._count_primary('unavailable')
+            return None
+        return healthy[next(self._counter) % len(healthy)]
+
+    def route(self, user_id=None, short_code=None):
+        """Replica for this context's reads (None: the primary) unless the
+        user or code was written recently"""
+        replica = None
+        if self.replicas:
+            if self.is_sticky(user_id, short_code):
+                self._count_primary('sticky')
+            else:
+                replica = self.choose()
+        g.read_replica = replica
+        if replica is not None:
+            replica.reads += 1
+        return replica
+
+    def failed(self, replica, error):
+        """Take a replica out after a failed query; the next check may bring it back"""
+        replica.healthy = False
+        replica.errors += 1
+        self._count_primary('error')
+        logger.warning(f"Read replica {replica.name} failed, using the primary: {str(error)}")
+
+    def read_only(self, view):
+        """Run a view's queries on a replica, retrying once on the primary
+        if the replica fails
+
+        Put it below @jwt_required(): the current user's recent writes keep
+        their reads on the primary.
+        """
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            if not self.replicas:
+                return view(*args, **kwargs)
+            from flask_jwt_extended import get_jwt_identity
+            from app import db
+
+            replica = self.route(user_id=get_jwt_identity())
+            try:
+                return view(*args, **kwargs)
+            except OperationalError as e:
+                # Refused or dropped connections; the view is read-only,
+                # so running it again is safe
+                if replica is None:
+                    raise
+                self.failed(replica, e)
+                db.session.rollback()
+                g.read_replica = None
+                return view(*args, **kwargs)
+        return wrapped
+
+    def load(self, fn, short_code=None):
+        """fn() on a replica, then on the primary if the replica fails or
+        finds nothing (None): the row may be newer than the replica's copy"""
+        if not self.replicas:
+            return fn()
+        from app import db
+
+        replica = self.route(short_code=short_code)
+        try:
+            result = fn()
+            if result is not None or replica is None:
+                return result
+            self._count_primary('miss')
+        except OperationalError as e:
+            if replica is None:
+                raise
+            self.failed(replica, e)
+            db.session.rollback()
+        finally:
+            g.read_replica = None
+        return fn()
+
+    def _count_primary(self, reason):
+        self.primary_reads[reason] = self.primary_reads.get(reason, 0) + 1
+
+    # Health checks
+
+    def check(self, replica):
+        """Run one health check and record the result"""
+        try:
+            with replica.engine.connect() as conn:
+                if replica.engine.dialect.name == 'postgresql':
+                    lag = conn.execute(POSTGRES_LAG).scalar()
+                else:
+                    conn.execute(text('SELECT 1'))
+                    lag = None
+            replica.lag = float(lag) if lag is not None else None
+            healthy = replica.lag is None or not self.max_lag or replica.lag <= self.max_lag
+            if healthy != replica.healthy:
+                logger.info(f"Read replica {replica.name} is {'back' if healthy else 'lagging'}"
+                            + (f" ({replica.lag:.1f}s behind)" if replica.lag is not None else ''))
+            replica.healthy = healthy
+        except Exception as e:
+            if replica.healthy:
+                logger.warning(f"Read replica {replica.name} failed its health check: {str(e)}")
+            replica.healthy = False
+        return replica.healthy
+
+    def _ensure_checking(self):
+        # One checker thread per process; a forked worker starts its own
+        if self._thread is not None and self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread_pid == os.getpid():
+                return
+            self._stop = threading.Event()
+            self._thread_pid = os.getpid()
+            self._thread = threading.Thread(target=self._check_loop, args=(self._stop,),
+                                            name='replica-health', daemon=True)
+            self._thread.start()
+
+    def _check_loop(self, stop):
+        while not stop.wait(self.health_interval):
+            for replica in self.replicas:
+                self.check(replica)
+
+    def dispose(self, close=True):
+        """Stop the checker and drop replica connections
+
+        After a fork, pass close=False: the connections are the parent's,
+        and the child only forgets them.
+        """
+        self._stop.set()
+        self._thread = None
+        for replica in self.replicas:
+            replica.engine.dispose(close=close)
+
+    def stats(self):
+        return {
+            'replicas': [{'name': replica.name, 'healthy': replica.healthy, 'lag': replica.lag,
+                          'reads': replica.reads, 'errors': replica.errors,
+                          'pool': pool_stats(replica.engine)}
+                         for replica in self.replicas],
+            'primary_reads': dict(self.primary_reads),
+            'sticky_keys': len(self._sticky),
+        }
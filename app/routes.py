@@ -1,15 +1,29 @@
-from flask import Blueprint, request, jsonify, redirect, current_app
-from app.models import ShortURL
-from app.utils import validate_url, error_response, generate_short_code
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from app import db
-from datetime import datetime
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+from app.models import ShortURL, ClickStatMinute, ClickStatDay
+from app.utils import validate_url, validate_short_code, error_response, url_hash, is_url_hash_conflict, parse_expiry
+from app.codes import is_short_code_conflict
+from app.purge import delete_click_data
+from app.ratelimit import too_many_requests
+from app.redirects import resolve_redirect, cache_value
+from app.serializers import dumps, dumps_items
+from app.search import rarest_first, search_links
+from app.tags import normalize_tags, set_tags, tag_ids, tags_for
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_current_user as current_profile
+from app import db, url_cache, click_buffer, code_allocator, short_code_filter, rate_limiter, replicas
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+import csv
+import io
+import json
 import validators
+import zlib
 
 bp = Blueprint('api', __name__)
 
 @bp.route('/shorten', methods=['POST'])
 @jwt_required()
+@rate_limiter.limit('shorten')
 def create_short_url():
     """
     Create a new short URL
@@ -29,7 +43,30 @@ def create_short_url():
             shortCode:
               type: string
               example: mylink
+            expiresAt:
+              type: string
+              example: 2026-12-31T23:59:59Z
+              description: ISO 8601 time the link stops working (UTC without an offset)
+            expiresIn:
+              type: number
+              example: 86400
+              description: Seconds until the link stops working, instead of expiresAt
+            title:
+              type: string
+              example: Spring campaign
+            tags:
+              type: array
+              items:
+                type: string
+              example: [campaign, spring]
+            dedupe:
+              type: boolean
+              description: >
+                Return your existing short URL for this destination if there
+                is one (links with an expiry are never deduplicated)
     responses:
+      200:
+        description: Existing short URL returned (dedupe)
       201:
         description: Short URL created
       400:
@@ -53,44 +90,396 @@ def create_short_url():
     short_code = data.get('shortCode')
     
     if short_code:
-        if len(short_code) < 3 or len(short_code) > 8:
-            return error_response(400, 'Short code must be between 3 and 8 characters')
-        
-        if not short_code.isalnum():
-            return error_response(400, 'Short code can only contain letters and numbers')
+        error = validate_short_code(short_code)
+        if error:
+            return error_response(400, error)
+    
+    expires_at, error = parse_expiry(data)
+    if error:
+        return error_response(400, error)
+    
+    title, tags, error = _parse_labels(data)
+    if error:
+        return error_response(400, error)
+    
+    # Dedup applies to generated, permanent codes only; a custom code or an
+    # expiring link is always a new link
+    dedupe = not short_code and expires_at is None and _dedupe_requested(data)
+    digest = url_hash(original_url) if dedupe else None
+    if digest is not None:
+        existing = _find_by_url_hash(current_user_id, [digest]).get(digest)
+        if existing is not None:
+            return _short_url_response(existing, 200)
+    
+    # Create and save short URL. Allocated codes never collide with each
+    # other, only (rarely) with a custom code, so retry those with a new code
+    for attempt in range(3):
+        short_url = ShortURL(
+            original_url=original_url,
+            short_code=short_code,
+            user_id=current_user_id,
+            url_hash=digest,
+            expires_at=expires_at,
+            title=title
+        )
         
-        if ShortURL.query.filter_by(short_code=short_code).first():
-            return error_response(400, 'Short code already in use')
+        try:
+            db.session.add(short_url)
+            if tags:
+                db.session.flush()
+                set_tags(current_user_id, {short_url.id: tags})
+            db.session.commit()
+            # Redirects of a new code fall back to the primary on their own
+            replicas.mark_written(current_user_id)
+            break
+        except IntegrityError as e:
+            db.session.rollback()
+            if digest is not None and is_url_hash_conflict(e):
+                # A concurrent request created it first
+                existing = _find_by_url_hash(current_user_id, [digest]).get(digest)
+                if existing is not None:
+                    return _short_url_response(existing, 200)
+            if not is_short_code_conflict(e):
+                return error_response(500, f'Error creating short URL: {str(e)}')
+            if short_code:
+                return error_response(400, 'Short code already in use')
+        except Exception as e:
+            db.session.rollback()
+            return error_response(500, f'Error creating short URL: {str(e)}')
     else:
-        short_code = generate_short_code(4)  # Default length
+        return error_response(500, 'Error creating short URL: no free short code')
     
-    # Create and save short URL
-    short_url = ShortURL(
-        original_url=original_url,
-        short_code=short_code,
-        user_id=current_user_id
-    )
+    url_cache.set(short_url.short_code, cache_value(short_url.original_url, expires_at))
+    short_code_filter.add(short_url.short_code)
+    return _short_url_response(short_url, 201)
+
+def _short_url_response(short_url, status):
+    """Create response for a new ShortURL (201) or an existing row found by dedup (200)"""
+    body = {
+        'id': short_url.id,
+        'original_url': short_url.original_url,
+        'short_code': short_url.short_code,
+        'short_url': current_app.extensions['url_serializer'].short_url(short_url.short_code),
+        'access_count': short_url.access_count,
+        'created_at': short_url.created_at.isoformat(),
+        'expires_at': short_url.expires_at.isoformat() if short_url.expires_at else None,
+        'user_id': short_url.user_id
+    }
+    if status == 200:
+        body['existing'] = True
+    return jsonify(body), status
+
+def _parse_labels(data, partial=False):
+    """(title, tags, error) from a request body; with partial, None for keys not sent"""
+    title = data.get('title')
+    if title is not None:
+        if not isinstance(title, str):
+            return None, None, 'title must be a string'
+        title = title.strip() or None
+        if title and len(title) > 100:
+            return None, None, 'title can be at most 100 characters'
+    if partial and 'tags' not in data:
+        return title, None, None
+    tags, error = normalize_tags(data.get('tags'), current_app.config['MAX_TAGS_PER_LINK'])
+    return title, tags, error
+
+@bp.route('/shorten/batch', methods=['POST'])
+@jwt_required()
+@rate_limiter.limit('shorten')
+def create_short_urls_batch():
+    """
+    Create many short URLs in a single transaction
+    ---
+    tags:
+      - URL Shortener
+    consumes:
+      - application/json
+      - application/x-ndjson
+    parameters:
+      - in: body
+        name: body
+        required: true
+        description: >
+          JSON array of URLs or {url, shortCode, expiresAt | expiresIn,
+          title, tags} objects, or one such value per line with
+          Content-Type application/x-ndjson
+        schema:
+          type: array
+          items:
+            type: object
+            properties:
+              url:
+                type: string
+                example: https://example.com/very/long/url
+              shortCode:
+                type: string
+                example: mylink
+              expiresAt:
+                type: string
+                example: 2026-12-31T23:59:59Z
+              expiresIn:
+                type: number
+                example: 86400
+              title:
+                type: string
+              tags:
+                type: array
+                items:
+                  type: string
+      - in: query
+        name: dedupe
+        type: boolean
+        description: >
+          Return existing short URLs for destinations you already shortened
+          (also accepted as "dedupe" next to "urls" in an object body)
+    responses:
+      200:
+        description: Every URL was already shortened (dedupe)
+      201:
+        description: All short URLs created
+      207:
+        description: Some items failed validation, see per-item results
+      400:
+        description: Invalid input
+      500:
+        description: Internal server error
+    """
+    current_user_id = get_jwt_identity()
+    max_items = current_app.config['BATCH_SHORTEN_MAX']
+    # A batch larger than the item bucket could never be let through
+    item_cap = rate_limiter.max_cost('shorten_batch')
+    if item_cap is not None:
+        max_items = min(max_items, item_cap)
     
-    try:
-        db.session.add(short_url)
-        db.session.commit()
-        return jsonify({
-            'id': short_url.id,
-            'original_url': short_url.original_url,
-            'short_code': short_url.short_code,
-            'short_url': f"{current_app.config['SHORT_DOMAIN']}/{short_url.short_code}",
-            'access_count': short_url.access_count,
-            'created_at': short_url.created_at.isoformat(),
-            'user_id': short_url.user_id
-        }), 201
-    except Exception as e:
-        db.session.rollback()
-        return error_response(500, f'Error creating short URL: {str(e)}')
+    body = None
+    if request.mimetype == 'application/x-ndjson':
+        items = _read_ndjson(request.stream, max_items + 1)
+    else:
+        items = request.get_json(silent=True)
+        if isinstance(items, dict):
+            body, items = items, items.get('urls')
+    
+    if not isinstance(items, list) or not items:
+        return error_response(400, 'A non-empty list of URLs is required')
+    
+    if len(items) > max_items:
+        return error_response(400, f'At most {max_items} URLs can be shortened per request')
+    
+    # Every URL costs a token, on top of the request's own from the shorten limit
+    if rate_limiter.rules:
+        wait = rate_limiter.check('shorten_batch', cost=len(items))
+        if wait:
+            return too_many_requests(wait)
+    
+    # Validate everything up front
+    results = [None] * len(items)
+    pending = []
+    custom_codes = set()
+    for index, item in enumerate(items):
+        if isinstance(item, str):
+            item = {'url': item}
+        
+        if not isinstance(item, dict) or not isinstance(item.get('url'), str):
+            results[index] = _batch_error(index, 'URL is required')
+            continue
+        
+        if not validators.url(item['url']):
+            results[index] = _batch_error(index, 'Invalid URL format')
+            continue
+        
+        short_code = item.get('shortCode')
+        if short_code:
+            error = validate_short_code(short_code)
+            if not error and short_code in custom_codes:
+                error = 'Duplicate short code in request'
+            if error:
+                results[index] = _batch_error(index, error)
+                continue
+            custom_codes.add(short_code)
+        
+        expires_at, error = parse_expiry(item)
+        if not error:
+            title, tags, error = _parse_labels(item)
+        if error:
+            results[index] = _batch_error(index, error)
+            continue
+        
+        pending.append({'index': index, 'url': item['url'], 'code': short_code,
+                        'custom': bool(short_code), 'expires_at': expires_at,
+                        'title': title, 'tags': tags})
+    
+    serializer = current_app.extensions['url_serializer']
+    
+    # Dedup: reuse the caller's existing links, and create repeats within
+    # the request once. Custom codes and expiring links always get a new link
+    repeats = {}
+    if _dedupe_requested(body):
+        for entry in pending:
+            permanent = not entry['custom'] and entry['expires_at'] is None
+            entry['hash'] = url_hash(entry['url']) if permanent else None
+        existing = _find_by_url_hash(
+            current_user_id, list({entry['hash'] for entry in pending if entry['hash']}))
+        first_by_hash = {}
+        remaining = []
+        for entry in pending:
+            digest = entry['hash']
+            if digest in existing:
+                row = existing[digest]
+                results[entry['index']] = _batch_success(
+                    entry['index'], row.id, row.original_url, row.short_code, row.created_at,
+                    None, serializer, existing=True)
+            elif digest in first_by_hash:
+                repeats[entry['index']] = first_by_hash[digest]
+            else:
+                if digest is not None:
+                    first_by_hash[digest] = entry
+                remaining.append(entry)
+        pending = remaining
+    
+    # Allocate codes in bulk, then drop or replace any already in use
+    allocated = iter(code_allocator.allocate_many(sum(1 for p in pending if not p['custom'])))
+    for entry in pending:
+        if not entry['custom']:
+            entry['code'] = next(allocated)
+    
+    taken = _existing_short_codes([entry['code'] for entry in pending])
+    while taken:
+        remaining = []
+        for entry in pending:
+            if entry['code'] not in taken:
+                remaining.append(entry)
+            elif entry['custom']:
+                results[entry['index']] = _batch_error(entry['index'], 'Short code already in use')
+            else:
+                entry['code'] = code_allocator.allocate()
+                remaining.append(entry)
+        pending = remaining
+        taken = _existing_short_codes([entry['code'] for entry in pending if not entry['custom']])
+    
+    if pending:
+        table = ShortURL.__table__
+        stmt = insert(table).returning(
+            table.c.id, table.c.created_at, sort_by_parameter_order=True)
+        try:
+            created = db.session.execute(stmt, [
+                {'original_url': entry['url'], 'short_code': entry['code'],
+                 'user_id': current_user_id, 'url_hash': entry.get('hash'),
+                 'expires_at': entry['expires_at'], 'title': entry['title']}
+                for entry in pending
+            ]).all()
+            link_tags = {row.id: entry['tags'] for entry, row in zip(pending, created) if entry['tags']}
+            if link_tags:
+                set_tags(current_user_id, link_tags)
+            db.session.commit()
+            replicas.mark_written(current_user_id)
+        except IntegrityError as e:
+            db.session.rollback()
+            if is_url_hash_conflict(e):
+                return error_response(409, 'Some of these URLs were shortened concurrently, please retry the request')
+            if is_short_code_conflict(e):
+                return error_response(400, 'Short code already in use, please retry the request')
+            return error_response(500, f'Error creating short URLs: {str(e)}')
+        except Exception as e:
+            db.session.rollback()
+            return error_response(500, f'Error creating short URLs: {str(e)}')
+        
+        url_cache.set_many({entry['code']: cache_value(entry['url'], entry['expires_at'])
+                            for entry in pending})
+        short_code_filter.add_many([entry['code'] for entry in pending])
+        for entry, row in zip(pending, created):
+            results[entry['index']] = _batch_success(
+                entry['index'], row.id, entry['url'], entry['code'], row.created_at,
+                entry['expires_at'], serializer)
+    
+    for index, first in repeats.items():
+        results[index] = dict(results[first['index']], index=index, existing=True)
+    
+    failed = sum(1 for result in results if not result['success'])
+    if failed == len(items):
+        status = 400
+    elif failed:
+        status = 207
+    elif pending:
+        status = 201
+    else:
+        status = 200
+    
+    return jsonify({
+        'created': len(pending),
+        'existing': len(items) - len(pending) - failed,
+        'failed': failed,
+        'results': results
+    }), status
+
+def _batch_success(index, id, original_url, short_code, created_at, expires_at, serializer, existing=False):
+    result = {
+        'index': index,
+        'success': True,
+        'id': id,
+        'original_url': original_url,
+        'short_code': short_code,
+        'short_url': serializer.short_url(short_code),
+        'created_at': created_at.isoformat(),
+        'expires_at': expires_at.isoformat() if expires_at else None
+    }
+    if existing:
+        result['existing'] = True
+    return result
+
+def _dedupe_requested(body=None):
+    """The request's "dedupe" flag (body, then query string), defaulting to DEDUPE_URLS"""
+    value = body.get('dedupe') if isinstance(body, dict) else None
+    if value is None:
+        value = request.args.get('dedupe')
+    if value is None:
+        return current_app.config['DEDUPE_URLS']
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+def _find_by_url_hash(user_id, digests, chunk_size=1000):
+    """Map url_hash -> existing row of this user, via the (user_id, url_hash) index"""
+    found = {}
+    for start in range(0, len(digests), chunk_size):
+        chunk = digests[start:start + chunk_size]
+        rows = db.session.execute(
+            select(ShortURL.url_hash, ShortURL.id, ShortURL.original_url, ShortURL.short_code,
+                   ShortURL.access_count, ShortURL.created_at, ShortURL.user_id)
+            .where(ShortURL.user_id == user_id, ShortURL.url_hash.in_(chunk)))
+        found.update((row.url_hash, row) for row in rows)
+    return found
+
+def _read_ndjson(stream, limit):
+    """Parse newline-delimited JSON, stopping after `limit` items"""
+    items = []
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            items.append(json.loads(line))
+        except ValueError:
+            items.append(None)
+        if len(items) >= limit:
+            break
+    return items
 
-@bp.route('/<short_code>', methods=['GET'])
+def _batch_error(index, message):
+    return {'index': index, 'success': False, 'message': message}
+
+def _existing_short_codes(codes, chunk_size=1000):
+    """Return the subset of codes already present in short_url"""
+    taken = set()
+    for start in range(0, len(codes), chunk_size):
+        chunk = codes[start:start + chunk_size]
+        taken.update(db.session.execute(
+            select(ShortURL.short_code).where(ShortURL.short_code.in_(chunk))).scalars())
+    return taken
+
+@bp.route('/<short_code:short_code>', methods=['GET'])
 def redirect_short_url(short_code):
     """
-    Redirect to original URL
+    Redirect to original URL (legacy path; public links use /<short_code>)
     ---
     tags:
       - URL Shortener
@@ -105,22 +494,11 @@ def redirect_short_url(short_code):
       404:
         description: Short URL not found
     """
-    short_url = ShortURL.query.filter_by(short_code=short_code).first()
-    
-    if not short_url:
-        return error_response(404, 'Short URL not found')
-    
-    try:
-        short_url.access_count += 1
-        short_url.last_accessed = datetime.utcnow()
-        db.session.commit()
-        return redirect(short_url.original_url, code=302)
-    except Exception as e:
-        db.session.rollback()
-        return error_response(500, f'Error redirecting: {str(e)}')
+    return resolve_redirect(short_code)
 
 @bp.route('/api/url/<short_code>', methods=['GET'])
 @jwt_required()
+@replicas.read_only
 def get_url_details(short_code):
     """
     Get URL details (authenticated)
@@ -141,12 +519,102 @@ def get_url_details(short_code):
         description: URL not found
     """
     current_user_id = get_jwt_identity()
-    short_url = ShortURL.query.filter_by(short_code=short_code, user_id=current_user_id).first()
+    serializer = current_app.extensions['url_serializer']
+    row = db.session.execute(
+        select(*serializer.columns())
+        .where(ShortURL.short_code == short_code, ShortURL.user_id == current_user_id)
+    ).first()
     
-    if not short_url:
+    if not row:
         return error_response(404, 'Short URL not found or not owned by you')
     
-    return jsonify(short_url.to_dict())
+    # The owner is the current user, whose profile is already cached
+    tags = tags_for([row.id]).get(row.id, [])
+    return jsonify(serializer.detail(row, current_profile(), tags))
+
+@bp.route('/api/url/<short_code>/stats', methods=['GET'])
+@jwt_required()
+@replicas.read_only
+def get_url_stats(short_code):
+    """
+    Click time series for a short URL, read from the rollup tables
+    ---
+    tags:
+      - URL Shortener
+    security:
+      - Bearer: []
+    parameters:
+      - name: short_code
+        in: path
+        type: string
+        required: true
+      - name: granularity
+        in: query
+        type: string
+        enum: [minute, day]
+        description: Defaults to day
+      - name: since
+        in: query
+        type: string
+        description: ISO timestamp, defaults to 1 hour (minute) or 30 days (day) ago
+      - name: until
+        in: query
+        type: string
+        description: ISO timestamp, defaults to now
+    responses:
+      200:
+        description: Click counts per bucket
+      400:
+        description: Invalid query parameters
+      404:
+        description: URL not found
+    """
+    current_user_id = get_jwt_identity()
+    owned = db.session.query(ShortURL.id, ShortURL.created_at).filter_by(
+        short_code=short_code, user_id=current_user_id).first()
+    
+    if not owned:
+        return error_response(404, 'Short URL not found or not owned by you')
+    
+    granularity = request.args.get('granularity', 'day')
+    if granularity == 'minute':
+        model, bucket, span = ClickStatMinute, ClickStatMinute.bucket, timedelta(hours=1)
+    elif granularity == 'day':
+        model, bucket, span = ClickStatDay, ClickStatDay.day, timedelta(days=30)
+    else:
+        return error_response(400, 'granularity must be minute or day')
+    
+    try:
+        until = datetime.fromisoformat(request.args['until']) if 'until' in request.args else datetime.utcnow()
+        since = datetime.fromisoformat(request.args['since']) if 'since' in request.args else until - span
+    except ValueError:
+        return error_response(400, 'since and until must be ISO 8601 timestamps')
+    # Stored buckets are naive UTC
+    since, until = (value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
+                    for value in (since, until))
+    
+    # Clicks still queued when a previous link with this code was deleted
+    # may land after it; nothing before this link existed is its own
+    if owned.created_at is not None:
+        since = max(since, owned.created_at.replace(second=0, microsecond=0))
+    
+    if granularity == 'day':
+        since, until = since.date(), until.date()
+    
+    rows = db.session.execute(
+        select(bucket, model.clicks)
+        .where(model.short_code == short_code, bucket >= since, bucket <= until)
+        .order_by(bucket)
+    ).all()
+    
+    return jsonify({
+        'short_code': short_code,
+        'granularity': granularity,
+        'since': since.isoformat(),
+        'until': until.isoformat(),
+        'total': sum(row.clicks for row in rows),
+        'series': [{'bucket': row[0].isoformat(), 'clicks': row.clicks} for row in rows]
+    })
 
 @bp.route('/api/url/<short_code>', methods=['PUT'])
 @jwt_required()
@@ -159,20 +627,53 @@ def update_short_url(short_code):
     
     data = request.get_json()
     
-    if not data or 'url' not in data:
+    # Any of destination, expiry, title and tags; "expiresAt": null removes the expiry
+    changes_expiry = isinstance(data, dict) and ('expiresAt' in data or 'expiresIn' in data)
+    changes_labels = isinstance(data, dict) and ('title' in data or 'tags' in data)
+    if not data or ('url' not in data and not changes_expiry and not changes_labels):
         return error_response(400, 'URL is required')
     
-    new_url = data['url']
+    if 'url' in data:
+        new_url = data['url']
+        
+        if not validators.url(new_url):
+            return error_response(400, 'Invalid URL format')
+        
+        short_url.original_url = new_url
+        # A retargeted link no longer stands for its old destination
+        short_url.url_hash = None
     
-    if not validators.url(new_url):
-        return error_response(400, 'Invalid URL format')
+    if changes_expiry:
+        expires_at, error = parse_expiry(data)
+        if error:
+            return error_response(400, error)
+        short_url.expires_at = expires_at
+        if expires_at is not None:
+            # Expiring links are kept out of dedup
+            short_url.url_hash = None
+    
+    tags = None
+    if changes_labels:
+        title, tags, error = _parse_labels(data, partial=True)
+        if error:
+            return error_response(400, error)
+        if 'title' in data:
+            short_url.title = title
     
-    short_url.original_url = new_url
     short_url.updated_at = datetime.utcnow()
     
     try:
+        if tags is not None:
+            set_tags(current_user_id, {short_url.id: tags}, replace=True)
+        else:
+            tags = tags_for([short_url.id]).get(short_url.id, [])
+        # Built before the commit expires the instance's attributes
+        body = current_app.extensions['url_serializer'].detail(short_url, current_profile(), tags)
         db.session.commit()
-        return jsonify(short_url.to_dict())
+        # Before the invalidation, so reloads of the code read the primary
+        replicas.mark_written(current_user_id, [short_code])
+        url_cache.invalidate(short_code)
+        return jsonify(body)
     except Exception as e:
         db.session.rollback()
         return error_response(500, f'Error updating short URL: {str(e)}')
@@ -189,15 +690,317 @@ def delete_short_url(short_code):
     try:
         db.session.delete(short_url)
         db.session.commit()
-        return '', 204
+        replicas.mark_written(current_user_id, [short_code])
+        url_cache.invalidate(short_code)
+        click_buffer.discard(short_code)
     except Exception as e:
         db.session.rollback()
         return error_response(500, f'Error deleting short URL: {str(e)}')
 
+    # Click data is keyed by short code; it must not outlive the link and
+    # show up in the stats of whoever reuses the code. It goes batch by
+    # batch after the link's own commit; whatever is left if this fails is
+    # picked up by purge_orphaned_clicks
+    try:
+        delete_click_data([short_code], current_app.config['PURGE_BATCH_SIZE'])
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.warning(f"Click data of {short_code} left for the purge job: {str(e)}")
+    return '', 204
+
 @bp.route('/api/user/urls', methods=['GET'])
 @jwt_required()
+@replicas.read_only
 def get_user_urls():
+    """
+    List the current user's short URLs, oldest first
+    ---
+    tags:
+      - URL Shortener
+    security:
+      - Bearer: []
+    parameters:
+      - name: limit
+        in: query
+        type: integer
+        description: Page size (default USER_URLS_PAGE_SIZE)
+      - name: cursor
+        in: query
+        type: string
+        description: next_cursor from the previous page
+      - name: fields
+        in: query
+        type: string
+        description: Comma-separated subset of fields to return
+    responses:
+      200:
+        description: A page of URLs and the cursor for the next one
+      400:
+        description: Invalid query parameters
+    """
+    current_user_id = get_jwt_identity()
+    
+    limit, cursor, fields, error = _listing_args()
+    if error:
+        return error_response(400, error)
+    
+    # Keyset pagination on (user_id, id), selecting only the needed columns
+    columns, serialize = current_app.extensions['url_serializer'].listing(fields, URL_LIST_FIELDS)
+    stmt = (
+        select(*columns)
+        .where(ShortURL.user_id == current_user_id, ShortURL.id > cursor)
+        .order_by(ShortURL.id)
+        .limit(limit + 1)
+    )
+    return _stream_urls(stmt, limit, serialize)
+
+@bp.route('/api/user/urls/search', methods=['GET'])
+@jwt_required()
+@replicas.read_only
+def search_user_urls():
+    """
+    Search the current user's short URLs, oldest first
+    ---
+    tags:
+      - URL Shortener
+    security:
+      - Bearer: []
+    parameters:
+      - name: tag
+        in: query
+        type: array
+        items:
+          type: string
+        collectionFormat: multi
+        description: Only links with this tag; repeat (or comma-separate) to require several
+      - name: q
+        in: query
+        type: string
+        description: Words that must all start a word of the title or URL
+      - name: title
+        in: query
+        type: string
+        description: Title prefix, case-insensitive
+      - name: url
+        in: query
+        type: string
+        description: Destination URL prefix, case-insensitive
+      - name: limit
+        in: query
+        type: integer
+      - name: cursor
+        in: query
+        type: string
+      - name: fields
+        in: query
+        type: string
+    responses:
+      200:
+        description: A page of matching URLs and the cursor for the next one
+      400:
+        description: Invalid query parameters
+    """
+    current_user_id = get_jwt_identity()
+    
+    limit, cursor, fields, error = _listing_args()
+    if error:
+        return error_response(400, error)
+    
+    tags, error = normalize_tags(
+        [tag for value in request.args.getlist('tag') for tag in value.split(',')],
+        current_app.config['MAX_TAGS_PER_LINK'])
+    if error:
+        return error_response(400, error)
+    
+    columns, serialize = current_app.extensions['url_serializer'].listing(fields, URL_LIST_FIELDS)
+    ids = tag_ids(current_user_id, tags)
+    if len(ids) < len(tags):
+        # A tag the user has never used matches nothing
+        return _stream_urls(None, limit, serialize)
+    
+    stmt = search_links(
+        columns, db.session.get_bind().dialect.name, current_user_id,
+        tag_ids=rarest_first([ids[tag] for tag in tags]),
+        q=request.args.get('q'),
+        title=request.args.get('title'),
+        url=request.args.get('url'),
+        cursor=cursor,
+        limit=limit + 1)
+    return _stream_urls(stmt, limit, serialize)
+
+@bp.route('/api/user/urls/export', methods=['GET'])
+@jwt_required()
+@rate_limiter.limit('export')
+@replicas.read_only
+def export_user_urls():
+    """
+    Download every short URL of the current user, oldest first
+    ---
+    tags:
+      - URL Shortener
+    security:
+      - Bearer: []
+    produces:
+      - application/x-ndjson
+      - text/csv
+    parameters:
+      - name: format
+        in: query
+        type: string
+        enum: [ndjson, csv]
+        default: ndjson
+        description: One JSON object per line, or CSV with a header row (tags comma-joined)
+      - name: fields
+        in: query
+        type: string
+        description: Comma-separated subset of fields to export
+    responses:
+      200:
+        description: The links, streamed; gzip-encoded when the client accepts it
+      400:
+        description: Invalid query parameters
+      429:
+        description: Too many exports
+    """
     current_user_id = get_jwt_identity()
-    urls = ShortURL.query.filter_by(user_id=current_user_id).all()
     
-    return jsonify([url.to_dict() for url in urls])
\ No newline at end of file
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return error_response(400, f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    fields, error = _listing_fields()
+    if error:
+        return error_response(400, error)
+    
+    columns, serialize = current_app.extensions['url_serializer'].listing(fields, URL_LIST_FIELDS)
+    stmt = select(*columns).where(ShortURL.user_id == current_user_id).order_by(ShortURL.id)
+    # yield_per streams through a server-side cursor where the driver has one,
+    # so memory holds one batch however many links the account has
+    rows = db.session.execute(
+        stmt, execution_options={'yield_per': current_app.config['EXPORT_BATCH_SIZE']})
+    encode = _csv_encoder(fields) if export_format == 'csv' else _ndjson_lines
+    
+    def generate():
+        try:
+            for partition in rows.partitions():
+                yield encode(serialize(partition))
+        finally:
+            rows.close()
+    
+    chunks = generate()
+    headers = {'Content-Disposition': f'attachment; filename="links.{export_format}"',
+               'Vary': 'Accept-Encoding'}
+    level = current_app.config['EXPORT_GZIP_LEVEL']
+    if level and request.accept_encodings['gzip']:
+        chunks = _gzip_chunks(chunks, level)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(stream_with_context(chunks), mimetype=EXPORT_FORMATS[export_format], headers=headers)
+
+# Export format -> Content-Type
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+def _ndjson_lines(items):
+    return b''.join([dumps(item) + b'\n' for item in items])
+
+def _csv_encoder(fields):
+    """items -> CSV bytes; the first call also writes the header row"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(fields)
+    
+    def cell(value):
+        if value is None:
+            return ''
+        if isinstance(value, datetime):
+            return value.isoformat()
+        if isinstance(value, list):
+            return ','.join(value)
+        return value
+    
+    def encode(items):
+        writer.writerows([[cell(item[field]) for field in fields] for item in items])
+        data = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+    
+    return encode
+
+def _gzip_chunks(chunks, level):
+    """gzip a stream of byte chunks, yielding compressed output as it fills"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def _listing_args():
+    """(limit, cursor, fields, error) from a listing request's query string"""
+    max_limit = current_app.config['USER_URLS_MAX_PAGE_SIZE']
+    limit = request.args.get('limit', str(current_app.config['USER_URLS_PAGE_SIZE']))
+    if not limit.isdigit() or not 1 <= int(limit) <= max_limit:
+        return None, None, None, f'limit must be between 1 and {max_limit}'
+    
+    cursor = request.args.get('cursor', '0')
+    if not cursor.isdigit():
+        return None, None, None, 'Invalid cursor'
+    
+    fields, error = _listing_fields()
+    if error:
+        return None, None, None, error
+    return int(limit), int(cursor), fields, None
+
+def _listing_fields():
+    """(fields, error) from the fields query parameter; every field by default"""
+    fields = request.args.get('fields')
+    if not fields:
+        return list(URL_LIST_FIELDS), None
+    fields = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in URL_LIST_FIELDS]
+    if unknown:
+        return None, f"Unknown fields: {', '.join(unknown)}"
+    return fields, None
+
+def _stream_urls(stmt, limit, serialize):
+    """Stream {"urls": [...], "next_cursor": ...} for a select of limit + 1 rows"""
+    rows = db.session.execute(stmt, execution_options={'yield_per': 500}) if stmt is not None else None
+    
+    def generate():
+        # One encoder call (and one tag lookup) per fetched partition of rows
+        yield b'{"urls":['
+        emitted = 0
+        next_cursor = None
+        for partition in rows.partitions() if rows is not None else ():
+            if emitted + len(partition) > limit:
+                partition = partition[:limit - emitted]
+                next_cursor = str(partition[-1][0] if partition else last_id)
+            if partition:
+                items = serialize(partition)
+                yield (b',' if emitted else b'') + dumps_items(items)
+                emitted += len(partition)
+                last_id = partition[-1][0]
+            if next_cursor is not None:
+                break
+        if rows is not None:
+            rows.close()
+        yield b'],"next_cursor":' + dumps(next_cursor) + b'}'
+    
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+# Listing field name -> column it is built from
+URL_LIST_FIELDS = {
+    'id': ShortURL.id,
+    'original_url': ShortURL.original_url,
+    'short_code': ShortURL.short_code,
+    'short_url': ShortURL.short_code,
+    'user_id': ShortURL.user_id,
+    'access_count': ShortURL.access_count,
+    'title': ShortURL.title,
+    'tags': ShortURL.id,
+    'created_at': ShortURL.created_at,
+    'updated_at': ShortURL.updated_at,
+    'expires_at': ShortURL.expires_at
+}
@@ -0,0 +1,144 @@
+"""Search over a user's links: tag filters, title/URL prefixes and full text
+
+Full-text and prefix matching are dialect specific:
+
+- Postgres: a GIN index on a 'simple' tsvector of title and URL, queried
+  with prefix terms (word:*), and pg_trgm GIN indexes for case-insensitive
+  title/URL prefixes (ILIKE).
+- SQLite, the local stand-in: an external-content FTS5 table kept in sync
+  by triggers, and (user_id, lower(column)) indexes scanned as a range.
+
+Both apply to every word of the query (AND) as a prefix, so "gith rel"
+finds "GitHub releases". The DDL is attached to short_url here for
+create_all; migration 0006 creates the same objects.
+"""
+import re
+
+from sqlalchemy import (DDL, and_, column, event, exists, func, literal, literal_column, select, table,
+                        text)
+
+from app import db
+from app.models import LinkTag, ShortURL
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+# Must match the expression of ix_short_url_search for Postgres to use it
+SEARCH_VECTOR = "to_tsvector('simple', coalesce(short_url.title, '') || ' ' || short_url.original_url)"
+
+POSTGRES_DDL = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX ix_short_url_search ON short_url USING gin "
+    "((to_tsvector('simple', coalesce(title, '') || ' ' || original_url)))",
+    "CREATE INDEX ix_short_url_title_trgm ON short_url USING gin (title gin_trgm_ops)",
+    "CREATE INDEX ix_short_url_original_url_trgm ON short_url USING gin (original_url gin_trgm_ops)",
+)
+
+SQLITE_DDL = (
+    "CREATE INDEX ix_short_url_user_id_title_lower ON short_url (user_id, lower(title))",
+    "CREATE INDEX ix_short_url_user_id_url_lower ON short_url (user_id, lower(original_url))",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS short_url_fts USING fts5("
+    "title, original_url, content='short_url', content_rowid='id')",
+    "CREATE TRIGGER short_url_fts_insert AFTER INSERT ON short_url BEGIN "
+    "INSERT INTO short_url_fts(rowid, title, original_url) "
+    "VALUES (new.id, new.title, new.original_url); END",
+    "CREATE TRIGGER short_url_fts_delete AFTER DELETE ON short_url BEGIN "
+    "INSERT INTO short_url_fts(short_url_fts, rowid, title, original_url) "
+    "VALUES ('delete', old.id, old.title, old.original_url); END",
+    # Click counting updates other columns and stays off this path
+    "CREATE TRIGGER short_url_fts_update AFTER UPDATE OF title, original_url ON short_url BEGIN "
+    "INSERT INTO short_url_fts(short_url_fts, rowid, title, original_url) "
+    "VALUES ('delete', old.id, old.title, old.original_url); "
+    "INSERT INTO short_url_fts(rowid, title, original_url) "
+    "VALUES (new.id, new.title, new.original_url); END",
+)
+
+for statement in POSTGRES_DDL:
+    event.listen(ShortURL.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+for statement in SQLITE_DDL:
+    event.listen(ShortURL.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+# Triggers go with the table, the FTS table has to be dropped explicitly
+event.listen(ShortURL.__table__, 'before_drop',
+             DDL('DROP TABLE IF EXISTS short_url_fts').execute_if(dialect='sqlite'))
+
+short_url_fts = table('short_url_fts', column('rowid'))
+
+
+def query_words(value):
+    return WORD.findall(value or '')
+
+
+def _prefix_bound(prefix):
+    """Smallest string greater than every string starting with prefix"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def prefix_filter(dialect, column_, prefix):
+    """Case-insensitive "column starts with prefix" that can use an index"""
+    if dialect == 'postgresql':
+        return column_.ilike(_escape_like(prefix) + '%', escape='\\')
+    prefix = prefix.lower()
+    lowered = func.lower(column_)
+    return and_(lowered >= prefix, lowered < _prefix_bound(prefix))
+
+
+def text_filter(dialect, words):
+    """Every word appears in the title or URL, as a word prefix"""
+    if dialect == 'postgresql':
+        query = ' & '.join(f'{word}:*' for word in words)
+        return text(f"{SEARCH_VECTOR} @@ to_tsquery('simple', :text_query)").bindparams(
+            text_query=query)
+    query = ' '.join('"{}"*'.format(word.replace('"', '""')) for word in words)
+    return ShortURL.id.in_(
+        select(short_url_fts.c.rowid).where(literal_column('short_url_fts').op('MATCH')(query)))
+
+
+def rarest_first(tag_ids, cap=1000):
+    """tag_ids ordered by how many links carry them, counting up to cap each"""
+    if len(tag_ids) < 2:
+        return list(tag_ids)
+    link_tag = LinkTag.__table__
+    counts = {}
+    for tag_id in tag_ids:
+        carried = select(link_tag.c.link_id).where(link_tag.c.tag_id == tag_id).limit(cap).subquery()
+        counts[tag_id] = db.session.execute(select(func.count()).select_from(carried)).scalar()
+    return sorted(tag_ids, key=counts.get)
+
+
+def search_links(columns, dialect, user_id, tag_ids=(), q=None, title=None, url=None,
+                 cursor=0, limit=100):
+    """Keyset-paginated select of a user's links matching every given filter
+
+    tag_ids are the ids of the required tags (all of them), best rarest
+    first: the first tag's link_tag range, already in link id order,
+    drives the query and the others are probed per link, so a page stops
+    after `limit` matches instead of sorting every tagged link.
+    """
+    stmt = select(*columns).where(ShortURL.user_id == user_id)
+    tag_ids = list(tag_ids)
+    if tag_ids:
+        link_tag = LinkTag.__table__
+        stmt = stmt.join(link_tag, and_(link_tag.c.link_id == ShortURL.id,
+                                        link_tag.c.tag_id == tag_ids[0]))
+        for tag_id in tag_ids[1:]:
+            other = link_tag.alias()
+            stmt = stmt.where(exists().where(other.c.link_id == ShortURL.id, other.c.tag_id == tag_id))
+        order = link_tag.c.link_id
+    else:
+        order = ShortURL.id
+    stmt = stmt.where(order > cursor)
+    words = query_words(q)
+    if words:
+        stmt = stmt.where(text_filter(dialect, words))
+    if title:
+        stmt = stmt.where(prefix_filter(dialect, ShortURL.title, title))
+    if url:
+        stmt = stmt.where(prefix_filter(dialect, ShortURL.original_url, url))
+    if dialect == 'sqlite':
+        # A bound LIMIT hides the page size from SQLite's planner, which
+        # then walks the id order instead of a selective prefix index
+        limit = literal(limit, literal_execute=True)
+    return stmt.order_by(order).limit(limit)
@@ -0,0 +1,152 @@
+"""Response serialization without the ORM
+
+Short URL responses are built from row tuples (or any object with the
+same attributes) rather than from model instances: the public short URL
+prefix is computed from SHORT_DOMAIN once per app, listing fields are
+resolved to tuple positions once per request, and datetimes go to the
+encoder as they are. JSON is encoded with orjson when it is installed
+(`pip install orjson`) and with the standard library otherwise.
+"""
+import json
+from datetime import date
+from operator import itemgetter
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+
+def _isoformat(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def dumps(obj):
+    """Compact JSON bytes, datetimes as ISO 8601"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False,
+                      default=_isoformat).encode()
+
+
+def dumps_items(items):
+    """A list's elements as JSON, comma separated without the brackets, for streaming"""
+    return dumps(items)[1:-1]
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, encoding compact responses with orjson when installed
+
+    Output matches DefaultJSONProvider, including its HTTP-date datetimes
+    and sorted keys; only the encoder changes.
+    """
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return self._orjson_dumps(obj).decode()
+
+    def _orjson_dumps(self, obj):
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option)
+
+    def response(self, *args, **kwargs):
+        # Pretty-printed (debug) responses keep the standard library path
+        if orjson is None or self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._orjson_dumps(obj) + b'\n', mimetype=self.mimetype)
+
+
+class URLSerializer:
+    """Short URL dicts from row tuples, with the short URL prefix computed once"""
+
+    # Columns a full short URL response is built from, in order
+    COLUMNS = ('id', 'original_url', 'short_code', 'user_id', 'access_count',
+               'title', 'created_at', 'updated_at', 'expires_at')
+
+    def __init__(self, short_domain):
+        self.prefix = f'{short_domain}/'
+
+    def short_url(self, short_code):
+        return self.prefix + short_code
+
+    def columns(self):
+        from app.models import ShortURL
+
+        return [getattr(ShortURL, name) for name in self.COLUMNS]
+
+    def detail(self, row, owner=None, tags=()):
+        """Full response for one link: a model instance or a row of columns(), and its tag names"""
+        return {
+            'id': row.id,
+            'original_url': row.original_url,
+            'short_code': row.short_code,
+            'short_url': self.prefix + row.short_code,
+            'user_id': row.user_id,
+            'access_count': row.access_count,
+            'title': row.title,
+            'tags': list(tags),
+            'created_at': row.created_at.isoformat() if row.created_at else None,
+            'updated_at': row.updated_at.isoformat() if row.updated_at else None,
+            'expires_at': row.expires_at.isoformat() if row.expires_at else None,
+            'owner': owner
+        }
+
+    def listing(self, fields, field_columns):
+        """(columns to select, rows -> list of dicts) for a subset of listing fields
+
+        field_columns maps each field name to the column it is built from
+        (tags are read from link_tag, keyed by id). The id column always
+        comes first, for the pagination cursor and the tag lookup, which
+        is one query per call. Datetimes are left for dumps() to encode.
+        """
+        from app.models import ShortURL
+        from app.tags import tags_for
+
+        columns = []
+        positions = {}
+        for column in [ShortURL.id] + [field_columns[field] for field in fields]:
+            if column.key not in positions:
+                positions[column.key] = len(columns)
+                columns.append(column)
+
+        getters = []
+        for field in fields:
+            index = positions[field_columns[field].key]
+            if field == 'short_url':
+                getters.append((field, self._short_url_getter(index)))
+            elif field == 'tags':
+                # Filled in per batch below; keeps the field in its place
+                getters.append((field, _no_tags))
+            else:
+                getters.append((field, itemgetter(index)))
+
+        def serialize(rows):
+            items = [{field: get(row) for field, get in getters} for row in rows]
+            if 'tags' in fields:
+                tags = tags_for([row[0] for row in rows])
+                for item, row in zip(items, rows):
+                    item['tags'] = tags.get(row[0], [])
+            return items
+
+        return columns, serialize
+
+    def _short_url_getter(self, index):
+        prefix = self.prefix
+        return lambda row: prefix + row[index]
+
+
+def _no_tags(row):
+    return []
+
+
+def init_serializers(app):
+    app.json = JSONProvider(app)
+    app.extensions['url_serializer'] = URLSerializer(app.config['SHORT_DOMAIN'])
@@ -0,0 +1,372 @@
+"""Memory-mapped snapshot of every redirect, for lookups without the database
+
+`flask snapshot-links` streams short_url in code order into one file:
+
+    header    magic (with the format version), count, as_of, section offsets
+    keys      count x u64: the code, NUL-padded to 8 bytes, as a big-endian
+              integer (so integer order is code order), stored native-endian
+    offsets   (count + 1) x u64 into the URL blob; entry i is [off[i], off[i+1])
+    expiries  count x f64 epoch seconds, 0.0 for links that never expire
+    urls      UTF-8 destinations back to back
+
+and atomically replaces the previous one. Every worker maps the same file
+read-only, so the page cache holds one copy for the whole node. A lookup
+is a bisect over the keys as a memoryview (no slicing, no parsing) and
+one slice of the blob for a hit.
+
+Links created or changed since the snapshot come from a delta overlay:
+each worker polls short_url for rows updated since the snapshot's as_of
+(less REDIRECT_SNAPSHOT_MARGIN for clock skew and slow transactions)
+every REDIRECT_SNAPSHOT_REFRESH seconds, which is also how often it looks
+for a newer file. Deletions leave no row to poll, so codes the URL cache
+invalidates are marked dirty and go to the database until the next file.
+
+The snapshot serves when the database fails (stale-if-error), and with
+REDIRECT_SNAPSHOT_MODE=first for every cache miss it can answer.
+"""
+import bisect
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from sqlalchemy import select, text
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'SHRTSNP1'
+KEY_WIDTH = 8
+# magic, count, as_of, offsets/expiries/urls section starts
+HEADER = struct.Struct('<8sQdQQQ')
+MODES = ('fallback', 'first')
+
+
+def code_key(short_code):
+    """The u64 a short code is sorted and searched by"""
+    return int.from_bytes(short_code.encode('ascii').ljust(KEY_WIDTH, b'\0'), 'big')
+
+
+def _epoch(value):
+    return value.replace(tzinfo=timezone.utc).timestamp() if value is not None else None
+
+
+def write_snapshot(rows, path, as_of):
+    """Write (short_code, original_url, expires_at) rows, sorted by code, to path
+
+    Sections are spooled to temporary files next to path, so memory stays
+    flat however many rows there are; the finished file replaces path
+    atomically. Returns the number of links written.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    spools = [tempfile.TemporaryFile(dir=directory) for _ in range(4)]
+    keys, offsets, expiries, urls = spools
+    count = 0
+    previous = -1
+    position = 0
+    pack_u64, pack_f64 = struct.Struct('=Q').pack, struct.Struct('=d').pack
+    try:
+        offsets.write(pack_u64(0))
+        for short_code, original_url, expires_at in rows:
+            key = code_key(short_code)
+            if key <= previous:
+                raise RuntimeError(f"Rows are not in short code order at '{short_code}'")
+            previous = key
+            url = original_url.encode('utf-8')
+            position += len(url)
+            keys.write(pack_u64(key))
+            offsets.write(pack_u64(position))
+            expiries.write(pack_f64(_epoch(expires_at) or 0.0))
+            urls.write(url)
+            count += 1
+
+        offsets_start = HEADER.size + count * 8
+        expiries_start = offsets_start + (count + 1) * 8
+        urls_start = expiries_start + count * 8
+        fd, temporary = tempfile.mkstemp(dir=directory, prefix='.snapshot-')
+        with os.fdopen(fd, 'wb') as out:
+            out.write(HEADER.pack(MAGIC, count, as_of, offsets_start, expiries_start, urls_start))
+            for spool in spools:
+                spool.seek(0)
+                while True:
+                    chunk = spool.read(1 << 20)
+                    if not chunk:
+                        break
+                    out.write(chunk)
+            out.flush()
+            os.fsync(out.fileno())
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+    finally:
+        for spool in spools:
+            spool.close()
+    return count
+
+
+class SnapshotFile:
+    """One mapped snapshot file"""
+
+    def __init__(self, path):
+        if sys.byteorder != 'little':
+            raise RuntimeError('Redirect snapshots are read as little-endian arrays')
+        with open(path, 'rb') as f:
+            self.stat = os.fstat(f.fileno())
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, as_of, offsets_start, expiries_start, urls_start = HEADER.unpack_from(self.map)
+        if magic != MAGIC or urls_start > len(self.map):
+            raise RuntimeError(f"{path} is not a redirect snapshot")
+        view = memoryview(self.map)
+        self.count = count
+        self.as_of = as_of
+        self.keys = view[HEADER.size:offsets_start].cast('Q')
+        self.offsets = view[offsets_start:expiries_start].cast('Q')
+        self.expiries = view[expiries_start:urls_start].cast('d')
+        self.urls_start = urls_start
+
+    def find(self, short_code):
+        """(original_url, expiry epoch or None), or None if the code is not in the file"""
+        key = code_key(short_code)
+        keys = self.keys
+        index = bisect.bisect_left(keys, key)
+        if index == self.count or keys[index] != key:
+            return None
+        start = self.urls_start + self.offsets[index]
+        end = self.urls_start + self.offsets[index + 1]
+        return self.map[start:end].decode('utf-8'), self.expiries[index] or None
+
+
+class RedirectSnapshot:
+    """Lookups in the node's snapshot file plus this worker's delta overlay"""
+
+    # Codes marked dirty before the file is dropped altogether
+    MAX_DIRTY = 100000
+
+    def __init__(self):
+        self.app = None
+        self.engine = None
+        self.path = None
+        self.mode = 'fallback'
+        self.refresh_interval = 5.0
+        self.margin = 60.0
+        self.file = None
+        self.delta = {}
+        # short_code -> when it was invalidated
+        self.dirty = {}
+        self._since = None
+        self._lock = threading.Lock()
+        self._thread_pid = None
+        self.hits = 0
+        self.misses = 0
+        self.stale_served = 0
+        self.delta_errors = 0
+
+    def init_app(self, app):
+        from app import url_cache
+
+        self.app = app
+        self._configure(app.config)
+        if self.enabled and self.forget not in url_cache.forget_listeners:
+            url_cache.forget_listeners.append(self.forget)
+        app.extensions['redirect_snapshot'] = self
+
+    def init_engine(self, engine, config, url_cache=None):
+        """Poll the delta through a plain engine, for processes without a Flask app"""
+        self.engine = engine
+        self._configure(config)
+        if self.enabled and url_cache is not None:
+            url_cache.forget_listeners.append(self.forget)
+
+    def _configure(self, config):
+        self.path = config.get('REDIRECT_SNAPSHOT_PATH') or None
+        self.mode = config.get('REDIRECT_SNAPSHOT_MODE', 'fallback')
+        if self.mode not in MODES:
+            raise RuntimeError(f"Unknown REDIRECT_SNAPSHOT_MODE '{self.mode}', "
+                               f"expected one of {', '.join(MODES)}")
+        self.refresh_interval = config.get('REDIRECT_SNAPSHOT_REFRESH', 5.0)
+        self.margin = config.get('REDIRECT_SNAPSHOT_MARGIN', 60.0)
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    # Lookups
+
+    def lookup(self, short_code):
+        """(original_url, expiry epoch or None) from the overlay or the file, or None"""
+        self._ensure_thread()
+        found = self.delta.get(short_code)
+        if found is None:
+            file = self.file
+            if file is not None:
+                found = file.find(short_code)
+        if found is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return found
+
+    def serves_first(self, short_code):
+        """Whether a cache miss for this code may be answered without the database"""
+        if self.mode != 'first':
+            return False
+        self._ensure_thread()
+        return self.file is not None and short_code not in self.dirty
+
+    def stale(self, short_code):
+        """Lookup while the database is failing, dirty or not"""
+        self._ensure_thread()
+        if self.file is None:
+            # Mapping needs no database; the delta catches up once it is back
+            file = self._newer_file()
+            with self._lock:
+                if self.file is None and file is not None:
+                    self.file = file
+                    self._since = file.as_of - self.margin
+        found = self.lookup(short_code)
+        if found is not None:
+            self.stale_served += 1
+        return found
+
+    def forget(self, short_code):
+        """The code was changed or deleted: answer it from the database from now on"""
+        with self._lock:
+            self.delta.pop(short_code, None)
+            if len(self.dirty) < self.MAX_DIRTY:
+                self.dirty[short_code] = time.time()
+            else:
+                # Too many to track; wait for the next file
+                logger.warning('Redirect snapshot dropped: too many changed codes')
+                self.file = None
+                self.dirty = {}
+
+    # Refresh
+
+    def refresh(self):
+        """Map a newer file if there is one and bring the delta up to date"""
+        file = self._newer_file()
+        if file is not None:
+            # The new file goes live together with its own delta
+            since = file.as_of - self.margin
+            delta, since = self._poll_delta({}, since)
+            with self._lock:
+                self.file = file
+                self.delta = delta
+                self._since = since
+                # Marks older than the file are part of it
+                self.dirty = {code: marked for code, marked in self.dirty.items()
+                              if marked >= file.as_of - self.margin}
+            logger.info(f"Mapped redirect snapshot of {file.count} links")
+        elif self.file is not None:
+            delta, since = self._poll_delta(self.delta, self._since)
+            with self._lock:
+                self.delta = delta
+                self._since = since
+
+    def _newer_file(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        current = self.file
+        if current is not None and (stat.st_ino, stat.st_mtime_ns) == (current.stat.st_ino,
+                                                                        current.stat.st_mtime_ns):
+            return None
+        try:
+            return SnapshotFile(self.path)
+        except (OSError, ValueError, RuntimeError, struct.error) as e:
+            logger.error(f"Could not map redirect snapshot {self.path}: {str(e)}")
+            return None
+
+    def _poll_delta(self, delta, since):
+        """(delta with every row updated since `since`, next since); unchanged on errors"""
+        from app.models import ShortURL
+
+        table = ShortURL.__table__
+        stmt = select(table.c.short_code, table.c.original_url, table.c.expires_at,
+                      table.c.updated_at).where(table.c.updated_at >= datetime.utcfromtimestamp(since))
+        try:
+            with self._connect() as conn:
+                rows = conn.execute(stmt).all()
+        except Exception as e:
+            self.delta_errors += 1
+            logger.warning(f"Redirect snapshot delta not refreshed: {str(e)}")
+            return delta, since
+        delta = dict(delta)
+        newest = since
+        for row in rows:
+            delta[row.short_code] = (row.original_url, _epoch(row.expires_at))
+            newest = max(newest, _epoch(row.updated_at) - self.margin)
+        return delta, newest
+
+    @contextmanager
+    def _connect(self):
+        if self.engine is not None:
+            with self.engine.connect() as conn:
+                yield conn
+            return
+        from app import db
+        with self.app.app_context(), db.engine.connect() as conn:
+            yield conn
+
+    def _ensure_thread(self):
+        # Started on first use, so that no thread exists before a server forks
+        if self._thread_pid == os.getpid() or not self.enabled:
+            return
+        with self._lock:
+            if self._thread_pid == os.getpid():
+                return
+            self._thread_pid = os.getpid()
+            # A forked child starts over: the parent's map is shared, its delta may be stale
+            self.file = None
+            self.delta = {}
+            threading.Thread(target=self._run, name='redirect-snapshot', daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Redirect snapshot refresh failed: {str(e)}")
+            time.sleep(self.refresh_interval)
+
+    def stats(self):
+        file = self.file
+        return {
+            'mode': self.mode,
+            'links': file.count if file is not None else 0,
+            'age': time.time() - file.as_of if file is not None else None,
+            'delta': len(self.delta),
+            'dirty': len(self.dirty),
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale_served': self.stale_served,
+            'delta_errors': self.delta_errors,
+        }
+
+
+def export_links(conn, path, batch_size=10000):
+    """Stream every short_url row into a snapshot at path; returns the link count
+
+    Links already expired are left out. Codes are ordered byte-wise (the
+    "C" collation on Postgres) so they come out in key order.
+    """
+    from app.models import ShortURL
+
+    table = ShortURL.__table__
+    # Taken before reading, so the delta overlay covers anything written meanwhile
+    as_of = time.time()
+    now = datetime.utcnow()
+    order = table.c.short_code
+    if conn.dialect.name == 'postgresql':
+        order = text('short_code COLLATE "C"')
+    stmt = (select(table.c.short_code, table.c.original_url, table.c.expires_at)
+            .where((table.c.expires_at.is_(None)) | (table.c.expires_at > now))
+            .order_by(order))
+    result = conn.execution_options(yield_per=batch_size).execute(stmt)
+    rows = (row for partition in result.partitions() for row in partition)
+    return write_snapshot(rows, path, as_of)
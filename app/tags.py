@@ -0,0 +1,89 @@
+"""Per-user tags in the tag / link_tag tables
+
+Tag names are normalized (trimmed, lower-case, single spaces) so that
+"Work" and "work " are one tag. Writes run in the caller's transaction;
+the caller commits.
+"""
+import re
+
+from sqlalchemy import delete, insert, select
+
+from app import db
+from app.models import LinkTag, Tag
+
+TAG_MAX_LENGTH = 32
+WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_tags(value, limit):
+    """(list of distinct tag names, error message or None) from a list or comma-separated string"""
+    if value is None:
+        return [], None
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, list) or not all(isinstance(tag, str) for tag in value):
+        return None, 'tags must be a list of strings'
+    names = []
+    for tag in value:
+        name = WHITESPACE.sub(' ', tag).strip().lower()
+        if not name:
+            continue
+        if len(name) > TAG_MAX_LENGTH:
+            return None, f'Tags can be at most {TAG_MAX_LENGTH} characters'
+        if name not in names:
+            names.append(name)
+    if len(names) > limit:
+        return None, f'At most {limit} tags per link'
+    return names, None
+
+
+def tags_for(link_ids, chunk_size=500):
+    """Map link id -> sorted tag names, for the links that have any"""
+    found = {}
+    link_ids = list(link_ids)
+    for start in range(0, len(link_ids), chunk_size):
+        rows = db.session.execute(
+            select(LinkTag.link_id, Tag.name)
+            .join(Tag, Tag.id == LinkTag.tag_id)
+            .where(LinkTag.link_id.in_(link_ids[start:start + chunk_size]))
+            .order_by(LinkTag.link_id, Tag.name))
+        for link_id, name in rows:
+            found.setdefault(link_id, []).append(name)
+    return found
+
+
+def tag_ids(user_id, names):
+    """Map name -> id for the user's existing tags among names"""
+    if not names:
+        return {}
+    return dict(db.session.execute(
+        select(Tag.name, Tag.id).where(Tag.user_id == user_id, Tag.name.in_(names))).all())
+
+
+def _insert_ignoring_duplicates():
+    # Concurrent requests may create the same tag; the unique index decides
+    if db.session.get_bind().dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    return dialect_insert(Tag.__table__).on_conflict_do_nothing()
+
+
+def set_tags(user_id, link_tags, replace=False):
+    """Tag links: link_tags maps link id -> normalized names
+
+    With replace, links' existing tags not in their new list are removed.
+    """
+    names = sorted({name for tags in link_tags.values() for name in tags})
+    ids = tag_ids(user_id, names)
+    missing = [name for name in names if name not in ids]
+    if missing:
+        db.session.execute(_insert_ignoring_duplicates(),
+                           [{'user_id': user_id, 'name': name} for name in missing])
+        ids.update(tag_ids(user_id, missing))
+    if replace:
+        db.session.execute(delete(LinkTag.__table__).where(LinkTag.link_id.in_(list(link_tags))))
+    rows = [{'tag_id': ids[name], 'link_id': link_id}
+            for link_id, tags in link_tags.items() for name in tags]
+    if rows:
+        db.session.execute(insert(LinkTag.__table__), rows)
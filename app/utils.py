@@ -1,8 +1,8 @@
-from urllib.parse import urlparse
-from flask import jsonify
+from urllib.parse import urlparse, urlsplit, urlunsplit
+from datetime import datetime, timedelta, timezone
+from flask import jsonify, request
+import hashlib
 import re
-import string
-import random
 
 def validate_url(url):
     """Validate URL format using urlparse"""
@@ -17,6 +17,96 @@ def validate_email(email):
     pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
     return re.match(pattern, email) is not None
 
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+def normalize_url(url):
+    """Canonical form for deduplication: lower-case scheme and host, no default port, non-empty path"""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = parts.hostname or ''
+    if ':' in host:
+        host = f'[{host}]'
+    netloc = host
+    if parts.username is not None:
+        userinfo = parts.username if parts.password is None else f'{parts.username}:{parts.password}'
+        netloc = f'{userinfo}@{netloc}'
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        netloc = f'{netloc}:{port}'
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, parts.fragment))
+
+def url_hash(url):
+    """16-byte digest of the normalized URL, as stored in short_url.url_hash"""
+    return hashlib.blake2b(normalize_url(url).encode('utf-8'), digest_size=16).digest()
+
+def is_url_hash_conflict(error):
+    """Whether an IntegrityError was raised by the (user_id, url_hash) unique index"""
+    return 'url_hash' in str(getattr(error, 'orig', error))
+
+# Root-level paths that a custom short code would be shadowed by
+RESERVED_SHORT_CODES = {'api', 'auth', 'healthz', 'metrics'}
+
+def validate_short_code(short_code):
+    """Return an error message for an invalid custom short code, else None"""
+    if not isinstance(short_code, str) or len(short_code) < 3 or len(short_code) > 8:
+        return 'Short code must be between 3 and 8 characters'
+    if not short_code.isascii() or not short_code.isalnum():
+        return 'Short code can only contain letters and numbers'
+    if short_code.lower() in RESERVED_SHORT_CODES:
+        return 'Short code is reserved'
+    return None
+
+def parse_expiry(data):
+    """(expires_at as naive UTC or None, error message or None) from expiresAt / expiresIn
+
+    expiresAt is an ISO 8601 timestamp (UTC unless it has an offset) and
+    expiresIn a number of seconds from now; an explicit null means never.
+    """
+    expires_at, expires_in = data.get('expiresAt'), data.get('expiresIn')
+    if expires_at is not None and expires_in is not None:
+        return None, 'Use either expiresAt or expiresIn, not both'
+    now = datetime.utcnow()
+    if expires_in is not None:
+        if isinstance(expires_in, bool) or not isinstance(expires_in, (int, float)) or expires_in <= 0:
+            return None, 'expiresIn must be a positive number of seconds'
+        try:
+            return now + timedelta(seconds=expires_in), None
+        except OverflowError:
+            return None, 'expiresIn is too far in the future'
+    if expires_at is None:
+        return None, None
+    try:
+        expires_at = datetime.fromisoformat(expires_at)
+    except (TypeError, ValueError):
+        return None, 'expiresAt must be an ISO 8601 timestamp'
+    if expires_at.tzinfo is not None:
+        expires_at = expires_at.astimezone(timezone.utc).replace(tzinfo=None)
+    if expires_at <= now:
+        return None, 'expiresAt must be in the future'
+    return expires_at, None
+
+def client_ip():
+    """Address of the client behind the current request
+
+    ProxyFix (PROXY_FIX_X_FOR) has already replaced the nearest proxy's
+    address with the one from X-Forwarded-For when there are trusted proxies.
+    """
+    return request.remote_addr
+
+def forwarded_client(forwarded_for, hops):
+    """Client address in an X-Forwarded-For value written by hops trusted proxies
+
+    Picks the entry the way werkzeug's ProxyFix does; None if there are
+    fewer entries than hops.
+    """
+    values = [value.strip() for value in forwarded_for.split(',')]
+    if hops <= 0 or len(values) < hops:
+        return None
+    return values[-hops]
+
 def error_response(status_code, message):
     """Standard error response format"""
     return jsonify({
@@ -24,8 +114,3 @@ def error_response(status_code, message):
         'message': message,
         'success': False
     }), status_code
-
-def generate_short_code(length=6):
-    """Generate random alphanumeric short code"""
-    characters = string.ascii_letters + string.digits
-    return ''.join(random.choice(characters) for _ in range(length))
\ No newline at end of file
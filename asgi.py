@@ -0,0 +1,9 @@
+from dotenv import load_dotenv
+from app.redirector import create_redirect_app
+
+# Load environment variables first
+load_dotenv()
+
+# Redirect-only service: uvicorn asgi:app --workers 4
+# Set CACHE_BACKEND so it hears of edits and deletes made through the main app
+app = create_redirect_app()
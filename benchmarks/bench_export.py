@@ -0,0 +1,105 @@
+"""Measure the streaming export of one large account: time, size and peak memory.
+
+    python benchmarks/bench_export.py --rows 1000000
+
+Seeds one user with --rows links, then downloads
+GET /api/api/user/urls/export as NDJSON, CSV and gzip-compressed CSV
+through the test client, reading the body chunk by chunk the way a
+client on the other end of a socket would. Resident memory is sampled
+after every chunk and reported as the peak above the level before the
+request. For comparison, the last run builds the same export the way a
+single JSON response would: every ShortURL loaded as a model instance
+with its owner, turned into a dict and encoded at once. It runs last
+because the memory it takes is not given back to the OS. Resident memory
+is read from /proc, so run it on Linux.
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from harness import seed  # noqa: E402
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * PAGE_SIZE
+
+
+def mib(size):
+    return f'{size / 2 ** 20:8.1f} MiB'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--database-url', default=None)
+    parser.add_argument('--skip-materialized', action='store_true',
+                        help='Leave out the load-everything comparison.')
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['DATABASE_URL'] = args.database_url or f'sqlite:///{db_path}'
+    os.environ.setdefault('SECRET_KEY', 'bench')
+    os.environ.setdefault('JWT_SECRET_KEY', 'bench-secret-key-of-sufficient-length')
+    os.environ['METRICS_ENABLED'] = 'false'
+    os.environ['RATELIMIT_ENABLED'] = 'false'
+
+    from flask_jwt_extended import create_access_token
+    from app import create_app, db
+    from app.models import ShortURL, User
+    from app.serializers import dumps
+
+    app = create_app()
+    logging.getLogger().setLevel(logging.WARNING)
+    seed(app, 1, args.rows)
+    with app.app_context():
+        user_id = db.session.query(User.id).scalar()
+        token = create_access_token(identity=user_id)
+
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {token}'}
+
+    def export(query, encoding=None):
+        request_headers = dict(headers, **({'Accept-Encoding': encoding} if encoding else {}))
+        baseline = peak = rss()
+        start = time.perf_counter()
+        response = client.get(f'/api/api/user/urls/export?{query}', headers=request_headers,
+                              buffered=False)
+        assert response.status_code == 200, response.get_data(as_text=True)
+        size = 0
+        for chunk in response.iter_encoded():
+            size += len(chunk)
+            peak = max(peak, rss())
+        response.close()
+        return time.perf_counter() - start, size, peak - baseline
+
+    print(f"{args.rows} links, one account")
+    for name, query, encoding in (('ndjson', 'format=ndjson', None),
+                                  ('csv', 'format=csv', None),
+                                  ('csv, gzip', 'format=csv', 'gzip')):
+        elapsed, size, growth = export(query, encoding)
+        print(f"{name:>14}: {elapsed:7.2f} s  {mib(size)} sent  peak RSS +{mib(growth)}  "
+              f"({args.rows / elapsed:,.0f} links/s)")
+
+    if not args.skip_materialized:
+        with app.app_context(), app.test_request_context():
+            baseline = rss()
+            start = time.perf_counter()
+            serializer = app.extensions['url_serializer']
+            links = db.session.query(ShortURL).filter_by(user_id=user_id).order_by(ShortURL.id).all()
+            # to_dict() without its per-link tag query, which would dominate the time
+            body = dumps({'urls': [serializer.detail(link, link.owner.to_dict()) for link in links]})
+            elapsed = time.perf_counter() - start
+            growth = rss() - baseline
+        print(f"{'materialized':>14}: {elapsed:7.2f} s  {mib(len(body))} built  RSS +{mib(growth)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""Compare gunicorn profiles on the redirect endpoint: throughput, CPU and per-worker memory.
+
+    python benchmarks/bench_gunicorn_profiles.py --workers 4 --requests 20000
+    python benchmarks/bench_gunicorn_profiles.py --profiles sync gthread --connections 64
+
+Seeds a throwaway SQLite database (or --database-url), then starts gunicorn
+with the shipped gunicorn.conf.py once per profile (sync, gthread and, if
+gevent is installed, gevent), all preloaded. gthread also runs once more
+without preloading, to show what preload_app saves. Each server is warmed
+up and then driven with GET /<code> over keep-alive connections (the
+asyncio client from bench_redirect_asgi.py). Reported per run:
+
+    req/s         wall-clock throughput
+    CPU ms/req    CPU time of the whole server process tree per request
+    RSS/worker    average resident size of a worker
+    PSS/worker    RSS with shared pages divided among the processes
+                  sharing them; what a worker really costs
+    private       pages only that worker has (written since the fork)
+
+Memory is read from /proc/<pid>/smaps_rollup after the load, so run it
+on Linux. For over-the-wire numbers, run the load on a separate machine.
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_redirect_asgi import drive, free_port, process_tree_cpu, wait_healthy  # noqa: E402
+from harness import seed  # noqa: E402
+
+PROFILES = ('sync', 'gthread', 'gevent')
+
+
+def worker_pids(master):
+    pids = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                parent = int(f.read().rsplit(')', 1)[1].split()[1])
+        except OSError:
+            continue
+        if parent == master:
+            pids.append(int(entry))
+    return pids
+
+
+def memory(pid):
+    """(rss, pss, private) bytes of one process"""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            name, _, rest = line.partition(':')
+            if rest.strip().endswith('kB'):
+                values[name] = int(rest.split()[0]) * 1024
+    return values['Rss'], values['Pss'], values['Private_Clean'] + values['Private_Dirty']
+
+
+def mib(size):
+    return f'{size / 2 ** 20:6.1f} MiB'
+
+
+def run(name, profile, preload, env, codes, args):
+    port = free_port()
+    env = dict(env, GUNICORN_PROFILE=profile, GUNICORN_WORKERS=str(args.workers),
+               GUNICORN_BIND=f'127.0.0.1:{port}', GUNICORN_LOG_LEVEL='warning',
+               GUNICORN_PRELOAD='true' if preload else 'false')
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py'],
+                               cwd=ROOT, env=env)
+    try:
+        asyncio.run(wait_healthy(port))
+        asyncio.run(drive(port, '/', codes, min(len(codes), args.warmup), args.connections))
+        cpu_before = process_tree_cpu(process.pid)
+        elapsed, errors = asyncio.run(drive(port, '/', codes, args.requests, args.connections))
+        cpu = process_tree_cpu(process.pid) - cpu_before
+        workers = [memory(pid) for pid in worker_pids(process.pid)]
+    finally:
+        process.terminate()
+        process.wait()
+
+    rss, pss, private = (sum(values) / len(workers) for values in zip(*workers))
+    print(f"{name:>19}: {args.requests / elapsed:7.0f} req/s  "
+          f"{cpu * 1000 / args.requests:6.3f} CPU ms/req  "
+          f"RSS/worker {mib(rss)}  PSS/worker {mib(pss)}  private {mib(private)}  errors {errors}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--profiles', nargs='+', choices=PROFILES, default=list(PROFILES))
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--links', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--warmup', type=int, default=10000)
+    parser.add_argument('--connections', type=int, default=32)
+    parser.add_argument('--database-url', default=None)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env['DATABASE_URL'] = args.database_url or 'sqlite:///' + os.path.join(
+        tempfile.mkdtemp(), 'profiles.db')
+    env.setdefault('SECRET_KEY', 'bench')
+    env.setdefault('JWT_SECRET_KEY', 'bench-secret-key-of-sufficient-length')
+    env['URL_CACHE_SIZE'] = str(max(args.links, 10000))
+    env['RATELIMIT_ENABLED'] = 'false'  # one client sends everything
+    os.environ.update(env)
+
+    from app import create_app
+    import logging
+
+    app = create_app()
+    logging.getLogger().setLevel(logging.WARNING)
+    _, codes = seed(app, 1, args.links)
+
+    print(f"{args.workers} workers, {args.connections} connections, {args.requests} redirects per run")
+    for profile in args.profiles:
+        if profile == 'gevent':
+            try:
+                import gevent  # noqa: F401
+            except ImportError:
+                print(f"{'gevent':>19}: skipped, gevent is not installed")
+                continue
+        run(profile, profile, True, env, codes, args)
+        if profile == 'gthread':
+            run('gthread, no preload', profile, False, env, codes, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Measure login throughput of one worker process.
+
+    python benchmarks/bench_login.py --threads 8 --logins 200 --rounds 10 12
+
+Each run drives POST /auth/login from --threads concurrent clients through
+the Flask test client, the way a threaded worker would serve them, and
+reports successful logins per second, latency and how many were shed with
+503 by the bounded bcrypt pool.
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--rounds', type=int, nargs='+', default=[10, 12])
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'login.db')
+    os.environ.setdefault('SECRET_KEY', 'bench')
+    os.environ.setdefault('JWT_SECRET_KEY', 'bench-secret-key-of-sufficient-length')
+    os.environ['RATELIMIT_ENABLED'] = 'false'  # one client sends every login
+
+    from app import create_app, db, password_hasher
+    from app.models import User
+
+    print(f"{'rounds':>6} {'logins/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'shed':>5}")
+    for rounds in args.rounds:
+        app = create_app()
+        logging.getLogger().setLevel(logging.WARNING)
+        app.config['BCRYPT_LOG_ROUNDS'] = rounds
+        password_hasher.init_app(app)
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            user = User(email='bench@example.com', username='bench')
+            user.set_password('secret')
+            db.session.add(user)
+            db.session.commit()
+
+        latencies = []
+        statuses = []
+        per_thread = args.logins // args.threads
+
+        def worker():
+            client = app.test_client()
+            for _ in range(per_thread):
+                start = time.perf_counter()
+                response = client.post('/auth/login', json={
+                    'email': 'bench@example.com', 'password': 'secret'})
+                latencies.append(time.perf_counter() - start)
+                statuses.append(response.status_code)
+
+        threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        ok = statuses.count(200)
+        latencies.sort()
+        print(f'{rounds:>6} {ok / elapsed:>9.1f} '
+              f'{statistics.median(latencies) * 1000:>8.1f} '
+              f'{latencies[int(len(latencies) * 0.95) - 1] * 1000:>8.1f} '
+              f'{statuses.count(503):>5}')
+
+
+if __name__ == '__main__':
+    main()
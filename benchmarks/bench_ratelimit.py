@@ -0,0 +1,150 @@
+"""Measure the token-bucket rate limiter and what it adds to a redirect.
+
+    python benchmarks/bench_ratelimit.py --keys 1 10000 1000000
+    python benchmarks/bench_ratelimit.py --backend redis://localhost:6379/15
+
+Reports, in order:
+
+  take          TokenBuckets.take() calls per second with --keys distinct
+                keys (clients) in rotation, one thread, every call allowed
+  threads       the same spread over --threads threads sharing one store
+  backend       RateLimiter.take() against --backend, one round trip each
+                (only with --backend)
+  redirect      GET /<code> through the Flask test client with no redirect
+                limit, then with RATELIMIT_REDIRECT_PER_IP set high enough
+                never to refuse, and the limiter's own check() per request
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from harness import seed  # noqa: E402
+from app.ratelimit import RateLimiter, TokenBuckets  # noqa: E402
+
+# A rule no benchmark client can exhaust: every take() does the full work
+INTERVAL, BURST = 1e-9, 10 ** 12
+
+
+def bench_take(keys, calls):
+    buckets = TokenBuckets(max_keys=max(keys, 1) * 2)
+    names = [f'shorten:ip:10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}' for i in range(keys)]
+    for name in names:
+        buckets.take(name, INTERVAL, BURST)
+    take = buckets.take
+    start = time.perf_counter()
+    for i in range(calls):
+        take(names[i % keys], INTERVAL, BURST)
+    return calls / (time.perf_counter() - start)
+
+
+def bench_threads(threads, keys, calls):
+    buckets = TokenBuckets(max_keys=keys * 2)
+    names = [f'redirect:ip:{i}' for i in range(keys)]
+    per_thread = calls // threads
+
+    def run(offset):
+        take = buckets.take
+        for i in range(per_thread):
+            take(names[(offset + i) % keys], INTERVAL, BURST)
+
+    workers = [threading.Thread(target=run, args=(n * 7919,)) for n in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return per_thread * threads / (time.perf_counter() - start)
+
+
+def bench_backend(url, calls, socket_timeout):
+    limiter = RateLimiter()
+    limiter.configure({'RATELIMIT_SHORTEN_PER_IP': f'{BURST}/second',
+                       'RATELIMIT_STORAGE': url,
+                       'CACHE_SOCKET_TIMEOUT': socket_timeout,
+                       'CACHE_KEY_PREFIX': f'bench:{os.getpid()}:'})
+    start = time.perf_counter()
+    for i in range(calls):
+        limiter.take('shorten', 'ip', str(i % 100))
+    elapsed = time.perf_counter() - start
+    if limiter.backend_errors:
+        print(f"  {limiter.backend_errors} backend errors, results are not meaningful")
+    return calls / elapsed
+
+
+def bench_redirect(args):
+    """Seconds per redirect without and with a per-IP redirect limit"""
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['DATABASE_URL'] = args.database_url or f'sqlite:///{db_path}'
+    os.environ['METRICS_ENABLED'] = 'false'
+
+    from app import create_app, rate_limiter
+    app = create_app()
+    logging.getLogger().setLevel(logging.WARNING)
+    _, codes = seed(app, 1, 100)
+    client = app.test_client()
+    for code in codes:
+        client.get(f'/{code}')
+
+    def run():
+        start = time.perf_counter()
+        for i in range(args.requests):
+            client.get(f'/{codes[i % len(codes)]}',
+                       environ_base={'REMOTE_ADDR': f'10.0.{i >> 8 & 255}.{i & 255}'})
+        return (time.perf_counter() - start) / args.requests
+
+    # Alternate the variants and keep each one's best, so drift does not
+    # land on either side
+    unlimited = limited = float('inf')
+    for _ in range(3):
+        rate_limiter.configure(dict(app.config, RATELIMIT_REDIRECT_PER_IP=''))
+        unlimited = min(unlimited, run())
+        rate_limiter.configure(dict(app.config, RATELIMIT_REDIRECT_PER_IP=f'{BURST}/second'))
+        limited = min(limited, run())
+
+    # The limiter's own share, without the test client's noise
+    with app.test_request_context(f'/{codes[0]}', environ_base={'REMOTE_ADDR': '10.1.2.3'}):
+        start = time.perf_counter()
+        for _ in range(args.requests * 10):
+            rate_limiter.check('redirect')
+        check = (time.perf_counter() - start) / (args.requests * 10)
+    app.extensions['click_buffer'].shutdown()
+    return unlimited, limited, check
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--keys', type=int, nargs='+', default=[1, 10000, 1000000])
+    parser.add_argument('--calls', type=int, default=1000000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--backend', default=None, help='a redis:// URL to benchmark against')
+    parser.add_argument('--socket-timeout', type=float, default=0.25)
+    parser.add_argument('--requests', type=int, default=5000, help='redirects per variant')
+    parser.add_argument('--database-url', default=None)
+    args = parser.parse_args()
+
+    os.environ.setdefault('SECRET_KEY', 'bench')
+    os.environ.setdefault('JWT_SECRET_KEY', 'bench-secret-key-of-sufficient-length')
+
+    for keys in args.keys:
+        rate = bench_take(keys, args.calls)
+        print(f"take      {keys:>8} keys  {rate / 1e6:6.2f}M/s  {1e9 / rate:6.0f} ns/call")
+    keys = max(args.keys)
+    rate = bench_threads(args.threads, keys, args.calls)
+    print(f"threads   {args.threads:>3} x {keys} keys  {rate / 1e6:6.2f}M/s total")
+    if args.backend:
+        rate = bench_backend(args.backend, min(args.calls, 20000), args.socket_timeout)
+        print(f"backend   {args.backend}  {rate:8.0f}/s  {1e6 / rate:6.0f} us/call")
+
+    unlimited, limited, check = bench_redirect(args)
+    print(f"redirect  no limit {unlimited * 1e6:6.1f} us  per-IP limit {limited * 1e6:6.1f} us  "
+          f"check() {check * 1e6:4.1f} us/request")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+"""Compare redirects per CPU-second: Flask under gunicorn vs the ASGI redirect service.
+
+    python benchmarks/bench_redirect_asgi.py --links 10000 --requests 20000
+    python benchmarks/bench_redirect_asgi.py --flask-worker-class gthread --connections 32
+
+Seeds a throwaway SQLite database (or --database-url), starts one gunicorn
+worker serving the Flask app and one uvicorn worker serving asgi:app, and
+drives GET /<code> on both over keep-alive
+connections from a minimal asyncio client. Besides wall-clock req/s it
+reports the server process tree's CPU time per request from /proc, which
+is the number that matters here: redirects per core, independent of how
+much CPU the load generator steals on the same machine.
+
+It first compares the two stacks in-process (Flask test client against
+direct ASGI calls), which isolates framework and lookup cost from the HTTP
+server and kernel. Run the load generator on a separate machine for the
+most faithful over-the-wire numbers; on a single shared core the HTTP
+server's own per-request floor narrows the gap.
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from harness import seed  # noqa: E402
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def process_tree_cpu(pid):
+    """User+system CPU seconds of pid and its live descendants"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append((int(entry), fields))
+
+    total = 0.0
+    stack = [pid]
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    total += (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    while stack:
+        for child, fields in children.get(stack.pop(), []):
+            total += (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+            stack.append(child)
+    return total
+
+
+async def wait_healthy(port, path='/healthz', attempts=200):
+    for _ in range(attempts):
+        try:
+            status, _ = await fetch_once(port, path)
+            if status == 200:
+                return
+        except OSError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError(f'server on port {port} did not become healthy')
+
+
+async def fetch_once(port, path):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: bench\r\n\r\n'.encode())
+        return await read_response(reader)
+    finally:
+        writer.close()
+
+
+async def read_response(reader):
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.split(b'\r\n')
+    status = int(lines[0].split()[1])
+    length = 0
+    close = False
+    for line in lines[1:]:
+        name, _, value = line.partition(b':')
+        name = name.strip().lower()
+        if name == b'content-length':
+            length = int(value)
+        elif name == b'connection' and value.strip().lower() == b'close':
+            close = True
+    if length:
+        await reader.readexactly(length)
+    return status, close
+
+
+async def drive(port, prefix, codes, total, connections, expected=302):
+    """Send total requests over keep-alive connections; returns (elapsed, errors)"""
+    errors = 0
+    remaining = total
+
+    async def worker(seed_value):
+        nonlocal errors, remaining
+        rng = random.Random(seed_value)
+        reader = writer = None
+        while remaining > 0:
+            remaining -= 1
+            if writer is None:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            path = prefix + rng.choice(codes)
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: bench\r\n\r\n'.encode())
+            try:
+                status, close = await read_response(reader)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                status, close = None, True
+            if status != expected:
+                errors += 1
+            if close:
+                writer.close()
+                reader = writer = None
+        if writer is not None:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(connections)))
+    return time.perf_counter() - start, errors
+
+
+def measure(name, process, port, prefix, codes, args):
+    asyncio.run(wait_healthy(port))
+    # Warm the per-worker URL cache so both sides are measured on the hot path
+    asyncio.run(drive(port, prefix, codes, min(len(codes), args.warmup), args.connections))
+    cpu_before = process_tree_cpu(process.pid)
+    elapsed, errors = asyncio.run(drive(port, prefix, codes, args.requests, args.connections))
+    cpu = process_tree_cpu(process.pid) - cpu_before
+    result = {
+        'server': name,
+        'rps': args.requests / elapsed,
+        'cpu_ms_per_request': cpu * 1000 / args.requests if cpu else None,
+        'requests_per_cpu_second': args.requests / cpu if cpu else None,
+        'errors': errors,
+    }
+    if cpu:
+        cost = f"{result['requests_per_cpu_second']:8.0f} req/CPU-s  " \
+               f"{result['cpu_ms_per_request']:.3f} ms CPU/req"
+    else:
+        cost = 'CPU time unavailable'
+    print(f"{name:>6}: {result['rps']:8.0f} req/s wall  {cost}  errors {errors}")
+    return result
+
+
+def measure_in_process(app, codes, requests):
+    """Per-request CPU of each stack with no sockets involved"""
+    from app.redirector import create_redirect_app
+
+    client = app.test_client()
+    paths = ['/' + code for code in codes]
+    for path in paths:
+        client.get(path)
+    start = time.process_time()
+    for i in range(requests):
+        client.get(paths[i % len(paths)])
+    flask_us = (time.process_time() - start) * 1e6 / requests
+
+    service = create_redirect_app()
+    scopes = [{'type': 'http', 'method': 'GET', 'path': '/' + code, 'headers': [],
+               'client': ('127.0.0.1', 0)} for code in codes]
+
+    async def send(message):
+        pass
+
+    async def run():
+        for scope in scopes:
+            await service(scope, None, send)
+        start = time.process_time()
+        for i in range(requests):
+            await service(scopes[i % len(scopes)], None, send)
+        return (time.process_time() - start) * 1e6 / requests
+
+    asgi_us = asyncio.run(run())
+    asyncio.run(service.engine.dispose())
+    print(f"in-process: flask {flask_us:.1f} us/req  asgi {asgi_us:.1f} us/req  "
+          f"({flask_us / asgi_us:.1f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--links', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--warmup', type=int, default=20000)
+    parser.add_argument('--connections', type=int, default=16)
+    parser.add_argument('--database-url', default=None)
+    parser.add_argument('--flask-worker-class', default='sync')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env['DATABASE_URL'] = args.database_url or 'sqlite:///' + os.path.join(
+        tempfile.mkdtemp(), 'redirect.db')
+    env.setdefault('SECRET_KEY', 'bench')
+    env.setdefault('JWT_SECRET_KEY', 'bench-secret-key-of-sufficient-length')
+    env['URL_CACHE_SIZE'] = str(max(args.links, 10000))
+    os.environ.update(env)
+
+    from app import create_app
+    import logging
+
+    app = create_app()
+    logging.getLogger().setLevel(logging.WARNING)
+    _, codes = seed(app, 1, args.links)
+
+    measure_in_process(app, codes, args.requests)
+
+    flask_port, asgi_port = free_port(), free_port()
+    servers = {
+        'flask': subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-w', '1', '-k', args.flask_worker_class,
+             '--threads', '4', '-b', f'127.0.0.1:{flask_port}', '--log-level', 'warning',
+             'app:create_app()'], cwd=ROOT, env=env),
+        'asgi': subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'asgi:app', '--workers', '1',
+             '--host', '127.0.0.1', '--port', str(asgi_port), '--log-level', 'warning',
+             '--no-access-log'], cwd=ROOT, env=env),
+    }
+    try:
+        flask = measure('flask', servers['flask'], flask_port, '/', codes, args)
+        asgi = measure('asgi', servers['asgi'], asgi_port, '/', codes, args)
+    finally:
+        for process in servers.values():
+            process.terminate()
+            process.wait()
+
+    if flask['requests_per_cpu_second'] and asgi['requests_per_cpu_second']:
+        print(f"over HTTP: asgi serves {asgi['requests_per_cpu_second'] / flask['requests_per_cpu_second']:.1f}x "
+              f"the redirects per CPU-second")
+
+
+if __name__ == '__main__':
+    main()
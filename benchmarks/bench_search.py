@@ -0,0 +1,140 @@
+"""Time link searches on one large account.
+
+    python benchmarks/bench_search.py --rows 100000 --runs 5
+
+Seeds one user with --rows links, each with a three-word title and up to
+three tags: 'common' on a third of the links, 'rare' on one in 200, and a
+spread of 40 others. Then times the first page (limit 100) of
+GET /api/api/user/urls/search for each filter, through the test client
+('no filter' is the fixed cost of a 100-link page), against the old way
+of finding the same links: paging through the whole listing and
+filtering client-side.
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from harness import seed  # noqa: E402
+
+WORDS = ('alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel', 'india',
+         'juliet', 'kilo', 'lima', 'mike', 'november', 'oscar', 'papa', 'quebec', 'romeo',
+         'sierra', 'tango', 'uniform', 'victor', 'whiskey', 'xray', 'yankee', 'zulu')
+HOSTS = ('github.com', 'docs.python.org', 'news.ycombinator.com', 'example.com', 'wikipedia.org')
+
+SEARCHES = (
+    ('no filter', ''),
+    ('tag common', 'tag=common'),
+    ('tag rare', 'tag=rare'),
+    ('tags common+rare', 'tag=common&tag=rare'),
+    ('q one word', 'q=tango'),
+    ('q two words', 'q=tang+whisk'),
+    ('title prefix', 'title=zulu+yan'),
+    ('url prefix', 'url=https://github.com/'),
+    ('url prefix, all', 'url=https://'),
+    ('everything', 'tag=common&q=alpha&url=https://docs'),
+)
+
+
+def best_of(runs, fn):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--database-url', default=None)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['DATABASE_URL'] = args.database_url or f'sqlite:///{db_path}'
+    os.environ.setdefault('SECRET_KEY', 'bench')
+    os.environ.setdefault('JWT_SECRET_KEY', 'bench-secret-key-of-sufficient-length')
+    os.environ['USER_URLS_MAX_PAGE_SIZE'] = '1000'
+    os.environ['METRICS_ENABLED'] = 'false'
+    os.environ['RATELIMIT_ENABLED'] = 'false'
+
+    from flask_jwt_extended import create_access_token
+    from sqlalchemy import bindparam, select, text, update
+    from app import create_app, db
+    from app.models import ShortURL, User
+    from app.tags import set_tags
+
+    app = create_app()
+    logging.getLogger().setLevel(logging.WARNING)
+    seed(app, 1, args.rows)
+
+    rng = random.Random(42)
+    with app.app_context():
+        user_id = db.session.query(User.id).scalar()
+        link_ids = db.session.execute(select(ShortURL.id).order_by(ShortURL.id)).scalars().all()
+        table = ShortURL.__table__
+        rows, link_tags = [], {}
+        for link_id in link_ids:
+            words = rng.sample(WORDS, 3)
+            rows.append({'link_id': link_id, 'title': ' '.join(words).title(),
+                         'url': f'https://{rng.choice(HOSTS)}/{"/".join(words)}/{link_id}'})
+            tags = [f'topic {rng.randrange(40)}'] if rng.random() < 0.8 else []
+            if link_id % 3 == 0:
+                tags.append('common')
+            if link_id % 200 == 0:
+                tags.append('rare')
+            link_tags[link_id] = tags
+        db.session.execute(
+            update(table).where(table.c.id == bindparam('link_id'))
+            .values(title=bindparam('title'), original_url=bindparam('url')), rows)
+        set_tags(user_id, link_tags)
+        if db.session.get_bind().dialect.name == 'sqlite':
+            db.session.execute(text('ANALYZE'))
+        else:
+            db.session.execute(text('ANALYZE short_url, tag, link_tag'))
+        db.session.commit()
+        # SQLite reads the statistics when a connection opens
+        db.engine.dispose()
+        token = create_access_token(identity=user_id)
+
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {token}'}
+
+    def search(query):
+        def run():
+            response = client.get(f'/api/api/user/urls/search?limit=100&{query}', headers=headers)
+            assert response.status_code == 200, response.get_data(as_text=True)
+            return [item['id'] for item in response.get_json()['urls']]
+        return run
+
+    def client_side(tag):
+        def run():
+            found, cursor = [], 0
+            while cursor is not None and len(found) < 100:
+                page = client.get(f'/api/api/user/urls?limit=1000&cursor={cursor}',
+                                  headers=headers).get_json()
+                found.extend(item['id'] for item in page['urls'] if tag in item['tags'])
+                cursor = page['next_cursor']
+            return found[:100]
+        return run
+
+    print(f"{args.rows} links, first page of 100, best of {args.runs}")
+    for name, query in SEARCHES:
+        elapsed, ids = best_of(args.runs, search(query))
+        print(f"{name:>18}: {elapsed * 1000:8.2f} ms  {len(ids):3d} links")
+    for tag in ('common', 'rare'):
+        elapsed, ids = best_of(max(1, args.runs // 2), client_side(tag))
+        expected = search(f'tag={tag}')()
+        same = 'same links' if ids == expected else 'LINKS DIFFER'
+        print(f"{'listing + filter ' + tag:>18}: {elapsed * 1000:8.2f} ms  {len(ids):3d} links  {same}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""Compare ways of serializing a 10k-row link listing.
+
+    python benchmarks/bench_serialization.py --rows 10000 --runs 5
+
+Seeds one user with --rows links and times, per listing:
+
+  orm_to_dict   ORM instances and the per-row to_dict the API used to
+                build (url_for per row, owner dict rebuilt per row), json
+  rows_json     row tuples with a json.dumps call per row, the listing
+                endpoint before the serializer layer
+  serializer    row tuples through URLSerializer.listing, stdlib json
+  + orjson      the same, encoded by orjson per partition (when installed)
+  endpoint      GET /api/api/user/urls?limit=<rows> through the test client
+
+Every variant produces the same JSON documents; the script checks that.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from harness import seed  # noqa: E402
+
+
+def best_of(runs, fn):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--database-url', default=None)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['DATABASE_URL'] = args.database_url or f'sqlite:///{db_path}'
+    os.environ.setdefault('SECRET_KEY', 'bench')
+    os.environ.setdefault('JWT_SECRET_KEY', 'bench-secret-key-of-sufficient-length')
+    os.environ['USER_URLS_MAX_PAGE_SIZE'] = str(args.rows)
+    os.environ['METRICS_ENABLED'] = 'false'
+
+    from flask import url_for
+    from flask_jwt_extended import create_access_token
+    from sqlalchemy import select, update
+    from app import create_app, db, serializers
+    from app.models import ShortURL, User
+    from app.routes import URL_LIST_FIELDS
+    from app.tags import set_tags, tags_for
+
+    app = create_app()
+    logging.getLogger().setLevel(logging.WARNING)
+    seed(app, 1, args.rows)
+    fields = list(URL_LIST_FIELDS)
+
+    with app.app_context():
+        db.session.execute(update(ShortURL).values(title='Bench link'))
+        user_id = db.session.query(User.id).scalar()
+        link_ids = db.session.execute(select(ShortURL.id)).scalars().all()
+        set_tags(user_id, {link_id: ['bench', 'listing'] for link_id in link_ids})
+        db.session.commit()
+        token = create_access_token(identity=user_id)
+
+    def orm_to_dict():
+        items = []
+        urls = ShortURL.query.filter_by(user_id=user_id).order_by(ShortURL.id).all()
+        tags = tags_for([url.id for url in urls])
+        for url in urls:
+            items.append({
+                'id': url.id,
+                'original_url': url.original_url,
+                'short_code': url.short_code,
+                'short_url': url_for('redirects.redirect_short_url',
+                                     short_code=url.short_code, _external=True),
+                'user_id': url.user_id,
+                'access_count': url.access_count,
+                'title': url.title,
+                'tags': tags.get(url.id, []),
+                'created_at': url.created_at.isoformat(),
+                'updated_at': url.updated_at.isoformat(),
+                'expires_at': url.expires_at.isoformat() if url.expires_at else None,
+                'owner': url.owner.to_dict() if url.owner else None
+            })
+        db.session.expunge_all()
+        return json.dumps({'urls': items})
+
+    def rows_json():
+        short_domain = app.config['SHORT_DOMAIN']
+        rows = db.session.execute(select(*URL_LIST_FIELDS.values()).where(
+            ShortURL.user_id == user_id).order_by(ShortURL.id)).all()
+        tags = tags_for([row.id for row in rows])
+        parts = []
+        for row in rows:
+            item = {}
+            for field in fields:
+                if field == 'short_url':
+                    item[field] = f"{short_domain}/{row.short_code}"
+                elif field == 'tags':
+                    item[field] = tags.get(row.id, [])
+                elif field in ('created_at', 'updated_at', 'expires_at'):
+                    value = getattr(row, field)
+                    item[field] = value.isoformat() if value else None
+                else:
+                    item[field] = getattr(row, field)
+            parts.append(json.dumps(item))
+        return '{"urls":[' + ','.join(parts) + ']}'
+
+    def serializer():
+        columns, serialize = app.extensions['url_serializer'].listing(fields, URL_LIST_FIELDS)
+        rows = db.session.execute(select(*columns).where(
+            ShortURL.user_id == user_id).order_by(ShortURL.id),
+            execution_options={'yield_per': 500})
+        parts = [serializers.dumps_items(serialize(partition))
+                 for partition in rows.partitions()]
+        return b'{"urls":[' + b','.join(parts) + b']}'
+
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {token}'}
+
+    def endpoint():
+        return client.get(f'/api/api/user/urls?limit={args.rows}', headers=headers).get_data()
+
+    def urls(document):
+        return [{key: value for key, value in item.items() if key != 'owner'}
+                for item in json.loads(document)['urls']]
+
+    orjson = serializers.orjson
+    variants = [('orm_to_dict', orm_to_dict), ('rows_json', rows_json)]
+    results = {}
+    with app.test_request_context(base_url=app.config['SHORT_DOMAIN']):
+        for name, fn in variants:
+            results[name] = best_of(args.runs, fn)
+        serializers.orjson = None
+        results['serializer'] = best_of(args.runs, serializer)
+        serializers.orjson = orjson
+        if orjson is not None:
+            results['+ orjson'] = best_of(args.runs, serializer)
+    results['endpoint'] = best_of(args.runs, endpoint)
+
+    expected = urls(results['rows_json'][1])
+    baseline = results['orm_to_dict'][0]
+    print(f"{args.rows} rows, best of {args.runs}")
+    for name, (elapsed, document) in results.items():
+        same = 'same output' if urls(document) == expected else 'OUTPUT DIFFERS'
+        print(f"{name:>12}: {elapsed * 1000:8.1f} ms  {elapsed / args.rows * 1e6:6.2f} us/row  "
+              f"{baseline / elapsed:5.1f}x  {same}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Compare short code allocation strategies as the short_url table grows.
+
+    python benchmarks/bench_short_codes.py --rows 1000000 --sample 2000
+
+"legacy" is the old random code + SELECT-until-free loop, "allocator" is
+the block-leased base62 sequence used by create_short_url. Each checkpoint
+grows the table with bulk inserts, then times `--sample` single-row inserts
+(allocation + INSERT, one transaction per row) for both strategies.
+"""
+import argparse
+import logging
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert, select  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--checkpoints', type=int, default=4)
+    parser.add_argument('--sample', type=int, default=2000)
+    parser.add_argument('--database-url', default=None)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['DATABASE_URL'] = args.database_url or f'sqlite:///{db_path}'
+    os.environ.setdefault('SECRET_KEY', 'bench')
+    os.environ.setdefault('JWT_SECRET_KEY', 'bench')
+
+    from app import create_app, db, code_allocator
+    from app.models import ShortURL, User
+
+    app = create_app()
+    logging.getLogger('sqlalchemy.engine').setLevel(logging.WARNING)
+    table = ShortURL.__table__
+
+    def random_code(length=6):
+        return ''.join(random.choice(string.ascii_letters + string.digits) for _ in range(length))
+
+    def legacy_code(conn):
+        code = random_code()
+        while conn.execute(select(table.c.id).where(table.c.short_code == code)).first():
+            code = random_code()
+        return code
+
+    def allocator_code(conn):
+        return code_allocator.allocate()
+
+    with app.app_context():
+        db.create_all()
+        user = User(email='bench@example.com', username='bench')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+        def timed_inserts(make_code):
+            start = time.perf_counter()
+            for _ in range(args.sample):
+                with db.engine.begin() as conn:
+                    conn.execute(insert(table).values(
+                        original_url='https://example.com/', short_code=make_code(conn),
+                        user_id=user_id, access_count=0))
+            return args.sample / (time.perf_counter() - start)
+
+        size = 0
+        step = args.rows // args.checkpoints
+        print(f"{'rows':>10} {'legacy ins/s':>14} {'allocator ins/s':>16}")
+        for checkpoint in range(1, args.checkpoints + 1):
+            while size < step * checkpoint:
+                chunk = min(50000, step * checkpoint - size)
+                with db.engine.begin() as conn:
+                    conn.execute(insert(table), [
+                        {'original_url': 'https://example.com/', 'short_code': code,
+                         'user_id': user_id, 'access_count': 0}
+                        for code in code_allocator.allocate_many(chunk)])
+                size += chunk
+            legacy = timed_inserts(legacy_code)
+            allocated = timed_inserts(allocator_code)
+            size += 2 * args.sample
+            print(f'{size:>10} {legacy:>14.0f} {allocated:>16.0f}')
+
+
+if __name__ == '__main__':
+    main()
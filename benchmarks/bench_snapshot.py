@@ -0,0 +1,107 @@
+"""Measure the redirect snapshot: build time, size, lookup cost and serving through an outage.
+
+    python benchmarks/bench_snapshot.py --rows 1000000 --probes 200000
+
+Seeds --rows links, writes the snapshot the way `flask snapshot-links`
+does, then times lookups of random existing codes in the mapped file
+against the primary-key SELECT a cache miss otherwise costs. Finally
+redirects --outage-requests random codes with the URL cache cleared and
+the database unreachable (the SQLite file is moved away) and reports how
+many were still answered from the snapshot.
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from harness import seed  # noqa: E402
+
+
+def per_op(fn, probes):
+    start = time.perf_counter()
+    for code in probes:
+        fn(code)
+    return (time.perf_counter() - start) / len(probes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--probes', type=int, default=100000)
+    parser.add_argument('--outage-requests', type=int, default=1000)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    db_path = os.path.join(directory, 'bench.db')
+    snapshot_path = os.path.join(directory, 'redirects.snap')
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    os.environ['REDIRECT_SNAPSHOT_PATH'] = snapshot_path
+    os.environ.setdefault('SECRET_KEY', 'bench')
+    os.environ.setdefault('JWT_SECRET_KEY', 'bench-secret-key-of-sufficient-length')
+    os.environ['METRICS_ENABLED'] = 'false'
+    os.environ['RATELIMIT_ENABLED'] = 'false'
+    os.environ['CLICK_FLUSH_INTERVAL'] = '3600'
+    os.environ['ANALYTICS_ENABLED'] = 'false'
+
+    from sqlalchemy import bindparam, select
+    from app import create_app, db, redirect_snapshot, url_cache
+    from app.models import ShortURL
+    from app.snapshot import SnapshotFile, export_links
+
+    app = create_app()
+    logging.getLogger().setLevel(logging.ERROR)
+    _, codes = seed(app, 10, args.rows)
+
+    with app.app_context(), db.engine.connect() as conn:
+        start = time.perf_counter()
+        count = export_links(conn, snapshot_path)
+        build = time.perf_counter() - start
+    size = os.path.getsize(snapshot_path)
+    print(f"snapshot: {count} links in {build:.2f} s, {size / 2 ** 20:.1f} MiB "
+          f"({size / max(count, 1):.0f} bytes per link)")
+
+    rng = random.Random(42)
+    probes = [rng.choice(codes) for _ in range(args.probes)]
+    snapshot = SnapshotFile(snapshot_path)
+    lookup = per_op(snapshot.find, probes)
+    absent = per_op(snapshot.find, [code[::-1] + 'x' for code in probes[:10000]])
+
+    table = ShortURL.__table__
+    lookup_stmt = select(table.c.original_url, table.c.expires_at).where(
+        table.c.short_code == bindparam('code'))
+    with app.app_context(), db.engine.connect() as conn:
+        query = per_op(lambda code: conn.execute(lookup_stmt, {'code': code}).first(),
+                       probes[:min(len(probes), 20000)])
+    print(f"{'snapshot hit':>16}: {lookup * 1e9:10.0f} ns/op")
+    print(f"{'snapshot miss':>16}: {absent * 1e9:10.0f} ns/op")
+    print(f"{'database query':>16}: {query * 1e9:10.0f} ns/op  ({query / lookup:.0f}x)")
+
+    client = app.test_client()
+    outage = [rng.choice(codes) for _ in range(args.outage_requests)]
+    # Map the file while the database is still there, as a running worker would have
+    client.get(f'/{outage[0]}')
+    redirect_snapshot.refresh()
+    with app.app_context():
+        db.engine.dispose()
+    os.rename(db_path, db_path + '.away')
+    os.mkdir(db_path)
+    url_cache.clear()
+    statuses = {}
+    start = time.perf_counter()
+    for code in outage:
+        status = client.get(f'/{code}').status_code
+        statuses[status] = statuses.get(status, 0) + 1
+    elapsed = time.perf_counter() - start
+    os.rmdir(db_path)
+    os.rename(db_path + '.away', db_path)
+    print(f"database down: {statuses.get(302, 0)}/{len(outage)} redirects served from the snapshot "
+          f"({elapsed / len(outage) * 1000:.2f} ms each), statuses {dict(sorted(statuses.items()))}")
+
+
+if __name__ == '__main__':
+    main()
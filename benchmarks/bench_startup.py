@@ -0,0 +1,55 @@
+"""Measure worker cold-start time: importing the app package plus create_app.
+
+    python benchmarks/bench_startup.py --runs 10 [--database-url URL]
+
+Every run is a fresh interpreter, like a newly forked gunicorn worker
+without preload_app, so import and factory costs are both included.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import logging, time
+start = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+create_app()
+done = time.perf_counter()
+print({"import": imported - start, "create_app": done - imported})
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--database-url', default=None)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env['DATABASE_URL'] = args.database_url or 'sqlite:///' + os.path.join(
+        tempfile.mkdtemp(), 'startup.db')
+    env.setdefault('SECRET_KEY', 'bench')
+    env.setdefault('JWT_SECRET_KEY', 'bench')
+
+    samples = []
+    for _ in range(args.runs):
+        out = subprocess.run(
+            [sys.executable, '-c', CHILD], cwd=ROOT, env=env,
+            capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(out.strip().splitlines()[-1].replace("'", '"')))
+
+    for key in ('import', 'create_app'):
+        values = [sample[key] * 1000 for sample in samples]
+        print(f'{key:>10}: median {statistics.median(values):7.1f} ms  '
+              f'max {max(values):7.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
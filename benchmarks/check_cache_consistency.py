@@ -0,0 +1,187 @@
+"""Check the two-tier URL cache: stampede coalescing and consistency under updates.
+
+    python benchmarks/check_cache_consistency.py
+    python benchmarks/check_cache_consistency.py --backend redis://localhost:6379/15 --grace 0.1
+
+Simulates --workers gunicorn workers, each with its own URLCache, sharing
+one L2 backend (an in-process MemoryBackend by default). The database is
+a dict of versioned URLs whose loads are counted and deliberately slow.
+
+1. Stampede: --threads threads per worker miss on the same code at once;
+   exactly one load may reach the database.
+2. Concurrent updates: writers bump a code's version and then invalidate
+   it through a random worker, as update_short_url does, while readers go
+   through random workers. A read that starts after an invalidation has
+   returned (plus --grace for pub/sub delivery) must not see an older
+   version, and once writers stop every worker must serve the latest one.
+
+Exits non-zero if either check fails.
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.cache import MISSING, URLCache  # noqa: E402
+from app.cache_backends import MemoryBackend, RedisBackend  # noqa: E402
+
+
+class FakeDatabase:
+    def __init__(self, codes, latency):
+        self.latency = latency
+        self.versions = {code: 0 for code in codes}
+        self.lock = threading.Lock()
+        self.loads = 0
+
+    def load(self, code):
+        with self.lock:
+            self.loads += 1
+            version = self.versions.get(code)
+        # The value is read before the delay, like a query whose result
+        # arrives after a concurrent update has committed
+        time.sleep(self.latency)
+        return MISSING if version is None else f'https://example.com/{code}?v={version}'
+
+    def update(self, code):
+        with self.lock:
+            self.versions[code] += 1
+            return self.versions[code]
+
+
+def version_of(value):
+    return int(value.rsplit('=', 1)[1])
+
+
+def build_workers(args, prefix):
+    """--workers caches on a fresh backend, subscribed before use"""
+    if args.backend == 'memory':
+        backend = MemoryBackend()
+    else:
+        backend = RedisBackend(args.backend, args.socket_timeout)
+    workers = []
+    for _ in range(args.workers):
+        cache = URLCache()
+        cache.maxsize, cache.ttl, cache.negative_ttl = 10000, 300, 30
+        cache.coalesce_timeout = 2.0
+        cache.use_backend(backend, prefix)
+        workers.append(cache)
+    # Let the Redis listener confirm its subscriptions, as workers' would
+    # have long before their first invalidation
+    backend.ensure_listening()
+    if args.backend != 'memory':
+        time.sleep(0.5)
+    return workers
+
+
+def check_stampede(args):
+    db = FakeDatabase(['viral'], latency=0.05)
+    workers = build_workers(args, f'check:{os.getpid()}:stampede:')
+    barrier = threading.Barrier(args.workers * args.threads)
+    results = []
+
+    def reader(cache):
+        barrier.wait()
+        results.append(cache.get_or_load('viral', lambda: db.load('viral')))
+
+    threads = [threading.Thread(target=reader, args=(cache,))
+               for cache in workers for _ in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    coalesced = sum(cache.coalesced for cache in workers)
+    ok = db.loads == 1 and len(set(results)) == 1 and len(results) == len(threads)
+    print(f"stampede     {len(threads)} concurrent misses -> {db.loads} load(s), "
+          f"{coalesced} coalesced  {'ok' if ok else 'FAILED'}")
+    return ok
+
+
+def check_updates(args):
+    codes = [f'c{i}' for i in range(args.codes)]
+    db = FakeDatabase(codes, latency=0.002)
+    workers = build_workers(args, f'check:{os.getpid()}:updates:')
+    settled = {code: (0, 0.0) for code in codes}
+    settled_lock = threading.Lock()
+    stop = threading.Event()
+    stale = []
+    reads = 0
+
+    def writer(seed):
+        rng = random.Random(seed)
+        while not stop.is_set():
+            code = rng.choice(codes)
+            version = db.update(code)
+            rng.choice(workers).invalidate(code)
+            with settled_lock:
+                if version > settled[code][0]:
+                    settled[code] = (version, time.monotonic())
+            time.sleep(rng.uniform(0, 0.01))
+
+    def reader(seed):
+        nonlocal reads
+        rng = random.Random(seed)
+        while not stop.is_set():
+            code = rng.choice(codes)
+            started = time.monotonic()
+            with settled_lock:
+                version, settled_at = settled[code]
+            value = rng.choice(workers).get_or_load(code, lambda: db.load(code))
+            reads += 1
+            if version_of(value) < version and started - settled_at > args.grace:
+                stale.append((code, version_of(value), version))
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(args.writers)]
+    threads += [threading.Thread(target=reader, args=(1000 + i,)) for i in range(args.readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    time.sleep(args.grace)
+
+    diverged = []
+    for code in codes:
+        expected = db.versions[code]
+        for index, cache in enumerate(workers):
+            value = cache.get_or_load(code, lambda: db.load(code))
+            if version_of(value) != expected:
+                diverged.append((index, code, version_of(value), expected))
+
+    updates = sum(db.versions.values())
+    ok = not stale and not diverged
+    print(f"updates      {updates} updates, {reads} reads, {db.loads} loads, "
+          f"{len(stale)} stale reads after invalidation  {'ok' if not stale else 'FAILED'}")
+    print(f"final state  {len(diverged)} of {len(codes) * len(workers)} worker entries "
+          f"behind the database  {'ok' if not diverged else 'FAILED'}")
+    for index, code, seen, expected in diverged[:10]:
+        print(f"  worker {index} serves {code} v{seen}, database has v{expected}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', default='memory', help='memory or a redis:// URL')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--threads', type=int, default=8, help='stampede threads per worker')
+    parser.add_argument('--codes', type=int, default=20)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=3.0)
+    parser.add_argument('--socket-timeout', type=float, default=0.25)
+    parser.add_argument('--grace', type=float, default=0.0,
+                        help='seconds allowed for an invalidation to reach other workers')
+    args = parser.parse_args()
+
+    ok = check_stampede(args)
+    ok = check_updates(args) and ok
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
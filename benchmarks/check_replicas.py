@@ -0,0 +1,149 @@
+"""Check read-replica routing, read-your-writes and failover.
+
+    python benchmarks/check_replicas.py
+    python benchmarks/check_replicas.py --primary postgresql://localhost/primary \
+        --replica postgresql://localhost/replica1 --replica postgresql://localhost/replica2
+
+Uses independent databases as stand-ins for a primary and its replicas
+(two throwaway SQLite files by default) and "replicates" by copying the
+primary's rows into every replica, so anything written after a copy is
+exactly what a lagging replica would be missing.
+
+1. Round-robin: read-only views spread over every replica.
+2. Read-your-writes: right after creating a link, its owner's listing
+   shows it although no replica has it; without the mark, the listing
+   comes from a replica and does not.
+3. Redirects: a code a replica does not have yet falls back to the
+   primary, and a code just updated is read from the primary.
+4. Failover: with a replica unreachable, views still answer (retried on
+   the primary), the replica is marked unhealthy, and a health check
+   brings it back once it is reachable again.
+
+Exits non-zero if any check fails.
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PASSWORD = 'check-password-1'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--primary', default=None)
+    parser.add_argument('--replica', action='append', default=None)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    primary = args.primary or f'sqlite:///{directory}/primary.db'
+    replica_urls = args.replica or [f'sqlite:///{directory}/replica{i}.db' for i in (1, 2)]
+    os.environ['DATABASE_URL'] = primary
+    os.environ['DATABASE_REPLICA_URLS'] = ','.join(replica_urls)
+    os.environ['REPLICA_HEALTH_INTERVAL'] = '0.1'
+    os.environ.setdefault('SECRET_KEY', 'check')
+    os.environ.setdefault('JWT_SECRET_KEY', 'check-secret-key-of-sufficient-length')
+    os.environ['RATELIMIT_ENABLED'] = 'false'
+    os.environ['CACHE_BACKEND'] = ''
+
+    from sqlalchemy import create_engine, delete, insert, select
+    from app import create_app, db, replicas, url_cache
+
+    app = create_app()
+    logging.getLogger().setLevel(logging.ERROR)
+    tables = db.metadata.sorted_tables
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        for replica in replicas.replicas:
+            db.metadata.drop_all(replica.engine)
+            db.metadata.create_all(replica.engine)
+
+    def replicate():
+        with app.app_context(), db.engine.connect() as source:
+            rows = {table: source.execute(select(table)).mappings().all() for table in tables}
+        for replica in replicas.replicas:
+            with replica.engine.begin() as target:
+                for table in reversed(tables):
+                    target.execute(delete(table))
+                for table in tables:
+                    if rows[table]:
+                        target.execute(insert(table), [dict(row) for row in rows[table]])
+
+    client = app.test_client()
+    client.post('/auth/register', json={'email': 'check@example.com', 'password': PASSWORD,
+                                        'username': 'check'})
+    token = client.post('/auth/login', json={'email': 'check@example.com',
+                                             'password': PASSWORD}).get_json()['access_token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    def shorten(url):
+        return client.post('/api/shorten', json={'url': url}, headers=headers).get_json()['short_code']
+
+    def listing():
+        response = client.get('/api/api/user/urls', headers=headers)
+        assert response.status_code == 200, response.get_data(as_text=True)
+        return {item['short_code'] for item in response.get_json()['urls']}
+
+    failures = []
+
+    def check(name, ok, detail=''):
+        print(f"[{' ok ' if ok else 'FAIL'}] {name}" + (f"  ({detail})" if detail else ''))
+        if not ok:
+            failures.append(name)
+
+    old_code = shorten('https://example.com/old')
+    replicate()
+    replicas._sticky.clear()
+
+    reads = [replica.reads for replica in replicas.replicas]
+    for _ in range(4 * len(replicas.replicas)):
+        listing()
+    spread = [replica.reads - before for replica, before in zip(replicas.replicas, reads)]
+    check('round-robin', all(spread), f'reads per replica {spread}')
+
+    new_code = shorten('https://example.com/new')
+    check('read-your-writes', new_code in listing())
+    replicas._sticky.clear()
+    check('replica read without the mark', new_code not in listing(), 'replica is behind, as expected')
+
+    url_cache.invalidate(new_code)
+    response = client.get(f'/{new_code}')
+    check('redirect of a code the replica lacks', response.headers.get('Location') == 'https://example.com/new',
+          f'{response.status_code} {response.headers.get("Location")}')
+
+    client.put(f'/api/api/url/{old_code}', json={'url': 'https://example.com/updated'}, headers=headers)
+    response = client.get(f'/{old_code}')
+    check('redirect of a code just updated', response.headers.get('Location') == 'https://example.com/updated',
+          f'{response.status_code} {response.headers.get("Location")}')
+
+    broken = replicas.replicas[0]
+    working_engine = broken.engine
+    broken.engine = create_engine(f'sqlite:///{directory}/missing/replica.db')
+    replicas._sticky.clear()
+    statuses = []
+    for _ in range(2 * len(replicas.replicas)):
+        response = client.get('/api/api/user/urls', headers=headers)
+        response.get_data()  # the listing streams; finish it before the next request
+        statuses.append(response.status_code)
+    check('views answer with a replica down', set(statuses) == {200}, f'statuses {sorted(set(statuses))}')
+    time.sleep(0.3)
+    check('failed replica marked unhealthy', not broken.healthy)
+
+    broken.engine = working_engine
+    time.sleep(0.3)
+    check('replica back after a health check', broken.healthy)
+
+    print(f"primary reads by reason: {replicas.stats()['primary_reads']}")
+    if failures:
+        print(f"Failed: {', '.join(failures)}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
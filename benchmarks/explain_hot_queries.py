@@ -0,0 +1,103 @@
+"""Check that the hot short_url queries are served by an index.
+
+    python benchmarks/explain_hot_queries.py [--database-url URL]
+
+Runs EXPLAIN for the redirect, details, listing and dedup lookups, the
+expired-link purge, the tag lookup, the link search variants and the
+redirect snapshot's delta poll against a freshly migrated database and
+exits non-zero if any of them falls back to a full table scan.
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select  # noqa: E402
+
+
+def explain(conn, stmt):
+    compiled = stmt.compile(dialect=conn.dialect, compile_kwargs={'render_postcompile': True})
+    sql = str(compiled)
+    params = compiled.construct_params()
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    if conn.dialect.name == 'sqlite':
+        rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + sql, params).all()
+        plan = '\n'.join(row[-1] for row in rows)
+        # An FTS5 match shows up as SCAN ... VIRTUAL TABLE INDEX
+        full_scan = any(line.startswith('SCAN') and 'USING' not in line
+                        and 'VIRTUAL TABLE INDEX' not in line for line in plan.splitlines())
+    else:
+        # Tiny tables make the planner prefer seq scans, so ask whether an
+        # index path exists at all
+        conn.exec_driver_sql('SET LOCAL enable_seqscan = off')
+        rows = conn.exec_driver_sql('EXPLAIN ' + sql, params).all()
+        plan = '\n'.join(row[0] for row in rows)
+        full_scan = 'Seq Scan on short_url' in plan
+    return plan, full_scan
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default=None)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'explain.db')
+    os.environ['DATABASE_URL'] = args.database_url or f'sqlite:///{db_path}'
+    os.environ.setdefault('SECRET_KEY', 'bench')
+    os.environ.setdefault('JWT_SECRET_KEY', 'bench')
+
+    from flask_migrate import upgrade
+    from app import create_app, db
+    from app.models import LinkTag, ShortURL, Tag
+    from app.search import search_links
+
+    app = create_app()
+    logging.getLogger('sqlalchemy.engine').setLevel(logging.WARNING)
+    dialect = 'postgresql' if os.environ['DATABASE_URL'].startswith('postgres') else 'sqlite'
+    columns = (ShortURL.id, ShortURL.short_code)
+
+    queries = {
+        'redirect': select(ShortURL.original_url, ShortURL.expires_at).where(
+            ShortURL.short_code == 'abc123'),
+        'details': select(ShortURL).where(
+            ShortURL.short_code == 'abc123', ShortURL.user_id == 1),
+        'listing': select(ShortURL.id, ShortURL.short_code).where(
+            ShortURL.user_id == 1, ShortURL.id > 100).order_by(ShortURL.id).limit(101),
+        'dedup': select(ShortURL.short_code).where(
+            ShortURL.user_id == 1, ShortURL.url_hash == bytes(16)),
+        'purge': select(ShortURL.id).where(
+            ShortURL.expires_at <= datetime(2026, 1, 1)).limit(1000),
+        'link tags': select(LinkTag.link_id, Tag.name).join(Tag, Tag.id == LinkTag.tag_id).where(
+            LinkTag.link_id.in_([1, 2, 3])),
+        'search tags': search_links(columns, dialect, 1, tag_ids=[1, 2], limit=101),
+        'search text': search_links(columns, dialect, 1, q='github release', limit=101),
+        'search title': search_links(columns, dialect, 1, title='Git', limit=101),
+        'search url': search_links(columns, dialect, 1, url='https://github.com/', limit=101),
+        'snapshot delta': select(ShortURL.short_code, ShortURL.original_url, ShortURL.expires_at,
+                                 ShortURL.updated_at).where(ShortURL.updated_at >= datetime(2026, 1, 1)),
+        'filter refresh': select(ShortURL.short_code).where(ShortURL.updated_at >= datetime(2026, 1, 1)),
+    }
+
+    failed = []
+    with app.app_context():
+        upgrade(directory=os.path.join(os.path.dirname(__file__), '..', 'migrations'))
+        with db.engine.begin() as conn:
+            for name, stmt in queries.items():
+                plan, full_scan = explain(conn, stmt)
+                print(f"[{'SCAN' if full_scan else ' ok '}] {name}\n    "
+                      + plan.replace('\n', '\n    '))
+                if full_scan:
+                    failed.append(name)
+
+    if failed:
+        print(f"Full table scans in: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+"""Load-test the hot endpoints and save the results as JSON.
+
+    python benchmarks/harness.py --users 50 --links 20000 --requests 2000
+    python benchmarks/harness.py --gunicorn --workers 4 --concurrency 16
+    python benchmarks/harness.py --database-url postgresql://localhost/bench
+
+Builds the app through create_app against a throwaway SQLite file (or
+--database-url), seeds users and links, then drives redirect, shorten,
+list and login. By default requests go through the Flask test client,
+which also counts DB queries per request; with --gunicorn a local
+gunicorn is started and driven over HTTP. Each scenario reports p50, p95
+and p99 latency and requests per second, and the whole run is written to
+--output for comparison against earlier runs.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PASSWORD = 'bench-password'
+SCENARIOS = ('redirect', 'shorten', 'list', 'login')
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def seed(app, users, links):
+    """Create users and links; returns (emails, short_codes)"""
+    from sqlalchemy import insert
+    from app import db, code_allocator, password_hasher
+    from app.models import User, ShortURL
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        password_hash = password_hasher.hash(PASSWORD)
+        emails = [f'user{i}@bench.local' for i in range(users)]
+        db.session.execute(insert(User.__table__), [
+            {'email': email, 'username': email.split('@')[0],
+             'password_hash': password_hash}
+            for email in emails])
+        db.session.commit()
+        user_ids = [row[0] for row in db.session.query(User.id).all()]
+
+        codes = []
+        for start in range(0, links, 10000):
+            chunk = code_allocator.allocate_many(min(10000, links - start))
+            db.session.execute(insert(ShortURL.__table__), [
+                {'original_url': f'https://example.com/{start + i}', 'short_code': code,
+                 'user_id': user_ids[(start + i) % len(user_ids)]}
+                for i, code in enumerate(chunk)])
+            codes.extend(chunk)
+            # The allocator leases codes on its own connection, which an
+            # open write transaction would lock out on SQLite
+            db.session.commit()
+    return emails, codes
+
+
+class TestClientDriver:
+    """Drives the app in-process and counts queries per request"""
+
+    def __init__(self, app):
+        from sqlalchemy import event
+        from app import db
+
+        self.app = app
+        self.local = threading.local()
+        with app.app_context():
+            engine = db.engine
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def count_query(*args):
+            self.local.queries = getattr(self.local, 'queries', 0) + 1
+
+    def session(self):
+        return self.app.test_client()
+
+    def request(self, client, method, path, **kwargs):
+        self.local.queries = 0
+        response = client.open(path, method=method, **kwargs)
+        body = response.get_data()
+        return response.status_code, body, self.local.queries
+
+
+class HTTPDriver:
+    """Drives a running server over HTTP with one keep-alive session per thread"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    def session(self):
+        import requests
+        return requests.Session()
+
+    def request(self, client, method, path, json=None, headers=None):
+        response = client.request(method, self.base_url + path, json=json,
+                                  headers=headers, allow_redirects=False)
+        return response.status_code, response.content, None
+
+
+def start_gunicorn(env, workers, worker_class):
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-k', worker_class,
+         '-b', f'127.0.0.1:{port}', '--log-level', 'warning', 'app:create_app()'],
+        cwd=ROOT, env=env)
+    base_url = f'http://127.0.0.1:{port}'
+    import requests
+    for _ in range(100):
+        try:
+            if requests.get(base_url + '/healthz', timeout=5).status_code == 200:
+                return process, base_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError('gunicorn did not become healthy')
+
+
+def run_scenario(driver, name, make_request, total, concurrency):
+    samples = []
+    errors = []
+    lock = threading.Lock()
+    per_thread = [total // concurrency + (1 if i < total % concurrency else 0)
+                  for i in range(concurrency)]
+
+    def worker(count, seed_value):
+        rng = random.Random(seed_value)
+        client = driver.session()
+        local = []
+        local_errors = 0
+        for _ in range(count):
+            method, path, kwargs, expected = make_request(rng, client)
+            start = time.perf_counter()
+            status, _, queries = driver.request(client, method, path, **kwargs)
+            local.append((time.perf_counter() - start, queries))
+            if status != expected:
+                local_errors += 1
+        with lock:
+            samples.extend(local)
+            errors.append(local_errors)
+
+    threads = [threading.Thread(target=worker, args=(count, i)) for i, count in enumerate(per_thread)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(sample[0] * 1000 for sample in samples)
+    queries = [sample[1] for sample in samples if sample[1] is not None]
+    return {
+        'scenario': name,
+        'requests': len(samples),
+        'errors': sum(errors),
+        'rps': len(samples) / elapsed if elapsed else None,
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'queries_per_request': sum(queries) / len(queries) if queries else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--links', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=1000, help='per scenario')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--database-url', default=None)
+    parser.add_argument('--bcrypt-rounds', type=int, default=4,
+                        help='work factor for seeded passwords and login')
+    parser.add_argument('--gunicorn', action='store_true', help='drive a local gunicorn over HTTP')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--worker-class', default='sync')
+    parser.add_argument('--output', default='bench_output.json')
+    args = parser.parse_args()
+
+    env = os.environ
+    env['DATABASE_URL'] = args.database_url or 'sqlite:///' + os.path.join(
+        tempfile.mkdtemp(), 'harness.db')
+    env.setdefault('SECRET_KEY', 'bench')
+    env.setdefault('JWT_SECRET_KEY', 'bench-secret-key-of-sufficient-length')
+    env['BCRYPT_LOG_ROUNDS'] = str(args.bcrypt_rounds)
+    env['RATELIMIT_ENABLED'] = 'false'  # one client sends everything
+
+    from flask_jwt_extended import create_access_token
+    from app import create_app
+    from app.models import User
+
+    app = create_app()
+    logging.getLogger().setLevel(logging.WARNING)
+    emails, codes = seed(app, args.users, args.links)
+    with app.app_context():
+        user_ids = [row[0] for row in User.query.with_entities(User.id).all()]
+        tokens = [create_access_token(identity=user_id) for user_id in user_ids]
+
+    server = None
+    if args.gunicorn:
+        server, base_url = start_gunicorn(dict(env), args.workers, args.worker_class)
+        driver = HTTPDriver(base_url)
+    else:
+        driver = TestClientDriver(app)
+
+    def auth(rng):
+        return {'Authorization': 'Bearer ' + rng.choice(tokens)}
+
+    requests_by_scenario = {
+        'redirect': lambda rng, client: ('GET', '/' + rng.choice(codes), {}, 302),
+        'shorten': lambda rng, client: (
+            'POST', '/api/shorten',
+            {'json': {'url': f'https://example.org/{rng.random()}'}, 'headers': auth(rng)}, 201),
+        'list': lambda rng, client: ('GET', '/api/api/user/urls?limit=100', {'headers': auth(rng)}, 200),
+        'login': lambda rng, client: (
+            'POST', '/auth/login',
+            {'json': {'email': rng.choice(emails), 'password': PASSWORD}}, 200),
+    }
+
+    results = []
+    try:
+        for name in args.scenarios:
+            result = run_scenario(driver, name, requests_by_scenario[name],
+                                  args.requests, args.concurrency)
+            results.append(result)
+            qpr = result['queries_per_request']
+            print(f"{name:>9}: {result['rps']:8.1f} req/s  p50 {result['p50_ms']:7.2f} ms  "
+                  f"p95 {result['p95_ms']:7.2f} ms  p99 {result['p99_ms']:7.2f} ms  "
+                  f"queries/req {'-' if qpr is None else f'{qpr:.2f}'}  errors {result['errors']}")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'timestamp': datetime.utcnow().isoformat(),
+            'mode': 'gunicorn' if args.gunicorn else 'test_client',
+            'python': platform.python_version(),
+            'database': env['DATABASE_URL'].split(':', 1)[0],
+            'params': vars(args),
+            'results': results
+        }, f, indent=2)
+    print(f'Results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
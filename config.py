@@ -9,4 +9,136 @@ class Config:  # Class name should be capitalized (Config, not config)
     GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_CLIENT_ID')
     GOOGLE_CLIENT_SECRET = os.environ.get('GOOGLE_CLIENT_SECRET')
     GOOGLE_DISCOVERY_URL = "https://accounts.google.com/.well-known/openid-configuration"
-    SHORT_DOMAIN = os.environ.get('SHORT_DOMAIN', 'http://localhost:5000')
\ No newline at end of file
+    SHORT_DOMAIN = os.environ.get('SHORT_DOMAIN', 'http://localhost:5000')
+    SQLALCHEMY_ECHO = os.environ.get('SQLALCHEMY_ECHO', 'false').lower() in ('1', 'true', 'yes')
+
+    # Connection pool: DB_POOL_PROFILE is one of sync, gevent, pgbouncer
+    # (NullPool). The numeric settings override the profile's defaults.
+    DB_POOL_PROFILE = os.environ.get('DB_POOL_PROFILE', 'sync')
+    DB_POOL_SIZE = os.environ.get('DB_POOL_SIZE')
+    DB_MAX_OVERFLOW = os.environ.get('DB_MAX_OVERFLOW')
+    DB_POOL_TIMEOUT = os.environ.get('DB_POOL_TIMEOUT')  # seconds
+    DB_POOL_RECYCLE = os.environ.get('DB_POOL_RECYCLE', 1800)  # seconds
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+
+    # Read replicas: comma-separated URLs for read-only views and redirect
+    # lookups (empty: everything on the primary). Pools use the DB_POOL_* settings.
+    DATABASE_REPLICA_URLS = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+                             if url.strip()]
+    REPLICA_HEALTH_INTERVAL = float(os.environ.get('REPLICA_HEALTH_INTERVAL', 5.0))  # seconds
+    REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', 10.0))  # seconds, Postgres only; 0 disables
+    REPLICA_STICKY_SECONDS = float(os.environ.get('REPLICA_STICKY_SECONDS', 10.0))  # reads on the primary after a write
+
+    # Redirect cache (per worker, in front of the shared tier)
+    URL_CACHE_SIZE = int(os.environ.get('URL_CACHE_SIZE', 10000))
+    URL_CACHE_TTL = int(os.environ.get('URL_CACHE_TTL', 300))  # seconds
+    URL_CACHE_NEGATIVE_TTL = int(os.environ.get('URL_CACHE_NEGATIVE_TTL', 30))
+    URL_CACHE_L2_TTL = int(os.environ.get('URL_CACHE_L2_TTL', 3600))  # seconds
+
+    # Shared cache tier: empty for per-worker caches only, memory, or a redis:// URL
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', '')
+    # Without CACHE_BACKEND an update or delete clears only the handling worker's
+    # cache, so every per-worker TTL is capped at this
+    CACHE_LOCAL_TTL = int(os.environ.get('CACHE_LOCAL_TTL', 5))  # seconds
+    CACHE_KEY_PREFIX = os.environ.get('CACHE_KEY_PREFIX', 'shortener:')
+    CACHE_COALESCE_TIMEOUT = float(os.environ.get('CACHE_COALESCE_TIMEOUT', 0.5))  # seconds to wait on another load
+    CACHE_SOCKET_TIMEOUT = float(os.environ.get('CACHE_SOCKET_TIMEOUT', 0.25))  # seconds, then L1 only for 1s
+
+    # Buffered click counting
+    CLICK_FLUSH_INTERVAL = float(os.environ.get('CLICK_FLUSH_INTERVAL', 5.0))  # seconds
+    CLICK_FLUSH_MAX_PENDING = int(os.environ.get('CLICK_FLUSH_MAX_PENDING', 1000))  # distinct codes
+
+    # Short code allocation
+    SHORT_CODE_LENGTH = int(os.environ.get('SHORT_CODE_LENGTH', 6))  # 3 to 8
+    SHORT_CODE_BLOCK_SIZE = int(os.environ.get('SHORT_CODE_BLOCK_SIZE', 1000))
+    SHORT_CODE_SCRAMBLE = os.environ.get('SHORT_CODE_SCRAMBLE', 'true').lower() in ('1', 'true', 'yes')
+    SHORT_CODE_SECRET = os.environ.get('SHORT_CODE_SECRET')  # defaults to SECRET_KEY
+
+    # Bulk shortening
+    BATCH_SHORTEN_MAX = int(os.environ.get('BATCH_SHORTEN_MAX', 10000))
+
+    # Reuse a user's existing link for the same destination; requests can
+    # override this with "dedupe" in the body or ?dedupe= in the query string
+    DEDUPE_URLS = os.environ.get('DEDUPE_URLS', 'false').lower() in ('1', 'true', 'yes')
+
+    # URL listing pagination
+    USER_URLS_PAGE_SIZE = int(os.environ.get('USER_URLS_PAGE_SIZE', 100))
+    USER_URLS_MAX_PAGE_SIZE = int(os.environ.get('USER_URLS_MAX_PAGE_SIZE', 1000))
+    MAX_TAGS_PER_LINK = int(os.environ.get('MAX_TAGS_PER_LINK', 10))
+
+    # Streaming export of a user's links (GET /api/api/user/urls/export)
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))  # rows per fetch from the cursor
+    EXPORT_GZIP_LEVEL = int(os.environ.get('EXPORT_GZIP_LEVEL', 6))  # 0 never compresses
+
+    # Purge of expired links and orphaned click data (`flask purge-expired`)
+    PURGE_BATCH_SIZE = int(os.environ.get('PURGE_BATCH_SIZE', 1000))  # rows per DELETE
+    PURGE_PAUSE = float(os.environ.get('PURGE_PAUSE', 0.05))  # seconds between batches
+
+    # Click analytics
+    ANALYTICS_ENABLED = os.environ.get('ANALYTICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    ANALYTICS_QUEUE_SIZE = int(os.environ.get('ANALYTICS_QUEUE_SIZE', 10000))
+    ANALYTICS_BATCH_SIZE = int(os.environ.get('ANALYTICS_BATCH_SIZE', 500))
+    ANALYTICS_FLUSH_INTERVAL = float(os.environ.get('ANALYTICS_FLUSH_INTERVAL', 2.0))  # seconds
+    GEOIP_DB_PATH = os.environ.get('GEOIP_DB_PATH')  # GeoLite2-Country.mmdb, needs geoip2
+
+    # Authentication hot path
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 30))  # seconds
+    USER_CACHE_L2_TTL = int(os.environ.get('USER_CACHE_L2_TTL', 300))  # seconds
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))  # hashes are upgraded on login
+    BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS', 2))
+    BCRYPT_MAX_PENDING = int(os.environ.get('BCRYPT_MAX_PENDING', 16))
+    BCRYPT_TIMEOUT = float(os.environ.get('BCRYPT_TIMEOUT', 10))  # seconds
+
+    # Instrumentation exposed at /metrics
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    QUERY_BUDGET = int(os.environ.get('QUERY_BUDGET', 10))  # warn above this many queries per request
+
+    # Redirect caching (Cache-Control on /<short_code>)
+    REDIRECT_MAX_AGE = int(os.environ.get('REDIRECT_MAX_AGE', 0))  # 0 = revalidate every click
+    REDIRECT_PERMANENT_MAX_AGE = int(os.environ.get('REDIRECT_PERMANENT_MAX_AGE', 0))  # >0 = 301s
+
+    # Memory-mapped redirect snapshot written by `flask snapshot-links` (empty disables).
+    # fallback: served only when the database fails; first: cache misses it can
+    # answer never reach the database
+    REDIRECT_SNAPSHOT_PATH = os.environ.get('REDIRECT_SNAPSHOT_PATH', '')
+    REDIRECT_SNAPSHOT_MODE = os.environ.get('REDIRECT_SNAPSHOT_MODE', 'fallback')
+    REDIRECT_SNAPSHOT_REFRESH = float(os.environ.get('REDIRECT_SNAPSHOT_REFRESH', 5.0))  # seconds
+    REDIRECT_SNAPSHOT_MARGIN = float(os.environ.get('REDIRECT_SNAPSHOT_MARGIN', 60.0))  # seconds of delta overlap
+
+    # Reverse proxies (Nginx, a CDN) in front of the app: how many X-Forwarded-For
+    # entries to trust for the client address that per-IP limits and GeoIP use.
+    # 0 uses the connecting peer's address; set it to the number of proxy hops
+    PROXY_FIX_X_FOR = int(os.environ.get('PROXY_FIX_X_FOR', 0))
+
+    # Rate limits as "count/period" (second, minute, hour, day); empty disables one.
+    # RATELIMIT_<NAME>_PER_<IP|USER|ACCOUNT|ENDPOINT>. Buckets are per worker
+    # unless RATELIMIT_STORAGE is a redis:// URL shared by every worker
+    RATELIMIT_ENABLED = os.environ.get('RATELIMIT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    RATELIMIT_STORAGE = os.environ.get('RATELIMIT_STORAGE', '')
+    RATELIMIT_MAX_KEYS = int(os.environ.get('RATELIMIT_MAX_KEYS', 100000))  # per worker
+    RATELIMIT_SHORTEN_PER_USER = os.environ.get('RATELIMIT_SHORTEN_PER_USER', '60/minute')
+    RATELIMIT_SHORTEN_PER_IP = os.environ.get('RATELIMIT_SHORTEN_PER_IP', '120/minute')
+    RATELIMIT_SHORTEN_PER_ENDPOINT = os.environ.get('RATELIMIT_SHORTEN_PER_ENDPOINT', '')
+    # Counted in URLs; a batch may hold no more than the smallest of these allows at once
+    RATELIMIT_SHORTEN_BATCH_PER_USER = os.environ.get('RATELIMIT_SHORTEN_BATCH_PER_USER', '10000/hour')
+    RATELIMIT_SHORTEN_BATCH_PER_IP = os.environ.get('RATELIMIT_SHORTEN_BATCH_PER_IP', '20000/hour')
+    RATELIMIT_LOGIN_PER_IP = os.environ.get('RATELIMIT_LOGIN_PER_IP', '20/minute')
+    RATELIMIT_LOGIN_PER_ACCOUNT = os.environ.get('RATELIMIT_LOGIN_PER_ACCOUNT', '10/minute')
+    RATELIMIT_LOGIN_PER_ENDPOINT = os.environ.get('RATELIMIT_LOGIN_PER_ENDPOINT', '')
+    RATELIMIT_REGISTER_PER_IP = os.environ.get('RATELIMIT_REGISTER_PER_IP', '10/hour')
+    RATELIMIT_REGISTER_PER_ENDPOINT = os.environ.get('RATELIMIT_REGISTER_PER_ENDPOINT', '')
+    RATELIMIT_REDIRECT_PER_IP = os.environ.get('RATELIMIT_REDIRECT_PER_IP', '')
+    RATELIMIT_EXPORT_PER_USER = os.environ.get('RATELIMIT_EXPORT_PER_USER', '10/hour')
+
+    # Bloom filter of existing short codes, rejects probes without a query
+    BLOOM_FILTER_ENABLED = os.environ.get('BLOOM_FILTER_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    BLOOM_FILTER_CAPACITY = int(os.environ.get('BLOOM_FILTER_CAPACITY', 1000000))
+    BLOOM_FILTER_ERROR_RATE = float(os.environ.get('BLOOM_FILTER_ERROR_RATE', 0.001))
+    BLOOM_FILTER_REFRESH_INTERVAL = float(os.environ.get('BLOOM_FILTER_REFRESH_INTERVAL', 2))  # seconds
+    BLOOM_FILTER_REBUILD_INTERVAL = int(os.environ.get('BLOOM_FILTER_REBUILD_INTERVAL', 3600))  # seconds
+    # Each poll re-reads this far back; longer than the slowest insert transaction
+    BLOOM_FILTER_MARGIN = float(os.environ.get('BLOOM_FILTER_MARGIN', 60))  # seconds
+    BLOOM_FILTER_PATH = os.environ.get('BLOOM_FILTER_PATH')  # shared mmap file for all workers on a host
+    # Without CACHE_BACKEND, trust BLOOM_FILTER_PATH to hear of every new code: no other host creates any
+    BLOOM_FILTER_SINGLE_HOST = os.environ.get('BLOOM_FILTER_SINGLE_HOST', 'false').lower() in ('1', 'true', 'yes')
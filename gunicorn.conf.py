@@ -0,0 +1,117 @@
+"""Gunicorn settings for production, picked up from the working directory:
+
+    gunicorn                              # GUNICORN_PROFILE=gthread by default
+    GUNICORN_PROFILE=gevent gunicorn      # needs `pip install gevent psycogreen`
+
+GUNICORN_PROFILE chooses the worker model:
+
+    sync     one request at a time per worker; CPU-bound work, simplest
+    gthread  a few threads per worker; the default, overlaps database waits
+    gevent   many greenlets per worker; slow clients and long exports
+
+Each profile sets defaults for GUNICORN_WORKERS, GUNICORN_THREADS and
+GUNICORN_WORKER_CONNECTIONS, and the matching DB_POOL_PROFILE. Explicit
+environment variables win.
+
+The app is imported and built once in the master (preload_app), then
+workers are forked from it, so code, config and the app object live in
+pages the workers share copy-on-write. The master freezes its objects
+out of the garbage collector before forking, so collections in a worker
+do not write to (and un-share) those pages. Anything holding a
+connection or a thread is reset after the fork: engine pools are
+disposed without closing the parent's sockets, and the click, analytics,
+filter, cache and snapshot threads start lazily in each worker. A worker
+that exits flushes its pending clicks and analytics events first.
+"""
+import gc
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROFILES = {
+    'sync': {'worker_class': 'sync', 'workers': 2 * multiprocessing.cpu_count() + 1,
+             'threads': 1, 'db_pool_profile': 'sync'},
+    'gthread': {'worker_class': 'gthread', 'workers': multiprocessing.cpu_count() + 1,
+                'threads': 4, 'db_pool_profile': 'sync'},
+    'gevent': {'worker_class': 'gevent', 'workers': multiprocessing.cpu_count(),
+               'threads': 1, 'db_pool_profile': 'gevent'},
+}
+
+profile_name = os.environ.get('GUNICORN_PROFILE', 'gthread')
+if profile_name not in PROFILES:
+    raise RuntimeError(f"Unknown GUNICORN_PROFILE '{profile_name}', expected one of {', '.join(PROFILES)}")
+profile = PROFILES[profile_name]
+
+if profile_name == 'gevent':
+    # Patch before the app is preloaded, so its locks, sockets and threads are cooperative
+    try:
+        from gevent import monkey
+    except ImportError:
+        raise RuntimeError("GUNICORN_PROFILE=gevent needs gevent (pip install gevent psycogreen)")
+    monkey.patch_all()
+    try:
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    except ImportError:  # optional: psycopg2 calls block the worker without it
+        pass
+
+# Read by config.Config when the app is preloaded below
+os.environ.setdefault('DB_POOL_PROFILE', profile['db_pool_profile'])
+
+wsgi_app = 'run:app'
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+worker_class = profile['worker_class']
+workers = int(os.environ.get('GUNICORN_WORKERS', profile['workers']))
+threads = int(os.environ.get('GUNICORN_THREADS', profile['threads']))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))  # gevent only
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+# Large exports stream for as long as they take; raise this if yours run longer
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))  # seconds; behind a proxy that reuses connections
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))  # recycle workers after this many; 0 never
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 0))
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG') or None  # '-' for stdout
+# The app trusts X-Forwarded-For from PROXY_FIX_X_FOR proxies; trust their
+# X-Forwarded-Proto as well. Narrow it to the proxies' addresses if the
+# workers can also be reached directly
+forwarded_allow_ips = os.environ.get(
+    'GUNICORN_FORWARDED_ALLOW_IPS', '*' if int(os.environ.get('PROXY_FIX_X_FOR', 0)) else '127.0.0.1')
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def when_ready(server):
+    # Runs in the master once the app is loaded and before any worker forks
+    if preload_app:
+        gc.collect()
+        gc.freeze()
+    server.log.info(f"Gunicorn profile {profile_name}: {workers} {worker_class} workers"
+                    + (f" x {threads} threads" if worker_class == 'gthread' else '')
+                    + (', app preloaded' if preload_app else ''))
+
+
+def post_fork(server, worker):
+    from app import db, replicas
+    from run import app
+
+    # Connections opened by the master (e.g. by migrations or checks at import)
+    # belong to it; close=False drops them from this pool without closing them
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    replicas.dispose(close=False)
+
+
+def worker_exit(server, worker):
+    from app import click_buffer, click_analytics
+
+    # Graceful exits only; a worker killed for timing out loses what it held
+    pending = click_buffer.stats()['pending_clicks']
+    queued = click_analytics.stats()['queued']
+    click_buffer.shutdown()
+    click_analytics.shutdown()
+    if pending or queued:
+        server.log.info(f"Worker {worker.pid} flushed {pending} clicks and {queued} analytics events")
@@ -0,0 +1,47 @@
+"""short_url indexes, wider code/url columns and last_accessed
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 09:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('short_url', schema=None) as batch_op:
+        batch_op.alter_column('short_code',
+               existing_type=sa.String(length=6),
+               type_=sa.String(length=8),
+               existing_nullable=False)
+        batch_op.alter_column('original_url',
+               existing_type=sa.String(length=512),
+               type_=sa.String(length=2048),
+               existing_nullable=False)
+        batch_op.add_column(sa.Column('last_accessed', sa.DateTime(), nullable=True))
+        batch_op.create_index('ix_short_url_user_id_id', ['user_id', 'id'], unique=False)
+        batch_op.create_index('ix_short_url_original_url', ['original_url'], unique=False,
+                              postgresql_using='hash')
+
+
+def downgrade():
+    with op.batch_alter_table('short_url', schema=None) as batch_op:
+        batch_op.drop_index('ix_short_url_original_url', postgresql_using='hash')
+        batch_op.drop_index('ix_short_url_user_id_id')
+        batch_op.drop_column('last_accessed')
+        batch_op.alter_column('original_url',
+               existing_type=sa.String(length=2048),
+               type_=sa.String(length=512),
+               existing_nullable=False)
+        batch_op.alter_column('short_code',
+               existing_type=sa.String(length=8),
+               type_=sa.String(length=6),
+               existing_nullable=False)
@@ -0,0 +1,55 @@
+"""click events and per-minute/per-day rollups
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('click_event',
+    sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), nullable=False),
+    sa.Column('occurred_at', sa.DateTime(), nullable=False),
+    sa.Column('short_code', sa.String(length=8), nullable=False),
+    sa.Column('referrer_host', sa.String(length=255), nullable=True),
+    sa.Column('user_agent_family', sa.String(length=32), nullable=True),
+    sa.Column('country', sa.String(length=2), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('click_event', schema=None) as batch_op:
+        batch_op.create_index('ix_click_event_occurred_at', ['occurred_at'], unique=False,
+                              postgresql_using='brin')
+        batch_op.create_index('ix_click_event_short_code_occurred_at', ['short_code', 'occurred_at'], unique=False)
+
+    op.create_table('click_stat_minute',
+    sa.Column('short_code', sa.String(length=8), nullable=False),
+    sa.Column('bucket', sa.DateTime(), nullable=False),
+    sa.Column('clicks', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('short_code', 'bucket')
+    )
+    op.create_table('click_stat_day',
+    sa.Column('short_code', sa.String(length=8), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('clicks', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('short_code', 'day')
+    )
+
+
+def downgrade():
+    op.drop_table('click_stat_day')
+    op.drop_table('click_stat_minute')
+    with op.batch_alter_table('click_event', schema=None) as batch_op:
+        batch_op.drop_index('ix_click_event_short_code_occurred_at')
+        batch_op.drop_index('ix_click_event_occurred_at', postgresql_using='brin')
+
+    op.drop_table('click_event')
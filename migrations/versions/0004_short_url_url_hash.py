@@ -0,0 +1,34 @@
+"""short_url.url_hash for per-user dedup of destinations
+
+Replaces the hash index on original_url, which only dedup lookups used,
+with a unique (user_id, url_hash) index over a 16-byte digest.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 11:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('short_url', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('url_hash', sa.LargeBinary(length=16), nullable=True))
+        batch_op.drop_index('ix_short_url_original_url', postgresql_using='hash')
+        batch_op.create_index('ix_short_url_user_id_url_hash', ['user_id', 'url_hash'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('short_url', schema=None) as batch_op:
+        batch_op.drop_index('ix_short_url_user_id_url_hash')
+        batch_op.create_index('ix_short_url_original_url', ['original_url'], unique=False,
+                              postgresql_using='hash')
+        batch_op.drop_column('url_hash')
@@ -0,0 +1,52 @@
+"""short_url.expires_at, and ON DELETE CASCADE from user to short_url
+
+Adds the link expiry column with a partial index for the purge job, and
+replaces the unnamed user_id foreign key with a named one that cascades,
+so deleting a user deletes its links in the database.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 13:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+# Lets batch mode on SQLite name the foreign key 0001 created without one
+NAMING_CONVENTION = {'fk': 'fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s'}
+
+
+def _user_fk_name():
+    # Postgres named it short_url_user_id_fkey when 0001 ran
+    if op.get_bind().dialect.name == 'postgresql':
+        return 'short_url_user_id_fkey'
+    return 'fk_short_url_user_id_user'
+
+
+def upgrade():
+    old_fk = _user_fk_name()
+    with op.batch_alter_table('short_url', schema=None,
+                              naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.add_column(sa.Column('expires_at', sa.DateTime(), nullable=True))
+        batch_op.create_index('ix_short_url_expires_at', ['expires_at'], unique=False,
+                              postgresql_where=sa.text('expires_at IS NOT NULL'),
+                              sqlite_where=sa.text('expires_at IS NOT NULL'))
+        batch_op.drop_constraint(old_fk, type_='foreignkey')
+        batch_op.create_foreign_key('fk_short_url_user_id_user', 'user', ['user_id'], ['id'],
+                                    ondelete='CASCADE')
+
+
+def downgrade():
+    with op.batch_alter_table('short_url', schema=None,
+                              naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.drop_constraint('fk_short_url_user_id_user', type_='foreignkey')
+        batch_op.create_foreign_key(_user_fk_name(), 'user', ['user_id'], ['id'])
+        batch_op.drop_index('ix_short_url_expires_at')
+        batch_op.drop_column('expires_at')
@@ -0,0 +1,155 @@
+"""tag / link_tag tables replace short_url.tags; full-text and prefix search indexes
+
+Existing comma-joined tags are split, normalized (trimmed, lower-case,
+single spaces, at most 32 characters) and moved into per-user tag rows
+before the column is dropped. Search objects are dialect specific:
+pg_trgm and a tsvector GIN index on Postgres, an FTS5 table with sync
+triggers and lower() expression indexes on SQLite.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17 14:30:00.000000
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+POSTGRES_SEARCH = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX ix_short_url_search ON short_url USING gin "
+    "((to_tsvector('simple', coalesce(title, '') || ' ' || original_url)))",
+    "CREATE INDEX ix_short_url_title_trgm ON short_url USING gin (title gin_trgm_ops)",
+    "CREATE INDEX ix_short_url_original_url_trgm ON short_url USING gin (original_url gin_trgm_ops)",
+)
+
+SQLITE_SEARCH = (
+    "CREATE INDEX ix_short_url_user_id_title_lower ON short_url (user_id, lower(title))",
+    "CREATE INDEX ix_short_url_user_id_url_lower ON short_url (user_id, lower(original_url))",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS short_url_fts USING fts5("
+    "title, original_url, content='short_url', content_rowid='id')",
+    "CREATE TRIGGER short_url_fts_insert AFTER INSERT ON short_url BEGIN "
+    "INSERT INTO short_url_fts(rowid, title, original_url) "
+    "VALUES (new.id, new.title, new.original_url); END",
+    "CREATE TRIGGER short_url_fts_delete AFTER DELETE ON short_url BEGIN "
+    "INSERT INTO short_url_fts(short_url_fts, rowid, title, original_url) "
+    "VALUES ('delete', old.id, old.title, old.original_url); END",
+    "CREATE TRIGGER short_url_fts_update AFTER UPDATE OF title, original_url ON short_url BEGIN "
+    "INSERT INTO short_url_fts(short_url_fts, rowid, title, original_url) "
+    "VALUES ('delete', old.id, old.title, old.original_url); "
+    "INSERT INTO short_url_fts(rowid, title, original_url) "
+    "VALUES (new.id, new.title, new.original_url); END",
+    "INSERT INTO short_url_fts(short_url_fts) VALUES ('rebuild')",
+)
+
+SQLITE_DROP_SEARCH = (
+    "DROP TRIGGER IF EXISTS short_url_fts_update",
+    "DROP TRIGGER IF EXISTS short_url_fts_delete",
+    "DROP TRIGGER IF EXISTS short_url_fts_insert",
+    "DROP TABLE IF EXISTS short_url_fts",
+    "DROP INDEX IF EXISTS ix_short_url_user_id_url_lower",
+    "DROP INDEX IF EXISTS ix_short_url_user_id_title_lower",
+)
+
+POSTGRES_DROP_SEARCH = (
+    "DROP INDEX IF EXISTS ix_short_url_original_url_trgm",
+    "DROP INDEX IF EXISTS ix_short_url_title_trgm",
+    "DROP INDEX IF EXISTS ix_short_url_search",
+)
+
+WHITESPACE = re.compile(r'\s+')
+
+
+def _move_tags(bind, chunk_size=1000):
+    short_url = sa.table('short_url', sa.column('id'), sa.column('user_id'), sa.column('tags'))
+    tag = sa.table('tag', sa.column('id'), sa.column('user_id'), sa.column('name'))
+    link_tag = sa.table('link_tag', sa.column('tag_id'), sa.column('link_id'))
+    tag_ids = {}
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(short_url.c.id, short_url.c.user_id, short_url.c.tags)
+            .where(short_url.c.id > last_id, short_url.c.tags.isnot(None), short_url.c.tags != '')
+            .order_by(short_url.c.id).limit(chunk_size)).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        pairs = set()
+        for row in rows:
+            for name in row.tags.split(','):
+                name = WHITESPACE.sub(' ', name).strip().lower()[:32]
+                if name:
+                    pairs.add((row.id, row.user_id, name))
+        new_tags = {(user_id, name) for _, user_id, name in pairs} - set(tag_ids)
+        for user_id, name in sorted(new_tags):
+            tag_ids[(user_id, name)] = bind.execute(
+                sa.insert(tag).values(user_id=user_id, name=name).returning(tag.c.id)).scalar()
+        if pairs:
+            bind.execute(sa.insert(link_tag), [
+                {'tag_id': tag_ids[(user_id, name)], 'link_id': link_id}
+                for link_id, user_id, name in sorted(pairs)])
+
+
+def upgrade():
+    op.create_table('tag',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=32), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], name='fk_tag_user_id_user', ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('tag', schema=None) as batch_op:
+        batch_op.create_index('ix_tag_user_id_name', ['user_id', 'name'], unique=True)
+
+    op.create_table('link_tag',
+    sa.Column('tag_id', sa.Integer(), nullable=False),
+    sa.Column('link_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['link_id'], ['short_url.id'], name='fk_link_tag_link_id_short_url',
+                            ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['tag_id'], ['tag.id'], name='fk_link_tag_tag_id_tag', ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('tag_id', 'link_id')
+    )
+    with op.batch_alter_table('link_tag', schema=None) as batch_op:
+        batch_op.create_index('ix_link_tag_link_id', ['link_id'], unique=False)
+
+    bind = op.get_bind()
+    _move_tags(bind)
+
+    # A plain ALTER TABLE DROP COLUMN (SQLite 3.35+) keeps the table, and
+    # with it link_tag's rows, instead of rebuilding it
+    op.drop_column('short_url', 'tags')
+
+    for statement in POSTGRES_SEARCH if bind.dialect.name == 'postgresql' else SQLITE_SEARCH:
+        op.execute(statement)
+
+
+def downgrade():
+    bind = op.get_bind()
+    for statement in POSTGRES_DROP_SEARCH if bind.dialect.name == 'postgresql' else SQLITE_DROP_SEARCH:
+        op.execute(statement)
+
+    op.add_column('short_url', sa.Column('tags', sa.String(length=200), nullable=True))
+    short_url = sa.table('short_url', sa.column('id'), sa.column('tags'))
+    names = {}
+    for link_id, name in bind.execute(sa.text(
+            'SELECT link_tag.link_id, tag.name FROM link_tag JOIN tag ON tag.id = link_tag.tag_id '
+            'ORDER BY link_tag.link_id, tag.name')):
+        names.setdefault(link_id, []).append(name)
+    for link_id, tags in names.items():
+        bind.execute(sa.update(short_url).where(short_url.c.id == link_id)
+                     .values(tags=','.join(tags)[:200]))
+
+    with op.batch_alter_table('link_tag', schema=None) as batch_op:
+        batch_op.drop_index('ix_link_tag_link_id')
+    op.drop_table('link_tag')
+    with op.batch_alter_table('tag', schema=None) as batch_op:
+        batch_op.drop_index('ix_tag_user_id_name')
+    op.drop_table('tag')
@@ -0,0 +1,26 @@
+"""Index on short_url.updated_at for the redirect snapshot's delta
+
+Every worker polls for links updated since its snapshot was taken, so
+the lookup has to be a short range scan rather than a table scan.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17 16:20:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_short_url_updated_at', 'short_url', ['updated_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_short_url_updated_at', table_name='short_url')
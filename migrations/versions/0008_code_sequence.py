@@ -0,0 +1,35 @@
+"""code_sequence table for the short code allocator
+
+Split out of the initial revision, which describes the schema of
+databases created before migrations existed: those are stamped at 0001
+and never had this table. Databases that ran an earlier 0001 already
+have it, so it is only created when missing.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if 'code_sequence' in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table('code_sequence',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('next_value', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('code_sequence')